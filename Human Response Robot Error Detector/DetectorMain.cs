@@ -18,6 +18,10 @@ namespace HumanResponseRobotDetector
     {
         // Indicator of whether the robot is moving
         public static double isMoving = 0;
+        // Whether the arm is moving as measured from the robot's feedback (motionMonitor.py), -1 until it is first heard from
+        public static double isArmMoving = -1;
+        // Whether the social signal ML (connectML.py) has published its readiness heartbeat, no AUs are sent to it before
+        public static bool isDetectorReady = false;
         // Indicator of whether to use of social signal modeling error detection (true for yes)
         public static bool isActiveDetection = false;
         // Indicator of whether potential error detected and robot is querying
@@ -46,13 +50,22 @@ namespace HumanResponseRobotDetector
                 var commandWriter = new NetMQWriter<string>(p, "commands", "tcp://XXX.XXX.X.XX:X", MessagePackFormat.Instance);
                 // Initialize bridging to python for social signal ML
                 // Local IP
-                var AUWriter = new NetMQWriter<double[]>(p, "AUs Intensities", "tcp://XXX.X.X.X:X", MessagePackFormat.Instance);
+                // The AUs chosen from the two cameras go on "AUs Intensities", the AUs of each camera with its face detection confidence
+                // on "AUs Camera1" and "AUs Camera2" for the camera fusion of the social signal ML (connectML.py --fuse-cameras)
+                var AUWriter = new NetMQWriter(p, "tcp://XXX.X.X.X:X", MessagePackFormat.Instance);
+                var chosenAUReceiver = AUWriter.AddTopic<double[]>("AUs Intensities");
+                var camera1AUReceiver = AUWriter.AddTopic<double[]>("AUs Camera1");
+                var camera2AUReceiver = AUWriter.AddTopic<double[]>("AUs Camera2");
 
                 // Initialize bridging back from machine running the robot to psi
                 var robotDoneSource = new NetMQSource<bool>(p, "isDone", "tcp://XXX.XXX.X.XX:X", MessagePackFormat.Instance);
+                // Initialize bridging of the arm motion measured by the robot controller (connectPsiRobot.py --motion-output)
+                var armMovingSource = new NetMQSource<bool>(p, "robotMoving", "tcp://XXX.XXX.X.XX:X", MessagePackFormat.Instance);
                 // Initialize bridging back from social signal ML to psi
                 // Local IP
                 var errorTimestepSource = new NetMQSource<string>(p, "isNewError", "tcp://XXX.X.X.X:X", MessagePackFormat.Instance);
+                // Initialize bridging of the readiness heartbeat of the social signal ML (same address as isNewError)
+                var detectorReadySource = new NetMQSource<double>(p, "detectorReady", "tcp://XXX.X.X.X:X", MessagePackFormat.Instance);
 
                 // Kinect Camera 1
                 var cam = new AzureKinectSensor(p, new AzureKinectSensorConfiguration()
@@ -98,8 +111,9 @@ namespace HumanResponseRobotDetector
                 var justAudio = camWithAudio.Select(m => { var (aud, img) = m; return aud; });
                 justAudio.Write("Audio", store);
 
-                // Create robot moving stream so can sync ml to it
-                var tempStream = Generators.Repeat(p, 0, TimeSpan.FromTicks(80000)).Select(m => { return isMoving; });
+                // Create robot moving stream so can sync ml to it. Follows the measured arm motion once the
+                // robot controller publishes it, otherwise whether a command is being executed
+                var tempStream = Generators.Repeat(p, 0, TimeSpan.FromTicks(80000)).Select(m => { return isArmMoving >= 0 ? isArmMoving : isMoving; });
                 var robotVideoSyncedStream = tempStream.Join(camWithAudio, RelativeTimeInterval.Past());
                 var robotMovingStream = robotVideoSyncedStream.Select(m => { var (move, aud, img) = m; return move; });
                 robotMovingStream.Write("robotMoving", store);
@@ -172,8 +186,30 @@ namespace HumanResponseRobotDetector
                     }
                     return vals;
                 });
-                // Pipe the AUs to the social signal ML algorithm for error detection
-                AUStream.PipeTo(AUWriter);
+                // Pipe the AUs to the social signal ML algorithm for error detection, once it is ready
+                detectorReadySource.Do(m =>
+                {
+                    if (!isDetectorReady)
+                    {
+                        Console.WriteLine("Social signal ML ready");
+                    }
+                    isDetectorReady = true;
+                });
+                AUStream.Where(m => isDetectorReady).PipeTo(chosenAUReceiver);
+                // AUs of each camera on its own, as robot moving, face detection confidence and the 17 AUs, joined to the
+                // originating time of the camera's frames so the ML can align the two cameras itself
+                var camera1AUStream = confidence.Join(AUs, RelativeTimeInterval.Past()).Join(robotMovingStream, RelativeTimeInterval.Past()).Select(m =>
+                {
+                    var (c, au, mov) = m;
+                    return new double[] { mov, c }.Concat(au.Values.Select(a => a.Item1)).ToArray();
+                });
+                var camera2AUStream = confidence2.Join(AUs2, RelativeTimeInterval.Past()).Join(robotMovingStream, RelativeTimeInterval.Past()).Select(m =>
+                {
+                    var (c, au, mov) = m;
+                    return new double[] { mov, c }.Concat(au.Values.Select(a => a.Item1)).ToArray();
+                });
+                camera1AUStream.Where(m => isDetectorReady).PipeTo(camera1AUReceiver);
+                camera2AUStream.Where(m => isDetectorReady).PipeTo(camera2AUReceiver);
 
                 // Output from the ML algorithm
                 var errorStringStream = errorTimestepSource.Out;
@@ -311,6 +347,8 @@ namespace HumanResponseRobotDetector
                 neededCommands.PipeTo(commandWriter);
 
                 // Output from robot controller of whether the robot is done moving in response to commands sent
+                armMovingSource.Do(m => { isArmMoving = m ? 1 : 0; });
+
                 robotDoneSource.Do((m, e) =>
                 {
                     // Check if done moving
@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+import wave
+
+# This file contains the player of the audio cues connectPsiRobot.py plays when an
+# error or a possible error is detected. The cue files are loaded once at startup
+# and played on a worker thread, so handling a command never waits for a clip to
+# be decoded or to finish. Cues are played one at a time in the order they were
+# asked for.
+#
+# Backends:
+# simpleaudio: decodes the cues into memory at startup and plays them from there.
+#   Needs simpleaudio, and pydub with ffmpeg for formats other than WAV (e.g. mp3).
+# playsound: plays the cue files with playsound. The file is decoded by playsound on
+#   every play, on the worker thread, which delays the cue.
+# file: appends a line per played cue to a log file, for headless runs
+# null: plays nothing, for tests
+# auto: simpleaudio if it is installed and every cue is a WAV file or pydub is
+#   installed, otherwise playsound
+
+backendNames = ["auto", "simpleaudio", "playsound", "file", "null"]
+
+def isWav(path):
+    return path.lower().endswith(".wav")
+
+class SimpleAudioBackend:
+    def __init__(self):
+        import simpleaudio
+        self.simpleaudio = simpleaudio
+
+    # This function decodes a cue file into memory. The output is what play() takes.
+    def load(self, path):
+        if isWav(path):
+            with wave.open(path, "rb") as file:
+                return (file.readframes(file.getnframes()), file.getnchannels(), file.getsampwidth(), file.getframerate())
+        from pydub import AudioSegment
+        clip = AudioSegment.from_file(path)
+        return (clip.raw_data, clip.channels, clip.sample_width, clip.frame_rate)
+
+    def play(self, name, cue):
+        frames, channels, sampleWidth, frameRate = cue
+        self.simpleaudio.play_buffer(frames, channels, sampleWidth, frameRate).wait_done()
+
+class PlaysoundBackend:
+    def __init__(self):
+        from playsound import playsound
+        self.playsound = playsound
+
+    def load(self, path):
+        return path
+
+    def play(self, name, cue):
+        self.playsound(cue)
+
+class FileBackend:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, path):
+        return path
+
+    def play(self, name, cue):
+        with open(self.path, "a") as file:
+            file.write("{},{},{}\n".format(time.time_ns(), name, cue))
+
+class NullBackend:
+    def load(self, path):
+        return path
+
+    def play(self, name, cue):
+        pass
+
+# This function creates a backend by name. cueFiles are the files it will play and
+# logPath is the log file of the file backend.
+def loadBackend(name, cueFiles, logPath=None):
+    if name == "auto":
+        try:
+            if not all(isWav(path) for path in cueFiles.values()):
+                import pydub
+            return SimpleAudioBackend()
+        except ImportError:
+            return PlaysoundBackend()
+    elif name == "simpleaudio":
+        return SimpleAudioBackend()
+    elif name == "playsound":
+        return PlaysoundBackend()
+    elif name == "file":
+        return FileBackend(logPath or "audioCues.log")
+    elif name == "null":
+        return NullBackend()
+    raise ValueError("unknown audio backend {}".format(name))
+
+class AudioCuePlayer:
+    # The inputs are the backend and a dict from cue name to file. Cues waiting to be
+    # played beyond maxPending are dropped.
+    def __init__(self, backend, cueFiles, maxPending=4):
+        self.backend = backend
+        self.cues = {name: backend.load(path) for name, path in cueFiles.items()}
+        self.pending = queue.Queue(maxPending)
+        # Cues played and dropped
+        self.played = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # This function asks for a cue to be played and returns straight away
+    def play(self, name):
+        try:
+            self.pending.put_nowait(name)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            name = self.pending.get()
+            if name is None:
+                break
+            try:
+                self.backend.play(name, self.cues[name])
+                self.played += 1
+            except Exception as e:
+                print("Audio cue {} failed: {}".format(name, e))
+
+    # This function stops the player once the cues already asked for are played
+    def stop(self):
+        self.pending.put(None)
+        self.thread.join()
@@ -0,0 +1,157 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import zmq
+import msgpack
+
+import latencyStats
+import motionMonitor
+
+# This program benchmarks the robot controller without the robot. It starts
+# connectPsiRobot.py against the simulated robot (--simulate, see kortexSimulator.py)
+# and stands in for PSI, sending it a scripted session of pipe requests. Some of the
+# picks are interrupted by an error, and some by a possible error that the
+# participant then rejects ("resume"). It reports the distributions of the time
+# from sending a command to its reply (for a pick that is not interrupted, the
+# robot being done; for an error, the recovery being done) and from
+# sending an error to the controller calling StopSequence, taken from the
+# controller's latency trace. For example:
+#   python benchmarkController.py --rounds 30 --config simulator.json
+
+# This function reads the controller's latency trace (see latencyTrace.py). The output
+# is a dict from originating time to a dict of stage to the time the message first
+# reached it.
+def readTrace(path):
+    marks = {}
+    with open(path) as file:
+        for line in file:
+            process, stage, originatingTime, timeNs = line.rstrip("\n").split(",")
+            messageMarks = marks.setdefault(int(originatingTime), {})
+            if stage not in messageMarks or int(timeNs) < messageMarks[stage]:
+                messageMarks[stage] = int(timeNs)
+    return marks
+
+def printDistribution(name, values):
+    if not values:
+        print("{:<28} {:>6}".format(name, 0))
+        return
+    print("{:<28} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(name, len(values),
+        sum(values) / len(values), latencyStats.percentile(values, 50), latencyStats.percentile(values, 95), max(values)))
+
+class ScriptedPsi:
+    def __init__(self, commandAddress, replyAddress):
+        context = zmq.Context.instance()
+        self.output = context.socket(zmq.PUB)
+        self.output.bind(commandAddress)
+        self.input = context.socket(zmq.SUB)
+        self.input.setsockopt_string(zmq.SUBSCRIBE, "isDone")
+        self.input.connect(replyAddress)
+        # Send times (time.perf_counter and time.time_ns) and kind of the commands
+        # sent, by originating time, and the reply times
+        self.sent = {}
+        self.replies = {}
+
+    # This function sends a command. kind is what it is reported as, the command by default.
+    def send(self, command, kind=None):
+        originatingTime = motionMonitor.originatingTimeNow()
+        self.sent[originatingTime] = (time.perf_counter(), time.time_ns(), kind or command)
+        self.output.send_multipart([b"commands", msgpack.dumps({u"message": command, u"originatingTime": originatingTime})])
+        return originatingTime
+
+    # This function collects replies until the one to originatingTime arrives or
+    # the timeout passes. The output is whether it arrived.
+    def waitReply(self, originatingTime, timeout):
+        end = time.perf_counter() + timeout
+        while originatingTime not in self.replies:
+            left = end - time.perf_counter()
+            if left <= 0 or not self.input.poll(left * 1000):
+                return False
+            [topic, payload] = self.input.recv_multipart()
+            reply = msgpack.unpackb(payload)
+            self.replies.setdefault(reply["originatingTime"], (time.perf_counter(), reply["message"]))
+        return True
+
+    # This function waits until the controller is ready, using "resume" (which is
+    # harmless when nothing is paused) as a ping
+    def waitReady(self, timeout):
+        end = time.perf_counter() + timeout
+        while time.perf_counter() < end:
+            if self.waitReply(self.send("resume"), 0.5):
+                self.sent.clear()
+                return True
+        return False
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, help="JSON config of the simulated robot (see kortexSimulator.py)", default="")
+    parser.add_argument("--rounds", type=int, help="pipe requests to send", default=20)
+    parser.add_argument("--error-every", type=int, help="every n-th pick is interrupted by an error", default=4)
+    parser.add_argument("--possible-every", type=int, help="every n-th pick is interrupted by a rejected possible error", default=5)
+    parser.add_argument("--interrupt-delay", type=float, help="seconds into a pick the error or possible error is sent", default=0.5)
+    parser.add_argument("--query-delay", type=float, help="seconds the participant takes to reject a possible error", default=0.5)
+    parser.add_argument("--timeout", type=float, help="seconds to wait for a reply", default=60.0)
+    parser.add_argument("--verbose", action="store_true", help="show the controller's output")
+    parser.add_argument("--profile", type=str, help="sequence profile file of the controller (a fresh one by default)")
+    parser.add_argument("--watchdog", type=str, help="watchdog action of the controller", default="flag")
+    parser.add_argument("--command-address", type=str, default="tcp://127.0.0.1:5590")
+    parser.add_argument("--reply-address", type=str, default="tcp://127.0.0.1:5591")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    tracePath = os.path.join(workDir, "robot.trace")
+    psi = ScriptedPsi(args.command_address, args.reply_address)
+    controller = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "connectPsiRobot.py"),
+        "--simulate", args.config, "--psi-input", args.command_address, "--psi-output", args.reply_address,
+        "--audio", "null", "--trace", tracePath, "--sequence-cache", os.path.join(workDir, "sequenceCache.json"),
+        "--profile", args.profile or os.path.join(workDir, "sequenceProfile.json"), "--watchdog", args.watchdog],
+        stdout=None if args.verbose else subprocess.DEVNULL)
+    try:
+        if not psi.waitReady(args.timeout):
+            print("The controller did not start")
+            return 1
+        errors = []
+        for i in range(args.rounds):
+            isInterrupted = (i + 1) % args.error_every == 0 or (i + 1) % args.possible_every == 0
+            pick = psi.send("yellow" if i % 2 == 0 else "green", "interrupted pick" if isInterrupted else "pick")
+            if (i + 1) % args.error_every == 0:
+                time.sleep(args.interrupt_delay)
+                errors.append(psi.send("error"))
+                psi.waitReply(errors[-1], args.timeout)
+            elif (i + 1) % args.possible_every == 0:
+                time.sleep(args.interrupt_delay)
+                psi.waitReply(psi.send("possible"), args.timeout)
+                time.sleep(args.query_delay)
+                psi.waitReply(psi.send("resume"), args.timeout)
+            psi.waitReply(pick, args.timeout)
+    finally:
+        # Interrupting the controller lets it write the rest of its trace
+        controller.send_signal(signal.SIGINT)
+        try:
+            controller.wait(10)
+        except subprocess.TimeoutExpired:
+            controller.kill()
+
+    marks = readTrace(tracePath) if os.path.exists(tracePath) else {}
+    latencies = {}
+    for originatingTime, (sendTime, sendTimeNs, kind) in psi.sent.items():
+        if originatingTime in psi.replies:
+            latencies.setdefault(kind, []).append((psi.replies[originatingTime][0] - sendTime) * 1000)
+    errorToStop = [(marks[originatingTime]["stopSequence"] - psi.sent[originatingTime][1]) / 1e6
+        for originatingTime in errors if "stopSequence" in marks.get(originatingTime, {})]
+
+    print("{:<28} {:>6} {:>10} {:>10} {:>10} {:>10}".format("ms", "count", "mean", "p50", "p95", "max"))
+    for kind in ["pick", "interrupted pick", "possible", "resume", "error"]:
+        printDistribution(kind + " to reply", latencies.get(kind, []))
+    printDistribution("error to StopSequence", errorToStop)
+    missing = [kind for originatingTime, (sendTime, sendTimeNs, kind) in psi.sent.items() if originatingTime not in psi.replies]
+    if missing:
+        print("No reply to {} commands: {}".format(len(missing), ", ".join(missing)))
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
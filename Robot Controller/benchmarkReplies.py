@@ -0,0 +1,50 @@
+import argparse
+import queue
+import time
+
+import replyDeduplicator
+
+# This program measures the cost of checking replies for duplicates as a session
+# goes on, for the bounded ReplyDeduplicator and for the unbounded queue scan
+# writeRobotDone used before. Every reply is checked twice, like a pick that gets
+# its reply from an error and again when its sequence aborts. For example:
+#   python benchmarkReplies.py --replies 1000000
+
+# This function checks the replies with the ReplyDeduplicator and prints the mean
+# cost per check of every block of replies
+def benchmarkDeduplicator(replies, block, capacity):
+    isWritten = replyDeduplicator.ReplyDeduplicator(capacity)
+    for start in range(0, replies, block):
+        begin = time.perf_counter()
+        for originatingTime in range(start, start + block):
+            isWritten.firstReply(originatingTime)
+            isWritten.firstReply(originatingTime)
+        elapsed = time.perf_counter() - begin
+        print("deduplicator {:>9} replies: {:.3f}us per check".format(start + block, elapsed / (2 * block) * 1e6))
+    print(isWritten.counters())
+
+# Same with the queue scan, which gets slower with every reply
+def benchmarkQueue(replies, block):
+    isWrittenQ = queue.Queue()
+    for start in range(0, replies, block):
+        begin = time.perf_counter()
+        for originatingTime in range(start, start + block):
+            for i in range(2):
+                if originatingTime not in isWrittenQ.queue:
+                    isWrittenQ.put(originatingTime)
+        elapsed = time.perf_counter() - begin
+        print("queue scan   {:>9} replies: {:.3f}us per check".format(start + block, elapsed / (2 * block) * 1e6))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replies", type=int, help="replies to send", default=1000000)
+    parser.add_argument("--block", type=int, help="replies per reported block", default=100000)
+    parser.add_argument("--capacity", type=int, help="replies the deduplicator remembers", default=4096)
+    parser.add_argument("--queue-replies", type=int, help="replies to send with the queue scan (it is quadratic)", default=20000)
+    args = parser.parse_args()
+
+    benchmarkDeduplicator(args.replies, args.block, args.capacity)
+    benchmarkQueue(args.queue_replies, min(args.block, args.queue_replies // 4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+
+import latencyTrace
+
+# This file contains the executor that runs the commands PSI sends to the robot
+# controller (connectPsiRobot.py) on one long-lived worker thread, so the receive
+# loop never blocks on the robot.
+#
+# Every command has a handler made of two parts:
+# preempt: optional, runs on the receive thread as soon as the command arrives.
+#   It is for the short RPCs that have to reach the robot before anything queued,
+#   e.g. pausing or stopping the sequence being played when an error is detected.
+#   It gets the command's originating time, the originating time of the command
+#   received before it and the time.perf_counter() time it was received at.
+# run: runs on the worker thread, in priority order and then in arrival order.
+#   It gets the command's originating time, the originating time of the command
+#   received before it and whatever preempt returned.
+# Handlers must not wait for a sequence on the worker except for short ones
+# (recovery). Long running sequences (picks) are started and handed to follow(),
+# which calls back on the worker when they end, so a "possible" or "error" is
+# never stuck behind a pick.
+
+# Priorities of the queued work, lower runs first
+PRIORITY_STOP = -1
+PRIORITY_ERROR = 0
+PRIORITY_SEQUENCE_END = 1
+PRIORITY_RESUME = 2
+PRIORITY_PICK = 3
+
+class CommandExecutor:
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        # Breaks priority ties in arrival order
+        self.order = itertools.count()
+        # Handlers by command: (priority, run, preempt)
+        self.handlers = {}
+        # Sequences being followed, as [deadline, future, onEnd]. Only used on the worker.
+        self.following = []
+        # Originating time of the previous command received
+        self.previousOriginatingTime = 0
+        # Seconds from receiving an "error" to reaching a step of handling it (e.g.
+        # the StopSequence call), by step
+        self.reactionTimes = collections.defaultdict(list)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    # This function registers the handler of a command
+    def register(self, command, priority, run, preempt=None):
+        self.handlers[command] = (priority, run, preempt)
+
+    def start(self):
+        self.thread.start()
+
+    # This function hands a received command to the executor. It is called on the
+    # receive thread. The inputs are the command, its originating time and the
+    # time.perf_counter() time it was received at.
+    def submit(self, command, originatingTime, receivedAt):
+        oldOrigTime = self.previousOriginatingTime
+        self.previousOriginatingTime = originatingTime
+        if command not in self.handlers:
+            print("Unknown command {}".format(command))
+            return
+        priority, run, preempt = self.handlers[command]
+        preempted = preempt(originatingTime, oldOrigTime, receivedAt) if preempt is not None else None
+        self.put(priority, self.execute, run, originatingTime, oldOrigTime, preempted)
+
+    def put(self, priority, function, *args):
+        self.queue.put((priority, next(self.order), function, args))
+
+    def execute(self, run, originatingTime, oldOrigTime, preempted):
+        latencyTrace.mark("threadStart", originatingTime)
+        run(originatingTime, oldOrigTime, preempted)
+
+    # This function records the reaction time to an error when it reaches a step of
+    # handling it. The inputs are the time the error was received at and the step.
+    def recordReaction(self, receivedAt, step="StopSequence"):
+        reactionTime = time.perf_counter() - receivedAt
+        self.reactionTimes[step].append(reactionTime)
+        print("Error to {}: {:.2f}ms".format(step, reactionTime * 1000))
+
+    # This function follows a started sequence. Called on the worker with the
+    # future of the sequence's end, it calls onEnd(True) on the worker when the
+    # sequence ends, or onEnd(False) if it has not ended after timeout seconds.
+    def follow(self, done, timeout, onEnd):
+        entry = [time.monotonic() + timeout, done, onEnd]
+        self.following.append(entry)
+        done.add_done_callback(lambda future: self.put(PRIORITY_SEQUENCE_END, self.end, entry, True))
+
+    def end(self, entry, ended):
+        if entry in self.following:
+            self.following.remove(entry)
+            entry[2](ended)
+
+    def run(self):
+        while True:
+            timeout = None
+            if self.following:
+                timeout = max(0.0, min(entry[0] for entry in self.following) - time.monotonic())
+            try:
+                priority, order, function, args = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                now = time.monotonic()
+                for entry in [entry for entry in self.following if entry[0] <= now]:
+                    self.end(entry, False)
+                continue
+            if function is None:
+                break
+            try:
+                function(*args)
+            except Exception as e:
+                print("Command failed: {}".format(e))
+
+    # This function stops the worker after the work it is running, dropping the
+    # rest of the queue
+    def stop(self):
+        self.put(PRIORITY_STOP, None)
+        self.thread.join()
+        for step, reactionTimes in self.reactionTimes.items():
+            print("Error to {} over {} errors: mean={:.2f}ms max={:.2f}ms".format(
+                step, len(reactionTimes), sum(reactionTimes) / len(reactionTimes) * 1000, max(reactionTimes) * 1000))
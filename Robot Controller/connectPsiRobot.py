@@ -1,12 +1,18 @@
 import zmq
 import msgpack
-import runSequence
 import time
 import sys
 import os
-import threading
-from playsound import playsound
-import queue
+import argparse
+
+import latencyTrace
+import runSequence
+import commandExecutor
+import replyDeduplicator
+import sequenceRegistry
+import motionMonitor
+import audioCues
+import sequenceProfiler
 
 from kortex_api.autogen.client_stubs.BaseClientRpc import BaseClient
 from kortex_api.autogen.client_stubs.BaseCyclicClientRpc import BaseCyclicClient
@@ -19,13 +25,9 @@ from kortex_api.autogen.messages import Session_pb2, Base_pb2, BaseCyclic_pb2
 # Connecting to PSI to receive commands (e.e., indicators for errors, object requests, query answers)
 input = zmq.Context().socket(zmq.SUB)
 input.setsockopt_string(zmq.SUBSCRIBE, "commands")
-# Fill in the X's for the appropriate IP address to communicate between PSI and this program
-input.connect("tcp://XXX.XXX.X.XX:X")
 
 # Connecting to PSI to send notification of whether the robot is moving
 output = zmq.Context().socket(zmq.PUB)
-# Fill in the X's for the appropriate IP address to communicate between PSI and this program
-output.bind("tcp://XXX.XXX.X.XX:X")
 
 # Counter for number of commands for yellow pipes
 yellowCount = 0
@@ -39,24 +41,28 @@ isErrorMissing = 0
 isYellowRecover = -1
 # Flag indicating if the recovery to the missing error has been executed
 isMissingRecover = -1
-# Queue logging the sent back to PSI
-isWrittenQ = queue.Queue()
-# Stores the originating time from the previous message sent from PSI
-oldOrigTime = 0
-# Separate thread to run the execution commands to the robot
-runRobotThread = threading.Thread()
+# Logs the replies sent back to PSI, bounded to the most recent ones
+isWritten = replyDeduplicator.ReplyDeduplicator()
 # Flag for whether a possible robot error has been detected
 isPossible = 0
+# Recovery sequence handle chosen while a possible error is queried, so a confirmed error can recover
+# straight away. None when there is no such plan.
+recoveryPlan = None
+# Originating times of the commands an error interrupted, whose reply (False) is sent by runError
+# and not when their sequence ends
+interruptedCommands = set()
 
 
 # This function reads in messages sent from PSI and outputs the command and the originating
 # that was sent through the message. This function is blocking.
 def readCommand():
     [topic, payload] = input.recv_multipart()
+    received = latencyTrace.now()
     message = msgpack.unpackb(payload, raw=True)
     command = message[b"message"]
     originatingTime = message[b"originatingTime"]
     command = command.decode('utf-8')
+    latencyTrace.mark("commandReceive", originatingTime, received)
     return (command, originatingTime)
 
 # This function sends a message to PSI indicating whether the robot is done executing a command
@@ -65,90 +71,243 @@ def readCommand():
 # originatingTime: Time recieved from the incoming message PSI sent that this one is replying to
 # In addition, it check to make sure that the message has not already been sent.
 def writeRobotDone(isDone, originatingTime):
-    # Checks if the reply message has already been sent
-    if originatingTime not in isWrittenQ.queue:
-        # Logs that the message has been replied to
-        isWrittenQ.put(originatingTime)
+    # Checks if the reply message has already been sent, and if not logs that it is being replied to
+    if isWritten.firstReply(originatingTime):
         # Send the message
         payload = {u"message": isDone, u"originatingTime": originatingTime}
         output.send_multipart(["isDone".encode(), msgpack.dumps(payload)])
+        latencyTrace.mark("robotDone", originatingTime)
 
 # This function loads all of the sequence handles for the pre-programmed robot actions from the
-# robot's computer into this program. The input is the base controller for the robot. The outputs
-# handles for the pick, error, and recovery sequences.
+# robot's computer into this program, or from the local cache of them (see sequenceRegistry.py).
+# The input is the base controller for the robot. The outputs handles for the pick, error, and
+# recovery sequences.
 def sequenceListing(base):
-    # Loads the list of pre-progammed sequences stored
-    sequenceList = base.ReadAllSequences()
-    retractIdx = 0
-    greenIdx = 0
-    yellowIdx = 0
-    missingIdx = 0
-    yErrIdx = 0
-    mRecoverIdx = 0
-    yCRecoverIdx = 0
-    yORecoverIdx = 0
-    gCRecoverIdx = 0
-    gORecoverIdx = 0
-    # Iterates through the pre-progammed sequence list
-    for i in range(len(sequenceList.sequence_list)):
-        seq = sequenceList.sequence_list[i]
-        # Checks if the name of the current sequence matches one needed for the task
-        if seq.name == "My Retract":
-            retractIdx = i
-        elif seq.name == "Green_PVC_Pick":
-            greenIdx = i
-        elif seq.name == "Yellow_PVC_Pick":
-            yellowIdx = i
-        elif seq.name == "Missing_Green_Error":
-            missingIdx = i
-        elif seq.name == "Missing_Recovery":
-            mRecoverIdx = i
-        elif seq.name == "Wrong_Y_Recovery_Close":
-            yCRecoverIdx = i
-        elif seq.name == "Wrong_Y_Recovery_Open":
-            yORecoverIdx = i
-        elif seq.name == "General_Recovery_Close":
-            gCRecoverIdx = i
-        elif seq.name == "General_Recovery_Open":
-            gORecoverIdx = i
-        elif seq.name == "Yellow_PVC_Error":
-            yErrIdx = i
-    retractHandle = sequenceList.sequence_list[retractIdx].handle
-    greenHandle = sequenceList.sequence_list[greenIdx].handle
-    yellowHandle = sequenceList.sequence_list[yellowIdx].handle
-    missingHandle = sequenceList.sequence_list[missingIdx].handle
-    mRecoverHandle = sequenceList.sequence_list[mRecoverIdx].handle
-    yCRecoverHandle = sequenceList.sequence_list[yCRecoverIdx].handle
-    yORecoverHandle = sequenceList.sequence_list[yORecoverIdx].handle
-    gCRecoverHandle = sequenceList.sequence_list[gCRecoverIdx].handle
-    gORecoverHandle = sequenceList.sequence_list[gORecoverIdx].handle
-    yErrHandle = sequenceList.sequence_list[yErrIdx].handle
-    return (retractHandle, greenHandle, yellowHandle, missingHandle, mRecoverHandle, yCRecoverHandle, gCRecoverHandle, gORecoverHandle, yORecoverHandle, yErrHandle)
-
-# This function sends the command to the robot to run the specified sequence and also send a message afterwards to PSI
-# that the execution is done. The inputs are:
-# base: Robot's computer client
-# base_cyclic: Robot's computer client that waits for a run sequence to be sent
-# commandHandle: Sequence handle for the sequence that needs to be executed by the robot
+    global sequenceNames
+    handles = sequenceRegistry.loadHandles(base, robotAddress, args.sequences, args.sequence_cache, args.refresh_sequences)
+    # Names of the sequences by handle identifier, for the profile
+    roles = sequenceRegistry.readConfig(args.sequences)
+    sequenceNames = {handles[role].identifier: roles[role] for role in handles}
+    return (handles["retract"], handles["green"], handles["yellow"], handles["missing"], handles["missingRecover"],
+        handles["yellowRecoverClose"], handles["generalRecoverClose"], handles["generalRecoverOpen"], handles["yellowRecoverOpen"],
+        handles["yellowError"])
+
+# The functions below handle the commands from PSI on the command executor (see commandExecutor.py).
+# The run functions run on the executor's worker thread, in priority order, and the preempt functions
+# run on the receive thread as soon as the command arrives.
+
+# This function starts the sequence for a pipe request and sends a message to PSI once the robot is
+# done executing it. The inputs are:
+# command: "yellow" or "green"
 # originatingTime: Command messages' originating time as sent by PSI
-def runRobotCommand(base, base_cyclic, commandHandle, originatingTime):
-    # Calls function to execute the robot sequence and returns value when done. This function is blocking.
-    isDone = runSequence.run_sequence(base, base_cyclic, commandHandle)
+def runPick(command, originatingTime):
+    global yellowCount, greenCount, isErrorYellow, isErrorMissing
+    # Checks if the command requests a yellow pipe
+    if command == "yellow":
+        # Sets the sequence handle to the sequence that retrieves the yellow pipe
+        commandHandle = yellowHandle
+        # Increases the yellow command count
+        yellowCount+=1
+    # Checks if the command requests a green pipe
+    else:
+        # Sets the sequence handle to the sequence that retrieves the green pipe
+        commandHandle = greenHandle
+        # Increases the green command count
+        greenCount+=1
+
+    # Manually pre-programmed error override statement for having the robot run the errors
+    # Checks if the yellow pipe command count is 9, if the error has already happened, and if it already
+    # has recovered from that error. Replaces the sequence handle with the corresponding error sequence handle
+    if yellowCount == 9 and isErrorYellow == 0 and isYellowRecover == -1:
+        isErrorYellow = 1
+        # Runs the wrong object error (grabbing green instead of yellow)
+        commandHandle = yErrHandle
+    # Checks if the green pipe command count is 10, if the error has already happened, and if it already
+    # has recovered from that error. Replaces the sequence handle with the corresponding error sequence handle
+    elif greenCount == 10 and isErrorMissing == 0 and isMissingRecover == -1:
+        isErrorMissing = 1
+        # Runs the missing error (failing to grab the pipe)
+        commandHandle = missingHandle
+
+    # Starts the sequence without waiting for it, so errors can be handled while the robot moves
+    done = runSequence.start_sequence(base, dispatcher, commandHandle, originatingTime)
+    print("Waiting for movement to finish ...")
+    executor.follow(done, runSequence.TIMEOUT_DURATION, lambda ended: pickEnded(ended, commandHandle, done, originatingTime))
+
+# This function is called on the executor when a pick sequence has ended (ended is True) or timed out
+# (ended is False). It sends the message to PSI that the execution is done.
+def pickEnded(ended, commandHandle, done, originatingTime):
+    if not ended:
+        dispatcher.forget(commandHandle, done)
+        print("Timeout on action notification wait")
+    # Checks if an error stopped the sequence, then runError replies that it is not done
+    if originatingTime in interruptedCommands:
+        interruptedCommands.discard(originatingTime)
+        return
     # Calls function to send response to command message stating execution is done.
-    writeRobotDone(isDone, originatingTime)
-    return
+    writeRobotDone(ended, originatingTime)
+
+# This function stops the robot as soon as an error is detected. The output is whether a possible error
+# was being queried when it arrived.
+def preemptError(originatingTime, oldOrigTime, receivedAt):
+    global isPossible
+    wasPossible = isPossible
+    # Marks the command the error interrupted before stopping it, so the end of its sequence does not
+    # reply that it is done before runError replies that it is not
+    if wasPossible == 0:
+        interruptedCommands.add(oldOrigTime)
+    # Checks if the error was detected using the implicit indicator (socials signal ml algorithm and domain-specific input)
+    if isPossible == 1:
+        base.ResumeSequence()
+        profiler.setPaused(False)
+        isPossible = 0
+
+    # Stops the current sequence
+    executor.recordReaction(receivedAt)
+    latencyTrace.mark("stopSequence", originatingTime)
+    base.StopSequence()
+    return (wasPossible, receivedAt)
+
+# This function checks if the gripper fingers are closed
+def isGripperClosed():
+    # Gets the current position of the gripper fingers
+    gripperMeasure = base.GetMeasuredGripperMovement(gripperRequest)
+    return len(gripperMeasure.finger) and (gripperMeasure.finger[0].value > 0.009)
+
+# This function chooses the recovery sequence for the current error. The output is its handle.
+def chooseRecovery():
+    # Checks if the error is the wrong object (yellow) error
+    if isErrorYellow == 1:
+        # Checks if the gripper is closed, to choose the appropriate recovery sequence
+        return yCRecoverHandle if isGripperClosed() else yORecoverHandle
+    # Checks if the error is failing to grab the pipe
+    elif isErrorMissing == 1:
+        return mRecoverHandle
+    # If error detected is neither, then robot executes a generic recovery, depending on whether the gripper is closed
+    else:
+        return gCRecoverHandle if isGripperClosed() else gORecoverHandle
+
+# This function recovers from an error after the robot was stopped
+def runError(originatingTime, oldOrigTime, preempted):
+    global isErrorYellow, isErrorMissing, isYellowRecover, isMissingRecover, recoveryPlan
+    wasPossible, receivedAt = preempted
+    # Checks if the error was detected using the explicit indicator
+    if wasPossible == 0:
+        # Calls function to send message stating robot is no longer moving
+        writeRobotDone(False, oldOrigTime)
+        interruptedCommands.discard(oldOrigTime)
+    # Plays the sound after error is detected, without waiting for it
+    cuePlayer.play("error")
+
+    # Uses the recovery chosen while the possible error was queried, otherwise chooses it now
+    recoveryHandle = recoveryPlan if wasPossible == 1 and recoveryPlan is not None else chooseRecovery()
+    recoveryPlan = None
+    # Sets that the error is being recovered from
+    if isErrorYellow == 1:
+        isErrorYellow = 0
+        isYellowRecover = 1
+    elif isErrorMissing == 1:
+        isErrorMissing = 0
+        isMissingRecover = 1
+    # Call function to run the recovery sequence
+    executor.recordReaction(receivedAt, "recovery start")
+    isDone = runSequence.run_sequence(base, base_cyclic, recoveryHandle, dispatcher=dispatcher)
+    # Calls function to send message indicating that the robot is done running
+    writeRobotDone(True, originatingTime)
+
+# This function pauses the robot as soon as a possible error is detected by the social signal ml algorithm
+def preemptPossible(originatingTime, oldOrigTime, receivedAt):
+    global isPossible
+    # Pause the robot from moving
+    base.PauseSequence()
+    profiler.setPaused(True)
+    # Flag that a possible error has occured
+    isPossible = 1
+
+# This function queries the participant after a possible error paused the robot
+def runPossible(originatingTime, oldOrigTime, preempted):
+    global recoveryPlan
+    # Chooses the recovery while the robot is paused, in case the participant confirms the error
+    recoveryPlan = chooseRecovery()
+    # Plays the query to the participant whether the error indeed happen, without waiting for it
+    cuePlayer.play("possible")
+    # Send message that the previous pipe command was recieved
+    writeRobotDone(False, oldOrigTime)
+    # Send message that the possible detection message has been recieved
+    writeRobotDone(False, originatingTime)
+
+# This function continues the paused sequence when the participant stated no error has occurred
+def preemptResume(originatingTime, oldOrigTime, receivedAt):
+    global isPossible
+    isPossible = 0
+    # Continue executing the pipe command
+    base.ResumeSequence()
+    profiler.setPaused(False)
+
+def runResume(originatingTime, oldOrigTime, preempted):
+    global recoveryPlan
+    # There was no error, the recovery chosen for it is not needed
+    recoveryPlan = None
+    # Send message that the possible detection message has been recieved
+    writeRobotDone(True, originatingTime)
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import utilities
 
 # Parse arguments
-args = utilities.parseConnectionArguments()
+parser = argparse.ArgumentParser()
+# Fill in the X's for the appropriate IP address to communicate between PSI and this program
+parser.add_argument("--psi-input", type=str, help="address to receive the commands from PSI on", default="tcp://XXX.XXX.X.XX:X")
+parser.add_argument("--psi-output", type=str, help="address to send the replies to PSI on", default="tcp://XXX.XXX.X.XX:X")
+parser.add_argument("--simulate", type=str, nargs="?", const="", help="run against the simulated robot of kortexSimulator.py, optionally configured with a JSON file")
+parser.add_argument("--trace", type=str, help="file to append per stage latency marks to (see traceReport.py)")
+parser.add_argument("--sequences", type=str, help="config file mapping the task's roles to sequence names",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sequences.json"))
+parser.add_argument("--sequence-cache", type=str, help="file caching the resolved sequence handles",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sequenceCache.json"))
+parser.add_argument("--refresh-sequences", action="store_true", help="list the sequences on the robot even if their handles are cached")
+# Fill in audio files to play after an error is detected and to query the participant whether the error indeed happened
+parser.add_argument("--error-cue", type=str, help="audio file played after an error is detected", default="XXXXX.wav")
+parser.add_argument("--possible-cue", type=str, help="audio file played to query the participant about a possible error", default="XXXX.wav")
+parser.add_argument("--audio", type=str, choices=audioCues.backendNames, help="audio cue backend, see audioCues.py", default="auto")
+parser.add_argument("--audio-log", type=str, help="log file of the file audio backend", default="audioCues.log")
+parser.add_argument("--profile", type=str, help="file keeping the per task timings of the sequences (see sequenceProfiler.py)",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sequenceProfile.json"))
+parser.add_argument("--watchdog", type=str, choices=sequenceProfiler.watchdogActions, help="what to do with a sequence whose task runs well past its profiled time", default="flag")
+parser.add_argument("--watchdog-factor", type=float, help="a task overruns after this times its p95 time plus --watchdog-slack", default=2.0)
+parser.add_argument("--watchdog-slack", type=float, help="seconds added to the limit of every task", default=1.0)
+parser.add_argument("--motion-output", type=str, help="address to publish the arm's motion state on, from the cyclic feedback (off if not given)")
+parser.add_argument("--motion-rate", type=float, help="feedback polls per second of the motion monitor", default=100.0)
+parser.add_argument("--motion-debounce", type=float, help="seconds a motion state change has to hold before it is published", default=0.03)
+parser.add_argument("--motion-udp", action="store_true", help="poll the feedback over a separate UDP connection, for rates up to 1kHz")
+args = utilities.parseConnectionArguments(parser)
+if args.trace:
+    latencyTrace.start(args.trace, "robot")
+input.connect(args.psi_input)
+output.bind(args.psi_output)
+
+# Connections to the robot, or to the simulated one
+createTcpConnection = utilities.DeviceConnection.createTcpConnection
+createUdpConnection = utilities.DeviceConnection.createUdpConnection
+robotAddress = args.ip
+if args.simulate is not None:
+    import kortexSimulator
+    simulatedRobot = kortexSimulator.SimulatedRobot.fromConfig(args.simulate, list(sequenceRegistry.readConfig(args.sequences).values()))
+    BaseClient, BaseCyclicClient = kortexSimulator.BaseClient, kortexSimulator.BaseCyclicClient
+    createTcpConnection = createUdpConnection = lambda args: kortexSimulator.SimulatedConnection(simulatedRobot)
+    robotAddress = "simulator"
+
+# Loads the audio cues so playing them never waits on decoding or on the clip
+cueFiles = {"error": args.error_cue, "possible": args.possible_cue}
+cuePlayer = audioCues.AudioCuePlayer(audioCues.loadBackend(args.audio, cueFiles, args.audio_log), cueFiles)
     
 # Create connection to the robot and get the router
-with utilities.DeviceConnection.createTcpConnection(args) as router:
+with createTcpConnection(args) as router:
     # Create required services for robot to run the sequences
     base = BaseClient(router)
     base_cyclic = BaseCyclicClient(router)
+    # One subscription to the sequence notifications for the whole session
+    dispatcher = runSequence.SequenceDispatcher(base)
     
     # Load the gripper object
     gripperRequest = Base_pb2.GripperRequest()
@@ -157,118 +316,47 @@ with utilities.DeviceConnection.createTcpConnection(args) as router:
     
     # Calls function to load all of the sequence handles needed for the task
     retractHandle, greenHandle, yellowHandle, missingHandle, mRecoverHandle, yCRecoverHandle, gCRecoverHandle, gORecoverHandle, yORecoverHandle, yErrHandle = sequenceListing(base)
+    # Times the tasks of every sequence and watches for stalled ones
+    profiler = sequenceProfiler.SequenceProfiler(args.profile, sequenceNames, base, args.watchdog, args.watchdog_factor, args.watchdog_slack)
+    dispatcher.add_listener(profiler.onNotification)
+    profiler.start()
     # Run an initial retract sequence on the robot to bring it to a neutral position
-    runSequence.run_sequence(base, base_cyclic, retractHandle)
-    originatingTime = 0
+    runSequence.run_sequence(base, base_cyclic, retractHandle, dispatcher=dispatcher)
+
+    # One worker runs all the commands. Errors and possible errors preempt the pipe requests.
+    executor = commandExecutor.CommandExecutor()
+    executor.register("yellow", commandExecutor.PRIORITY_PICK, lambda originatingTime, oldOrigTime, preempted: runPick("yellow", originatingTime))
+    executor.register("green", commandExecutor.PRIORITY_PICK, lambda originatingTime, oldOrigTime, preempted: runPick("green", originatingTime))
+    executor.register("error", commandExecutor.PRIORITY_ERROR, runError, preemptError)
+    executor.register("possible", commandExecutor.PRIORITY_ERROR, runPossible, preemptPossible)
+    executor.register("resume", commandExecutor.PRIORITY_RESUME, runResume, preemptResume)
+    executor.start()
+
+    # Publishes whether the arm is moving, measured from the cyclic feedback
+    monitor = None
+    if args.motion_output:
+        monitorConnection = None
+        monitorCyclic = base_cyclic
+        if args.motion_udp:
+            monitorConnection = createUdpConnection(args)
+            monitorCyclic = BaseCyclicClient(monitorConnection.__enter__())
+        monitor = motionMonitor.MotionMonitor(monitorCyclic, args.motion_output, args.motion_rate, debounce=args.motion_debounce, connection=monitorConnection)
+        monitor.start()
     
-    # Continous while that waits for commands to come in
-    while True:
-        # Sets the previous message's originating time
-        oldOrigTime = originatingTime
-        # Calls function to read in incoming message
-        command, originatingTime = readCommand()
-        
-        # Set sequence handle to default retract
-        commandHandle = retractHandle
-        # Checks if the command is requesting a pipe
-        if command == "yellow" or command == "green":
-            # Checks if the command requests a yellow pipe
-            if command == "yellow":
-                # Sets the sequence handle to the sequence that retrieves the yellow pipe
-                commandHandle = yellowHandle
-                # Increases the yellow command count
-                yellowCount+=1
-            # Checks if the command requests a green pipe
-            elif command == "green":
-                # Sets the sequence handle to the sequence that retrieves the green pipe
-                commandHandle = greenHandle
-                # Increases the green command count
-                greenCount+=1
-
-            # Manually pre-programmed error override statement for having the robot run the errors
-            # Checks if the yellow pipe command count is 9, if the error has already happened, and if it already
-            # has recovered from that error. Replaces the sequence handle with the corresponding error sequence handle
-            if yellowCount == 9 and isErrorYellow == 0 and isYellowRecover == -1:
-                isErrorYellow = 1
-                # Runs the wrong object error (grabbing green instead of yellow) in a separate thread
-                runRobotThread = threading.Thread(target=runRobotCommand, args=(base, base_cyclic, yErrHandle, originatingTime))
-            # Checks if the green pipe command count is 10, if the error has already happened, and if it already
-            # has recovered from that error. Replaces the sequence handle with the corresponding error sequence handle
-            elif greenCount == 10 and isErrorMissing == 0 and isMissingRecover == -1:
-                isErrorMissing = 1
-                # Runs the wrong object error (grabbing green instead of yellow) in a separate thread
-                runRobotThread = threading.Thread(target=runRobotCommand, args=(base, base_cyclic, missingHandle, originatingTime))
-            # Otherwise runs the requested pipe's pick retrieval sequence
-            else:
-                runRobotThread = threading.Thread(target=runRobotCommand, args=(base, base_cyclic, commandHandle, originatingTime))
-            
-            # Initiates the thread to run the robot
-            runRobotThread.start()
-        
-        # Checks if the command sent from PSI indicates that an error has been detected
-        elif command == "error":
-            # Checks if the error was detected using the explicit indicator
-            if isPossible == 0:
-                # Calls function to send message stating robot is no longer moving
-                writeRobotDone(False, oldOrigTime)
-            # Checks if the error was detected using the implicit indicator (socials signal ml algorithm and domain-specific input)
-            elif isPossible == 1:
-                base.ResumeSequence()
-                isPossible = 0
-                
-            # Stops the current sequence
-            base.StopSequence()
-            # Fill in audio if want to play sound after error is detected
-            playsound("XXXXX.mp3")
-            
-            # Gets the current position of the gripper fingers
-            gripperMeasure = base.GetMeasuredGripperMovement(gripperRequest)
-
-            # Checks if the error is the wrong object (yellow) error
-            if isErrorYellow == 1:
-                isErrorYellow = 0
-                # Sets that the error is being recovered from
-                isYellowRecover = 1
-                # Checks if the gripper is closed
-                if len(gripperMeasure.finger) and (gripperMeasure.finger[0].value > 0.009):
-                    # Call function to run the appropriate recovery sequence knowing the gripper is closed
-                    isDone = runSequence.run_sequence(base, base_cyclic, yCRecoverHandle)
-                else:
-                    # Call function to run the appropriate recovery sequence knowing the gripper is opem
-                    isDone = runSequence.run_sequence(base, base_cyclic, yORecoverHandle)
-            # Checks if the error is failing to grab the pipe
-            elif isErrorMissing == 1:
-                isErrorMissing = 0
-                # Sets that the error is being recovered from
-                isMissingRecover = 1
-                # Calls function to run the appropriate recovery sequence
-                isDone = runSequence.run_sequence(base, base_cyclic, mRecoverHandle)
-            # If error detected is neither, then robot executes a generic recovery
-            else:
-                # Check if gripper is closed
-                if len(gripperMeasure.finger) and (gripperMeasure.finger[0].value > 0.009):
-                    isDone = runSequence.run_sequence(base, base_cyclic, gCRecoverHandle)
-                else:
-                    isDone = runSequence.run_sequence(base, base_cyclic, gORecoverHandle)
-            # Calls function to send message indicating that the robot is done running
-            writeRobotDone(True, originatingTime)
-        # Checks if the command sent from PSI indicates that an error has been detected by the social signal ml algorithm
-        elif command == "possible":
-            # Pause the robot from moving
-            base.PauseSequence()
-            # Flag that a possible error has occured
-            isPossible = 1
-            # Fill in audio, if want to query the participant whether the error indeed happen
-            playsound("XXXX.mp3")
-            # Send message that the previous pipe command was recieved
-            writeRobotDone(False, oldOrigTime)
-            # Send message that the possible detection message has been recieved
-            writeRobotDone(False, originatingTime)
-        # Checks if the command sent from PSI indicates that the participant stated no error has occurred post social signal ml algorithm detection
-        elif command == "resume":
-            isPossible = 0
-            # Continue executing the pipe command
-            base.ResumeSequence()
-            # Send message that the possible detection message has been recieved
-            writeRobotDone(True, originatingTime)
+    try:
+        # Continous while that waits for commands to come in and hands them to the executor
+        while True:
+            # Calls function to read in incoming message
+            command, originatingTime = readCommand()
+            executor.submit(command, originatingTime, time.perf_counter())
             
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        executor.stop()
+        cuePlayer.stop()
+        profiler.stop()
+        if monitor is not None:
+            monitor.stop()
+        print("Replies: {}".format(isWritten.counters()))
+        dispatcher.close()
@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+
+from kortex_api.autogen.messages import Base_pb2, BaseCyclic_pb2, Common_pb2
+
+# This file contains an in-process stand-in for a Kinova Gen3 arm, so the robot
+# controller can be run and benchmarked without one (connectPsiRobot.py --simulate).
+# BaseClient and BaseCyclicClient offer the calls the controller makes:
+# ReadAllSequences, PlaySequence, Pause/Resume/StopSequence,
+# GetMeasuredGripperMovement, sequence notifications and RefreshFeedback. Every call
+# takes a configurable RPC latency, and every sequence runs for a configurable time
+# split evenly over its tasks, sending the same notifications as the robot.
+#
+# The simulation is configured with a JSON file, all keys optional:
+# {"sequences": ["My Retract", ...],  names of the sequences stored on the robot
+#  "durations": {"Yellow_PVC_Pick": 8.0, ...},  seconds per sequence
+#  "defaultDuration": 2.0,  seconds of sequences not in durations
+#  "tasks": 3,  tasks per sequence
+#  "rpcLatency": 0.002}  seconds per call
+# By default the sequences are the ones in sequences.json.
+
+# Joint speed, in degrees/s, of the simulated arm while a sequence plays
+jointSpeed = 20.0
+jointCount = 7
+# Gripper finger position when open and closed
+gripperOpen = 0.0
+gripperClosed = 0.5
+
+# One run of a sequence
+class Run:
+    def __init__(self, handle, name, duration, tasks):
+        self.handle = handle
+        self.name = name
+        self.duration = duration
+        self.tasks = tasks
+        self.aborted = False
+
+class SimulatedRobot:
+    def __init__(self, sequences, durations=None, defaultDuration=2.0, tasks=3, rpcLatency=0.002):
+        self.durations = durations or {}
+        self.defaultDuration = defaultDuration
+        self.tasks = tasks
+        self.rpcLatency = rpcLatency
+        self.sequences = sequences
+        self.condition = threading.Condition()
+        # Notification callbacks by subscription handle
+        self.subscriptions = {}
+        self.nextSubscription = 1
+        self.current = None
+        self.paused = False
+        self.gripper = gripperOpen
+        # Calls made, by name
+        self.calls = {}
+
+    # This function creates a simulated robot from a config file, or with the
+    # default config if path is empty
+    @staticmethod
+    def fromConfig(path, defaultSequences):
+        config = {}
+        if path:
+            with open(path) as file:
+                config = json.load(file)
+        return SimulatedRobot(config.get("sequences", defaultSequences), config.get("durations", {}),
+            config.get("defaultDuration", 2.0), config.get("tasks", 3), config.get("rpcLatency", 0.002))
+
+    # This function stands for the round trip of a call to the robot
+    def call(self, name):
+        time.sleep(self.rpcLatency)
+        with self.condition:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def notify(self, run, event, taskIndex=0):
+        notification = Base_pb2.SequenceInfoNotification()
+        notification.event_identifier = event
+        notification.sequence_handle.CopyFrom(run.handle)
+        notification.task_index = taskIndex
+        with self.condition:
+            callbacks = list(self.subscriptions.values())
+        for callback in callbacks:
+            callback(notification)
+
+    # This function plays a run, on its own thread, sending the notifications of
+    # its tasks and its end. Paused time does not count towards the duration.
+    def play(self, run):
+        taskDuration = run.duration / run.tasks
+        for taskIndex in range(run.tasks):
+            self.notify(run, Base_pb2.SEQUENCE_TASK_STARTED, taskIndex)
+            left = taskDuration
+            with self.condition:
+                while not run.aborted and left > 0:
+                    start = time.perf_counter()
+                    wasPaused = self.paused
+                    self.condition.wait(None if wasPaused else left)
+                    if not wasPaused:
+                        left -= time.perf_counter() - start
+                aborted = run.aborted
+            if aborted:
+                self.notify(run, Base_pb2.SEQUENCE_ABORTED, taskIndex)
+                return
+            self.notify(run, Base_pb2.SEQUENCE_TASK_COMPLETED, taskIndex)
+            # Picks close the gripper halfway through, other sequences open it at the end
+            if "Pick" in run.name and taskIndex == (run.tasks - 1) // 2:
+                self.gripper = gripperClosed
+        with self.condition:
+            if self.current is run:
+                self.current = None
+        if "Pick" not in run.name:
+            self.gripper = gripperOpen
+        self.notify(run, Base_pb2.SEQUENCE_COMPLETED, run.tasks - 1)
+
+    def abortCurrent(self):
+        with self.condition:
+            if self.current is not None:
+                self.current.aborted = True
+                self.current = None
+            self.paused = False
+            self.condition.notify_all()
+
+    def isMoving(self):
+        with self.condition:
+            return self.current is not None and not self.paused
+
+# Context manager standing in for utilities.DeviceConnection, the "router" it
+# yields is the simulated robot
+class SimulatedConnection:
+    def __init__(self, robot):
+        self.robot = robot
+
+    def __enter__(self):
+        return self.robot
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+class BaseClient:
+    def __init__(self, robot):
+        self.robot = robot
+
+    def ReadAllSequences(self):
+        self.robot.call("ReadAllSequences")
+        sequenceList = Base_pb2.SequenceList()
+        for i, name in enumerate(self.robot.sequences):
+            sequence = sequenceList.sequence_list.add()
+            sequence.name = name
+            sequence.handle.identifier = i + 1
+        return sequenceList
+
+    def OnNotificationSequenceInfoTopic(self, callback, options):
+        self.robot.call("OnNotificationSequenceInfoTopic")
+        with self.robot.condition:
+            handle = Common_pb2.NotificationHandle()
+            handle.identifier = self.robot.nextSubscription
+            self.robot.nextSubscription += 1
+            self.robot.subscriptions[handle.identifier] = callback
+        return handle
+
+    def Unsubscribe(self, handle):
+        self.robot.call("Unsubscribe")
+        with self.robot.condition:
+            self.robot.subscriptions.pop(handle.identifier, None)
+
+    def PlaySequence(self, handle):
+        self.robot.call("PlaySequence")
+        name = self.robot.sequences[handle.identifier - 1]
+        run = Run(handle, name, self.robot.durations.get(name, self.robot.defaultDuration), self.robot.tasks)
+        # Playing a sequence aborts the one playing
+        self.robot.abortCurrent()
+        with self.robot.condition:
+            self.robot.current = run
+        threading.Thread(target=self.robot.play, args=(run,), daemon=True).start()
+
+    def PauseSequence(self):
+        self.robot.call("PauseSequence")
+        with self.robot.condition:
+            self.robot.paused = True
+            self.robot.condition.notify_all()
+
+    def ResumeSequence(self):
+        self.robot.call("ResumeSequence")
+        with self.robot.condition:
+            self.robot.paused = False
+            self.robot.condition.notify_all()
+
+    def StopSequence(self):
+        self.robot.call("StopSequence")
+        self.robot.abortCurrent()
+
+    def GetMeasuredGripperMovement(self, request):
+        self.robot.call("GetMeasuredGripperMovement")
+        gripper = Base_pb2.Gripper()
+        finger = gripper.finger.add()
+        finger.value = self.robot.gripper
+        return gripper
+
+class BaseCyclicClient:
+    def __init__(self, robot):
+        self.robot = robot
+
+    def RefreshFeedback(self):
+        self.robot.call("RefreshFeedback")
+        velocity = jointSpeed if self.robot.isMoving() else 0.0
+        feedback = BaseCyclic_pb2.Feedback()
+        for i in range(jointCount):
+            feedback.actuators.add().velocity = velocity
+        feedback.interconnect.gripper_feedback.motor.add().position = self.robot.gripper * 100.0
+        return feedback
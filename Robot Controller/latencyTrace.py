@@ -0,0 +1,99 @@
+import atexit
+import threading
+import time
+from array import array
+
+# This file contains lightweight latency tracing shared by connectML.py and the
+# robot controller (connectPsiRobot.py). It is a copy of latencyTrace.py in Social
+# Signal Model for Detection, so the controller runs without that folder. The copies
+# differ only in this comment, keep them that way (the stages in particular) so
+# their traces can be joined; traceReport.py stops at a record whose layout or
+# stage it does not know. Code marks when a message reaches a stage with
+# mark(stage, originatingTime). Marks go into a fixed-size ring buffer and a
+# background thread appends them to a CSV file (process,stage,originatingTime,
+# timeNs) once a second. Tracing is off until start() is called, and then a mark
+# costs a clock read and a few array writes. traceReport.py (in Social Signal Model
+# for Detection) joins the files of both processes on originatingTime.
+#
+# Times are wall clock nanoseconds (time.time_ns), so latencies between the two
+# processes are only meaningful when their machines' clocks are synchronised.
+
+# Stages in the order a message passes through them
+mlStages = ["receive", "unpack", "inference", "window", "publish"]
+robotStages = ["commandReceive", "stopSequence", "threadStart", "playSequence", "sequenceDone", "robotDone"]
+stages = mlStages + robotStages
+stageIds = {stage: i for i, stage in enumerate(stages)}
+
+# Ring buffer of marks flushed to file by a background thread
+class Tracer:
+    def __init__(self, path, process, capacity=65536, flushInterval=1.0):
+        self.path = path
+        self.process = process
+        self.capacity = capacity
+        self.flushInterval = flushInterval
+        self.stages = array('B', [0] * capacity)
+        self.originatingTimes = array('q', [0] * capacity)
+        self.times = array('q', [0] * capacity)
+        # Number of marks made and written to file so far
+        self.marked = 0
+        self.flushed = 0
+        # Marks overwritten before they could be written to file
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def mark(self, stage, originatingTime, timeNs=None):
+        if timeNs is None:
+            timeNs = time.time_ns()
+        with self.lock:
+            slot = self.marked % self.capacity
+            self.stages[slot] = stageIds[stage]
+            self.originatingTimes[slot] = int(originatingTime)
+            self.times[slot] = timeNs
+            self.marked += 1
+
+    # This function writes the marks made since the last flush to the file
+    def flush(self):
+        with self.lock:
+            if self.marked - self.flushed > self.capacity:
+                self.dropped += self.marked - self.flushed - self.capacity
+                self.flushed = self.marked - self.capacity
+            marks = [(self.stages[i % self.capacity], self.originatingTimes[i % self.capacity], self.times[i % self.capacity])
+                for i in range(self.flushed, self.marked)]
+            self.flushed = self.marked
+        if marks:
+            with open(self.path, "a") as file:
+                file.writelines("{},{},{},{}\n".format(self.process, stages[stage], originatingTime, timeNs)
+                    for stage, originatingTime, timeNs in marks)
+
+    def run(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+
+# Tracer used by mark(), None while tracing is off
+tracer = None
+
+# This function turns tracing on. The inputs are the file to append the marks to
+# and the name of the process making them.
+def start(path, process):
+    global tracer
+    tracer = Tracer(path, process)
+    atexit.register(tracer.stop)
+
+# This function returns the current time in the unit marks use, for stages whose
+# originatingTime is only known after the stage has started
+def now():
+    return time.time_ns()
+
+# This function records that the message with the given originating time reached
+# a stage. timeNs defaults to now.
+def mark(stage, originatingTime, timeNs=None):
+    if tracer is not None:
+        tracer.mark(stage, originatingTime, timeNs)
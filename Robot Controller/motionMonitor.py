@@ -0,0 +1,106 @@
+import threading
+import time
+
+import zmq
+import msgpack
+
+# This file contains the monitor that tells PSI whether the arm is actually moving,
+# measured from the robot's cyclic feedback rather than inferred from the replies to
+# the commands. A background thread polls BaseCyclic feedback at a fixed rate (up to
+# 1kHz over a UDP connection) and counts the arm as moving while any joint turns
+# faster than velocityThreshold (degrees/s) or the gripper's motor moves faster than
+# gripperThreshold (% of its range/s). The gripper's reported velocity is used
+# rather than differencing its position, which is too coarse between 1ms polls. A
+# change of state is published once it has held for debounce seconds, as a msgpack
+# {message: bool, originatingTime} on its own topic ("robotMoving").
+
+topic = "robotMoving"
+# Ticks (100ns) between 0001-01-01, where PSI's originating times start, and 1970-01-01
+unixEpochTicks = 621355968000000000
+
+# This function returns the current time as a PSI originating time
+def originatingTimeNow():
+    return time.time_ns() // 100 + unixEpochTicks
+
+class MotionMonitor:
+    # The inputs are:
+    # base_cyclic: Robot's cyclic client to poll the feedback of
+    # address: ZMQ address to publish the motion state on
+    # rate: Polls per second
+    # velocityThreshold: Joint speed, in degrees/s, above which the arm is moving
+    # gripperThreshold: Gripper speed, in % of its range/s, above which the gripper is moving
+    # debounce: Seconds a change of state has to hold before it is published
+    # connection: Device connection the client uses, closed when the monitor stops
+    def __init__(self, base_cyclic, address, rate=100.0, velocityThreshold=0.5, gripperThreshold=2.0, debounce=0.03, connection=None):
+        self.base_cyclic = base_cyclic
+        self.period = 1.0 / rate
+        self.velocityThreshold = velocityThreshold
+        self.gripperThreshold = gripperThreshold
+        self.debounce = debounce
+        self.connection = connection
+        self.output = zmq.Context.instance().socket(zmq.PUB)
+        self.output.bind(address)
+        # Published state, and the polled state it may change to with the time that started
+        self.isMoving = None
+        self.candidate = None
+        self.candidateSince = 0.0
+        # Polls made, polls that failed and polls that started later than a period after they were due
+        self.polls = 0
+        self.errors = 0
+        self.late = 0
+        self.pollTime = 0.0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # This function checks if the arm or gripper moves in one feedback message
+    def isMovingNow(self, feedback):
+        if any(abs(actuator.velocity) > self.velocityThreshold for actuator in feedback.actuators):
+            return True
+        motors = feedback.interconnect.gripper_feedback.motor
+        return len(motors) > 0 and abs(motors[0].velocity) > self.gripperThreshold
+
+    def publish(self, isMoving):
+        payload = {u"message": isMoving, u"originatingTime": originatingTimeNow()}
+        self.output.send_multipart([topic.encode(), msgpack.dumps(payload)])
+
+    def run(self):
+        due = time.perf_counter()
+        while not self.stopped.is_set():
+            now = time.perf_counter()
+            if now - due > self.period:
+                self.late += 1
+                due = now
+            try:
+                feedback = self.base_cyclic.RefreshFeedback()
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1:
+                    print("Motion monitor feedback failed: {}".format(e))
+                feedback = None
+            polled = time.perf_counter()
+            self.polls += 1
+            self.pollTime += polled - now
+            if feedback is not None:
+                isMoving = self.isMovingNow(feedback)
+                if isMoving != self.candidate:
+                    self.candidate = isMoving
+                    self.candidateSince = polled
+                # The first state is published straight away
+                if isMoving != self.isMoving and (self.isMoving is None or polled - self.candidateSince >= self.debounce):
+                    self.isMoving = isMoving
+                    self.publish(isMoving)
+            due += self.period
+            self.stopped.wait(max(0.0, due - time.perf_counter()))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.output.close()
+        if self.connection is not None:
+            self.connection.__exit__(None, None, None)
+        if self.polls:
+            print("Motion monitor: {} polls, {} failed, {} late, mean poll {:.2f}ms".format(
+                self.polls, self.errors, self.late, self.pollTime / self.polls * 1000))
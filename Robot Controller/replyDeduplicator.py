@@ -0,0 +1,54 @@
+import collections
+import threading
+import time
+
+# This file contains the bookkeeping connectPsiRobot.py uses to send at most one
+# reply to PSI per command. A command can be answered from more than one place
+# (e.g. a pick that is stopped by an error gets its reply from the error, and
+# again once its sequence aborts), so every reply is checked against the
+# originating times already replied to.
+#
+# The originating times are kept in a set, for constant time lookups, and in a
+# FIFO of insertion order, which bounds the memory: once there are more than
+# capacity entries, or an entry is older than maxAge seconds, the oldest one is
+# forgotten. PSI only repeats recent originating times, so forgetting old ones
+# does not let duplicates through in practice. All calls are thread-safe.
+
+class ReplyDeduplicator:
+    def __init__(self, capacity=4096, maxAge=None):
+        self.capacity = capacity
+        self.maxAge = maxAge
+        self.replied = set()
+        # (originatingTime, time.monotonic() when replied), oldest first
+        self.order = collections.deque()
+        self.lock = threading.Lock()
+        # Replies suppressed as duplicates, replies let through and entries forgotten
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # This function checks if a reply for the originating time has not been sent
+    # yet, and if so records it. The output is True if the reply should be sent.
+    def firstReply(self, originatingTime):
+        now = time.monotonic()
+        with self.lock:
+            if self.maxAge is not None:
+                while self.order and now - self.order[0][1] > self.maxAge:
+                    self.evict()
+            if originatingTime in self.replied:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self.replied.add(originatingTime)
+            self.order.append((originatingTime, now))
+            if len(self.order) > self.capacity:
+                self.evict()
+            return True
+
+    def evict(self):
+        self.replied.discard(self.order.popleft()[0])
+        self.evictions += 1
+
+    def counters(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.replied)}
@@ -2,6 +2,9 @@ import time
 import sys
 import os
 import threading
+import concurrent.futures
+
+import latencyTrace
 
 from kortex_api.autogen.client_stubs.BaseClientRpc import BaseClient
 from kortex_api.autogen.client_stubs.BaseCyclicClientRpc import BaseCyclicClient
@@ -16,11 +19,13 @@ from kortex_api.autogen.messages import Session_pb2, Base_pb2, BaseCyclic_pb2
 TIMEOUT_DURATION = 240
 
 # Create closure to set an event after an END or an ABORT
-def check_for_sequence_end_or_abort(e):
+def check_for_sequence_end_or_abort(e, originatingTime=None):
     """Return a closure checking for END or ABORT notifications on a sequence
     Arguments:
     e -- event to signal when the action is completed
         (will be set when an END or ABORT occurs)
+    originatingTime -- originating time of the command that started the sequence,
+        traced when the sequence ends (None for no tracing)
     """
 
     def check(notification, e = e):
@@ -33,22 +38,118 @@ def check_for_sequence_end_or_abort(e):
                 .format(\
                     notification.abort_details,\
                     Base_pb2.SubErrorCodes.Name(notification.abort_details)))
+            if originatingTime is not None:
+                latencyTrace.mark("sequenceDone", originatingTime)
             e.set()
         elif event_id == Base_pb2.SEQUENCE_COMPLETED:
             print("Sequence completed.")
+            if originatingTime is not None:
+                latencyTrace.mark("sequenceDone", originatingTime)
             e.set()
     return check
 
+class SequenceDispatcher:
+    """Route the notifications of one long-lived sequence subscription to the
+    callers waiting on each sequence, through futures.
+
+    Create it once the device connection is open and close it before the
+    connection closes. Register a wait with watch() (or watch_task()) before
+    playing the sequence so no notification can be missed. Several callers can
+    wait on the same sequence. Listeners added with add_listener() get every
+    notification.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.lock = threading.Lock()
+        # Futures waiting for the end of a sequence, by sequence handle identifier
+        self.end_waiters = {}
+        # Futures waiting for a task of a sequence, by (identifier, task index)
+        self.task_waiters = {}
+        self.listeners = []
+        self.notification_handle = base.OnNotificationSequenceInfoTopic(
+            self.dispatch,
+            Base_pb2.NotificationOptions()
+        )
+
+    def add_listener(self, listener):
+        """Call listener(notification) with every sequence notification"""
+        self.listeners.append(listener)
+
+    def dispatch(self, notification):
+        # A failing listener must not keep the waiters below from being resolved
+        for listener in self.listeners:
+            try:
+                listener(notification)
+            except Exception as e:
+                print("Sequence notification listener {} failed: {}: {}".format(listener, type(e).__name__, e))
+        event_id = notification.event_identifier
+        task_id = notification.task_index
+        identifier = notification.sequence_handle.identifier
+        waiters = []
+        if event_id == Base_pb2.SEQUENCE_TASK_COMPLETED:
+            print("Sequence task {} completed".format(task_id))
+            with self.lock:
+                waiters = self.task_waiters.pop((identifier, task_id), [])
+        elif event_id == Base_pb2.SEQUENCE_ABORTED:
+            print("Sequence aborted with error {}:{}"\
+                .format(\
+                    notification.abort_details,\
+                    Base_pb2.SubErrorCodes.Name(notification.abort_details)))
+            with self.lock:
+                waiters = self.end_waiters.pop(identifier, [])
+        elif event_id == Base_pb2.SEQUENCE_COMPLETED:
+            print("Sequence completed.")
+            with self.lock:
+                waiters = self.end_waiters.pop(identifier, [])
+        for future in waiters:
+            future.set_result(notification)
+
+    def watch(self, commandHandle):
+        """Return a future resolved with the SEQUENCE_COMPLETED or
+        SEQUENCE_ABORTED notification of the next run of the sequence"""
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.end_waiters.setdefault(commandHandle.identifier, []).append(future)
+        return future
+
+    def watch_task(self, commandHandle, task_index):
+        """Return a future resolved with the SEQUENCE_TASK_COMPLETED
+        notification of a task of the next run of the sequence"""
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.task_waiters.setdefault((commandHandle.identifier, task_index), []).append(future)
+        return future
+
+    def forget(self, commandHandle, future):
+        """Stop waiting with a future returned by watch()"""
+        with self.lock:
+            waiters = self.end_waiters.get(commandHandle.identifier, [])
+            if future in waiters:
+                waiters.remove(future)
+        future.cancel()
+
+    def close(self):
+        self.base.Unsubscribe(self.notification_handle)
+
 # This function sends command to the robot to run the specified sequence.
-# The sequences were pre-programmed.
-def run_sequence(base, base_cyclic, commandHandle):
+# The sequences were pre-programmed. originatingTime is the originating time of
+# the command being executed, used for latency tracing. With a dispatcher the
+# wait goes through its subscription, otherwise the function subscribes to the
+# sequence notifications for the length of the sequence.
+def run_sequence(base, base_cyclic, commandHandle, originatingTime=None, dispatcher=None):
+    if dispatcher is not None:
+        return run_sequence_dispatched(base, dispatcher, commandHandle, originatingTime)
+
     e = threading.Event()
     notification_handle = base.OnNotificationSequenceInfoTopic(
-        check_for_sequence_end_or_abort(e),
+        check_for_sequence_end_or_abort(e, originatingTime),
         Base_pb2.NotificationOptions()
     )
 
     print("Executing it")
+    if originatingTime is not None:
+        latencyTrace.mark("playSequence", originatingTime)
     base.PlaySequence(commandHandle)
 
     print("Waiting for movement to finish ...")
@@ -59,6 +160,35 @@ def run_sequence(base, base_cyclic, commandHandle):
         print("Timeout on action notification wait")
     return finished
 
+# This function starts the specified sequence without waiting for it. The output
+# is the dispatcher future resolved when the sequence completes or aborts.
+def start_sequence(base, dispatcher, commandHandle, originatingTime=None):
+    done = dispatcher.watch(commandHandle)
+    if originatingTime is not None:
+        done.add_done_callback(lambda future: latencyTrace.mark("sequenceDone", originatingTime))
+
+    print("Executing it")
+    if originatingTime is not None:
+        latencyTrace.mark("playSequence", originatingTime)
+    base.PlaySequence(commandHandle)
+    return done
+
+# Same as run_sequence, waiting on the dispatcher's subscription
+def run_sequence_dispatched(base, dispatcher, commandHandle, originatingTime):
+    done = start_sequence(base, dispatcher, commandHandle, originatingTime)
+
+    print("Waiting for movement to finish ...")
+    try:
+        done.result(TIMEOUT_DURATION)
+        finished = True
+    except concurrent.futures.TimeoutError:
+        dispatcher.forget(commandHandle, done)
+        finished = False
+
+    if not finished:
+        print("Timeout on action notification wait")
+    return finished
+
 def main():
     # Import the utilities helper module
     sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+from kortex_api.autogen.messages import Base_pb2
+
+import latencyStats
+
+# This file contains the profiler of the pre-programmed sequences. It listens to the
+# sequence notifications (SequenceDispatcher.add_listener in runSequence.py) and
+# times every task of every sequence from its SEQUENCE_TASK_STARTED to its
+# SEQUENCE_TASK_COMPLETED notification, and every sequence from its first task
+# starting to its SEQUENCE_COMPLETED notification. Time spent paused is not counted.
+# The timings are kept per sequence in a JSON file (sequenceProfile.json by
+# default), with the last historyLength of each, so they build up over sessions.
+#
+# A watchdog thread uses the profile to catch stalled sequences: a task that runs
+# longer than factor times its p95 plus slack seconds is flagged, and with
+# action="abort" the sequence is stopped. Tasks with fewer than minSamples timings
+# are not watched.
+#
+# Running this file exports a profile, sorted by the sequences' mean duration, to
+# see which sequences limit the cycle time. For example:
+#   python sequenceProfiler.py sequenceProfile.json --csv profile.csv
+
+historyLength = 50
+watchdogActions = ["off", "flag", "abort"]
+
+# This function summarises a history of timings as (count, mean, p95)
+def summary(history):
+    if not history:
+        return (0, 0.0, 0.0)
+    return (len(history), sum(history) / len(history), latencyStats.percentile(history, 95))
+
+class SequenceProfiler:
+    # The inputs are:
+    # path: Profile file, read at start and written after every completed sequence
+    # names: Dict from sequence handle identifier to the name the sequence is profiled under
+    # base: Robot's computer client, to stop overrunning sequences with
+    # action: What the watchdog does with an overrunning task, one of watchdogActions
+    # factor, slack, minSamples: When a task is overrunning, see above
+    def __init__(self, path, names, base=None, action="flag", factor=2.0, slack=1.0, minSamples=3):
+        self.path = path
+        self.names = names
+        self.base = base
+        self.action = action
+        self.factor = factor
+        self.slack = slack
+        self.minSamples = minSamples
+        # Profile by sequence name: {"duration": [seconds], "tasks": {task index: [seconds]}}
+        self.profile = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.profile = json.load(file)
+        self.lock = threading.Lock()
+        # Sequences playing, by name: [sequence start, task index, task start, flagged]
+        self.running = {}
+        self.pausedAt = None
+        # Tasks flagged and sequences aborted by the watchdog
+        self.overruns = 0
+        self.aborts = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+
+    def start(self):
+        if self.action != "off":
+            self.thread.start()
+
+    def sequenceProfile(self, name):
+        return self.profile.setdefault(name, {"duration": [], "tasks": {}})
+
+    def record(self, history, seconds):
+        history.append(round(seconds, 4))
+        del history[:-historyLength]
+
+    # This function is the listener of the sequence notifications
+    def onNotification(self, notification):
+        now = time.perf_counter()
+        event = notification.event_identifier
+        name = self.names.get(notification.sequence_handle.identifier, str(notification.sequence_handle.identifier))
+        save = False
+        with self.lock:
+            run = self.running.get(name)
+            if event == Base_pb2.SEQUENCE_TASK_STARTED:
+                if run is None:
+                    self.running[name] = [now, notification.task_index, now, False]
+                else:
+                    run[1:] = [notification.task_index, now, False]
+            elif event == Base_pb2.SEQUENCE_TASK_COMPLETED and run is not None:
+                tasks = self.sequenceProfile(name)["tasks"]
+                self.record(tasks.setdefault(str(notification.task_index), []), now - run[2])
+            elif event == Base_pb2.SEQUENCE_COMPLETED and run is not None:
+                self.record(self.sequenceProfile(name)["duration"], now - run[0])
+                del self.running[name]
+                save = True
+            elif event == Base_pb2.SEQUENCE_ABORTED:
+                self.running.pop(name, None)
+        if save:
+            self.save()
+
+    # This function stops (paused is True) or restarts the clocks of the playing
+    # sequences, when they are paused or resumed
+    def setPaused(self, paused):
+        now = time.perf_counter()
+        with self.lock:
+            if paused and self.pausedAt is None:
+                self.pausedAt = now
+            elif not paused and self.pausedAt is not None:
+                for run in self.running.values():
+                    run[0] += now - self.pausedAt
+                    run[2] += now - self.pausedAt
+                self.pausedAt = None
+
+    # This function returns the seconds after which a task counts as overrunning, or
+    # None if there are too few timings of it
+    def taskLimit(self, name, taskIndex):
+        history = self.profile.get(name, {}).get("tasks", {}).get(str(taskIndex), [])
+        if len(history) < self.minSamples:
+            return None
+        return self.factor * latencyStats.percentile(history, 95) + self.slack
+
+    def watch(self):
+        while not self.stopped.wait(0.1):
+            now = time.perf_counter()
+            overrunning = []
+            with self.lock:
+                if self.pausedAt is not None:
+                    continue
+                for name, run in self.running.items():
+                    limit = self.taskLimit(name, run[1])
+                    if not run[3] and limit is not None and now - run[2] > limit:
+                        run[3] = True
+                        self.overruns += 1
+                        overrunning.append((name, run[1], now - run[2], limit))
+            for name, taskIndex, elapsed, limit in overrunning:
+                print("Sequence {} task {} overrunning: {:.1f}s, expected at most {:.1f}s".format(name, taskIndex, elapsed, limit))
+                if self.action == "abort" and self.base is not None:
+                    self.aborts += 1
+                    self.base.StopSequence()
+
+    def save(self):
+        with self.lock:
+            profile = json.dumps(self.profile, indent=1, sort_keys=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(profile)
+        os.replace(temporary, self.path)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.save()
+        if self.overruns:
+            print("Watchdog: {} overrunning tasks, {} sequences aborted".format(self.overruns, self.aborts))
+
+# This function writes a profile as a table, one row per sequence and per task,
+# sorted by the sequences' mean duration. The output is the rows.
+def exportProfile(profile):
+    rows = []
+    for name, sequence in profile.items():
+        count, mean, p95 = summary(sequence["duration"])
+        rows.append((mean, name, "all", count, mean, p95))
+        for taskIndex, history in sorted(sequence["tasks"].items(), key=lambda item: int(item[0])):
+            taskCount, taskMean, taskP95 = summary(history)
+            rows.append((mean, name, taskIndex, taskCount, taskMean, taskP95))
+    rows.sort(key=lambda row: (-row[0], row[1], row[2] != "all"))
+    return [row[1:] for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("profile", type=str, help="profile file written by connectPsiRobot.py")
+    parser.add_argument("--csv", type=str, help="file to also write the table to as CSV")
+    args = parser.parse_args()
+
+    with open(args.profile) as file:
+        rows = exportProfile(json.load(file))
+    print("{:<28} {:>6} {:>6} {:>10} {:>10}".format("sequence", "task", "count", "mean s", "p95 s"))
+    for name, task, count, mean, p95 in rows:
+        print("{:<28} {:>6} {:>6} {:>10.2f} {:>10.2f}".format(name, task, count, mean, p95))
+    if args.csv:
+        with open(args.csv, "w") as file:
+            file.write("sequence,task,count,mean,p95\n")
+            file.writelines("{},{},{},{:.4f},{:.4f}\n".format(*row) for row in rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import time
+
+from kortex_api.autogen.messages import Base_pb2
+
+# This file contains the registry connectPsiRobot.py gets the handles of the
+# pre-programmed sequences from. Which sequence plays which role in the task
+# (e.g. "yellow" is the sequence named "Yellow_PVC_Pick") is declared in a JSON
+# config file, sequences.json by default.
+#
+# Resolving the names means listing every sequence stored on the robot, so the
+# resolved handles are saved to a local cache file keyed by the robot's IP address
+# and a hash of the config. A restart against the same robot with the same config
+# reads the handles from the cache and skips the listing. The cache does not notice
+# sequences being re-programmed on the robot: start with --refresh-sequences after
+# changing them.
+
+# This function reads the config file. The output is a dict from role to sequence name.
+def readConfig(path):
+    with open(path) as file:
+        return json.load(file)
+
+# This function returns the cache key of a robot and config
+def cacheKey(ip, roles):
+    return ip + "/" + hashlib.sha1(json.dumps(roles, sort_keys=True).encode()).hexdigest()
+
+# This function resolves the roles' sequence names with the list of sequences
+# stored on the robot. The output is a dict from role to sequence handle. It
+# raises ValueError naming the sequences the robot does not have.
+def listHandles(base, roles):
+    # Sequence handles by name, the last one wins if a name is used twice
+    handlesByName = {seq.name: seq.handle for seq in base.ReadAllSequences().sequence_list}
+    missing = sorted(set(roles.values()) - set(handlesByName))
+    if missing:
+        raise ValueError("sequences not found on the robot: {}".format(", ".join(missing)))
+    return {role: handlesByName[name] for role, name in roles.items()}
+
+# This function reads the handles of a robot and config from the cache file. The
+# output is None if they are not cached.
+def readCache(path, key, roles):
+    try:
+        with open(path) as file:
+            cached = json.load(file).get(key)
+    except (OSError, ValueError):
+        return None
+    if cached is None or set(cached) != set(roles):
+        return None
+    return {role: Base_pb2.SequenceHandle(identifier=handle["identifier"], permission=handle["permission"])
+        for role, handle in cached.items()}
+
+# This function saves the handles of a robot and config to the cache file, next to
+# the ones of other robots and configs
+def writeCache(path, key, handles):
+    try:
+        with open(path) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+    cache[key] = {role: {"identifier": handle.identifier, "permission": handle.permission} for role, handle in handles.items()}
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+    os.replace(temporary, path)
+
+# This function loads the sequence handles for the task. The inputs are:
+# base: Robot's computer client
+# ip: Robot's IP address
+# configPath: Config file mapping roles to sequence names
+# cachePath: Cache file of resolved handles
+# refresh: Whether to list the sequences on the robot even if the handles are cached
+# The output is a dict from role to sequence handle.
+def loadHandles(base, ip, configPath, cachePath, refresh=False):
+    start = time.perf_counter()
+    roles = readConfig(configPath)
+    key = cacheKey(ip, roles)
+    handles = None if refresh else readCache(cachePath, key, roles)
+    source = "cache"
+    if handles is None:
+        source = "robot"
+        handles = listHandles(base, roles)
+        writeCache(cachePath, key, handles)
+    print("Loaded {} sequence handles from the {} in {:.1f}ms".format(len(handles), source, (time.perf_counter() - start) * 1000))
+    return handles
@@ -0,0 +1,183 @@
+import asyncio
+import concurrent.futures
+
+import zmq
+import zmq.asyncio
+import msgpack
+
+import connectML
+import latencyTrace
+
+# This file contains the pipelined version of the connectML.py loop. Receiving,
+# classifying and publishing run as separate asyncio stages joined by bounded
+# queues, and the classifier runs on its own thread so new AUs keep being received
+# while a timestep is classified. When the classifier falls behind (GC, CPU
+# contention) the frames waiting for it are handled with a late frame policy:
+# none: every frame is classified one at a time, however late
+# coalesce: every frame waiting is classified together in one batch
+# skip: like coalesce, but frames more than maxLag milliseconds behind the newest
+#   frame of their stream are not classified. They still enter the sliding window
+#   as non-error timesteps so the window keeps one slot per timestep and the
+#   timestep indices (and estimated error starts) stay correct. No reply is sent
+#   for them.
+# How late a frame is is measured on the stream's own originatingTime clock, so
+# the Detector and this program do not need synchronised clocks.
+
+latePolicies = connectML.latePolicies
+# Topic the pipeline counters are published on
+statsTopic = "detectorStats"
+
+# Counters of what happened to the frames, printed and published every few seconds
+class PipelineCounters:
+    def __init__(self,):
+        # Frames received from PSI
+        self.received = 0
+        # Frames classified and replied to
+        self.processed = 0
+        # Frames more than maxLag behind the newest frame of their stream when the
+        # classifier got to them
+        self.late = 0
+        # Late frames that were not classified (skip policy)
+        self.skipped = 0
+        # Frames classified in a batch of more than one (coalesce and skip policies)
+        self.coalesced = 0
+        # Times the receive stage had to wait because the classifier queue was full
+        self.receiveStalls = 0
+
+    def asDict(self):
+        return dict(vars(self))
+
+# One stream of AUs, i.e. one Detector instance
+class Stream:
+    def __init__(self, topic):
+        self.window = connectML.newWindow()
+        # Index the next timestep of the stream gets
+        self.count = 0
+        self.replyTopic = connectML.replyTopic.encode() + topic[len(connectML.auTopic):]
+        # Newest originatingTime received on the stream
+        self.newest = None
+
+class AsyncPipeline:
+    # The inputs are:
+    # input: zmq.asyncio subscribe socket the AUs arrive on
+    # output: publish socket the replies are sent on
+    # model: The classifier backend loaded from file
+    # latePolicy: One of latePolicies
+    # maxLag: Milliseconds a frame can be behind the newest frame of its stream
+    #   before it is late
+    # ticksPerMs: originatingTime units per millisecond (10000 for PSI ticks)
+    # queueSize: Number of frames each queue between stages holds
+    # maxBatch: Largest number of frames classified together
+    def __init__(self, input, output, model, latePolicy, maxLag, ticksPerMs, queueSize, maxBatch):
+        self.input = input
+        self.output = output
+        self.model = model
+        self.latePolicy = latePolicy
+        self.maxLag = maxLag * ticksPerMs
+        self.maxBatch = maxBatch
+        self.frames = asyncio.Queue(queueSize)
+        self.replies = asyncio.Queue(queueSize)
+        self.streams = {}
+        self.counters = PipelineCounters()
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    # Receive stage: unpacks the AUs and gives every frame its timestep index
+    async def receive(self):
+        while True:
+            [topic, payload] = await self.input.recv_multipart(copy=False)
+            received = latencyTrace.now()
+            # The payload is decoded in place, as in connectML.receiveFrames
+            topic, payload = topic.bytes, payload.buffer
+            AUsCalced, oT, streamId = connectML.decodeAUs(payload)
+            latencyTrace.mark("receive", oT, received)
+            latencyTrace.mark("unpack", oT)
+            if topic not in self.streams:
+                self.streams[topic] = Stream(topic)
+            stream = self.streams[topic]
+            if stream.newest is None or oT > stream.newest:
+                stream.newest = oT
+            self.counters.received += 1
+            if self.frames.full():
+                self.counters.receiveStalls += 1
+            await self.frames.put((stream, stream.count, AUsCalced, oT, streamId))
+            stream.count += 1
+
+    # Inference stage: classifies the frames and runs them through their stream's
+    # sliding window in the order they arrived
+    async def infer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.frames.get()]
+            if self.latePolicy != "none":
+                while len(pending) < self.maxBatch and not self.frames.empty():
+                    pending.append(self.frames.get_nowait())
+
+            classify = []
+            skip = set()
+            for i, (stream, index, AUsCalced, oT, streamId) in enumerate(pending):
+                if stream.newest - oT > self.maxLag:
+                    self.counters.late += 1
+                    if self.latePolicy == "skip":
+                        skip.add(i)
+                        continue
+                classify.append(AUsCalced[1:])
+
+            if len(classify) == 1:
+                predictedClass, predictedConfidence = await loop.run_in_executor(self.executor, connectML.runML, self.model, classify[0])
+                predictedClasses, predictedConfidences = [predictedClass], [predictedConfidence]
+            elif classify:
+                predictedClasses, predictedConfidences = await loop.run_in_executor(self.executor, connectML.runMLBatch, self.model, classify)
+                self.counters.coalesced += len(classify)
+            classified = latencyTrace.now()
+
+            replied = 0
+            for i, (stream, index, AUsCalced, oT, streamId) in enumerate(pending):
+                if i in skip:
+                    stream.window.update(0.0, 0.0, index, AUsCalced[0])
+                    self.counters.skipped += 1
+                    continue
+                latencyTrace.mark("inference", oT, classified)
+                reply = connectML.detectTimeStep(predictedClasses[replied], predictedConfidences[replied], index, AUsCalced[0], stream.window)
+                latencyTrace.mark("window", oT)
+                replied += 1
+                await self.replies.put((stream.replyTopic, reply, oT, streamId))
+                self.counters.processed += 1
+
+    # Publish stage: sends the replies back to PSI
+    async def publish(self):
+        while True:
+            topic, reply, oT, streamId = await self.replies.get()
+            connectML.writeCommand(self.output, reply, oT, topic, streamId)
+
+    # Prints and publishes the counters every interval seconds
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            counters = self.counters.asDict()
+            print(" ".join("{}={}".format(name, value) for name, value in counters.items()))
+            self.output.send_multipart([statsTopic.encode(), msgpack.dumps(counters)])
+
+    # Beats the readiness heartbeat (see connectML.Heartbeat) every interval seconds
+    async def beat(self, heartbeat):
+        while True:
+            heartbeat.beat()
+            await asyncio.sleep(heartbeat.interval)
+
+    async def run(self, statsInterval, heartbeat=None):
+        stages = [self.receive(), self.infer(), self.publish()]
+        if statsInterval > 0:
+            stages.append(self.report(statsInterval))
+        if heartbeat is not None:
+            stages.append(self.beat(heartbeat))
+        await asyncio.gather(*stages)
+
+# This function runs the pipeline until interrupted. The inputs are the address PSI
+# publishes the AUs on, the publish socket for the replies, the classifier backend,
+# the parsed connectML.py arguments and the readiness heartbeat, None for none.
+def run(address, output, model, args, heartbeat=None):
+    input = zmq.asyncio.Context().socket(zmq.SUB)
+    input.setsockopt(zmq.RCVHWM, args.hwm)
+    input.setsockopt_string(zmq.SUBSCRIBE, connectML.auTopic)
+    input.connect(address)
+    pipeline = AsyncPipeline(input, output, model, args.late_policy, args.max_lag, args.ticks_per_ms, args.queue_size, args.max_batch)
+    asyncio.run(pipeline.run(args.stats_interval, heartbeat))
@@ -0,0 +1,210 @@
+import argparse
+import time
+
+import numpy as np
+
+# This file contains the temporal AU features connectML.py can classify instead of
+# the AUs of a timestep on their own (--features). For every AU it keeps, over each
+# horizon (a number of timesteps):
+# - the exponentially weighted moving average, with alpha = 2 / (horizon + 1)
+# - the mean and variance of the last horizon timesteps
+# and the difference of the AU from the participant's baseline, the mean of their
+# first baselineTimesteps timesteps (of the timesteps so far until there are that
+# many). The features of a timestep are the 17 AUs followed by the EWMAs, the
+# means, the variances (all horizon by horizon, AU by AU within a horizon) and the
+# baseline differences, 17 * (2 + 3 * horizons) values.
+#
+# FeatureExtractor updates the features of one stream timestep by timestep in
+# constant time: the rolling means and variances come from running sums and sums
+# of squares over a ring buffer of the last timesteps, recomputed from the buffer
+# every time it wraps so rounding errors do not build up over a session.
+# sessionFeatures computes the same features for a whole recorded session at once,
+# to build the training inputs of a model classifying features. Running this file
+# writes them for a session log (see replaySession.py) or session store (see
+# sessionStore.py):
+#   python auFeatures.py --log session.aulog --output session.features.npz
+
+# Number of AUs per timestep
+auCount = 17
+defaultHorizons = [3, 9, 30]
+# Timesteps the baseline is the mean of (30s at 3 timesteps per second)
+defaultBaselineTimesteps = 90
+
+# This function returns the number of features per timestep for a number of horizons
+def featureCount(horizonCount):
+    return auCount * (2 + 3 * horizonCount)
+
+# Temporal features of one stream of AUs, updated one timestep at a time. The
+# state lives in preallocated arrays, the running averages inside the features of
+# the last timestep, so an update is a fixed number of small array operations.
+class FeatureExtractor:
+    # The inputs are the horizons in timesteps and the number of timesteps the
+    # baseline is the mean of
+    def __init__(self, horizons=defaultHorizons, baselineTimesteps=defaultBaselineTimesteps):
+        self.horizons = np.array(horizons, dtype=np.int64)
+        self.alphas = (2.0 / (self.horizons + 1.0))[:, None]
+        self.baselineTimesteps = baselineTimesteps
+        self.inputSize = featureCount(len(horizons))
+        # Last timesteps, the newest at slot head - 1
+        size = int(self.horizons.max())
+        self.history = np.zeros((size, auCount))
+        self.head = 0
+        self.count = 0
+        # Slots of the timesteps falling out of each horizon, by head
+        self.leaving = (np.arange(size)[:, None] - self.horizons[None, :]) % size
+        # Sums and sums of squares of the last horizon timesteps, per horizon
+        self.sums = np.zeros((len(horizons), auCount))
+        self.squares = np.zeros((len(horizons), auCount))
+        self.counts = np.ones((len(horizons), 1))
+        self.baselineSum = np.zeros(auCount)
+        self.baseline = np.zeros(auCount)
+        self.baselineCount = 0
+        # Features of the last timestep, with views of each kind of feature
+        self.features = np.zeros(self.inputSize)
+        blocks = np.split(self.features, np.cumsum([1, len(horizons), len(horizons), len(horizons)]) * auCount)
+        self.x = blocks[0]
+        self.ewma, self.means, self.variances = [block.reshape(len(horizons), auCount) for block in blocks[1:4]]
+        self.delta = blocks[4]
+        self.scratch = np.zeros((len(horizons), auCount))
+
+    # This function adds a timestep. The input is the 1D list of 17 AU intensities.
+    # The output is the 1D float32 array of the features of the timestep.
+    def update(self, timeStepAU):
+        x = self.x
+        x[:] = timeStepAU
+        # Take the timesteps falling out of each horizon off its sums
+        if self.count >= len(self.history):
+            old = self.history[self.leaving[self.head]]
+            self.sums -= old
+            old *= old
+            self.squares -= old
+        elif self.count:
+            leaving = self.count >= self.horizons
+            if leaving.any():
+                old = self.history[self.leaving[self.head][leaving]]
+                self.sums[leaving] -= old
+                self.squares[leaving] -= old * old
+        self.sums += x
+        np.multiply(x, x, out=self.scratch[0])
+        self.squares += self.scratch[0]
+        self.history[self.head] = x
+        self.head = (self.head + 1) % len(self.history)
+        self.count += 1
+        if self.head == 0:
+            self.recompute()
+        if self.count <= len(self.history):
+            self.counts[:, 0] = np.minimum(self.count, self.horizons)
+
+        if self.count == 1:
+            self.ewma[:] = x
+        else:
+            np.subtract(x, self.ewma, out=self.scratch)
+            self.scratch *= self.alphas
+            self.ewma += self.scratch
+        np.divide(self.sums, self.counts, out=self.means)
+        np.multiply(self.means, self.means, out=self.variances)
+        np.divide(self.squares, self.counts, out=self.scratch)
+        np.subtract(self.scratch, self.variances, out=self.variances)
+        np.maximum(self.variances, 0.0, out=self.variances)
+        if self.baselineCount < self.baselineTimesteps:
+            self.baselineSum += x
+            self.baselineCount += 1
+            np.divide(self.baselineSum, self.baselineCount, out=self.baseline)
+        np.subtract(x, self.baseline, out=self.delta)
+        return self.features.astype(np.float32)
+
+    # This function recomputes the sums from the timesteps in the ring buffer
+    def recompute(self):
+        size = len(self.history)
+        for i, horizon in enumerate(self.horizons):
+            window = self.history[(self.head - np.arange(1, min(self.count, horizon) + 1)) % size]
+            self.sums[i] = window.sum(axis=0)
+            self.squares[i] = (window * window).sum(axis=0)
+
+# This function computes the exponentially weighted moving average of every column
+# of a session, in blocks so it is a matrix product per block instead of a loop
+# over the timesteps. The inputs are the 2D array of values and alpha.
+def sessionEwma(values, alpha, blockSize=256):
+    ewma = np.empty_like(values)
+    if len(values) == 0:
+        return ewma
+    offsets = np.arange(blockSize)
+    # Weight of the value j timesteps back, and of the average before the block
+    lags = offsets[:, None] - offsets[None, :]
+    weights = np.where(lags >= 0, alpha * (1.0 - alpha) ** np.maximum(lags, 0), 0.0)
+    decay = (1.0 - alpha) ** (offsets + 1.0)
+    # The average starts at the first value
+    previous = values[0]
+    for start in range(0, len(values), blockSize):
+        block = values[start:start + blockSize]
+        rows = len(block)
+        ewma[start:start + rows] = weights[:rows, :rows] @ block + decay[:rows, None] * previous
+        previous = ewma[start + rows - 1]
+    return ewma
+
+# This function computes the features of every timestep of a session, the same as a
+# FeatureExtractor fed the timesteps one at a time. The inputs are the 2D array with
+# a row of 17 AU intensities per timestep, the horizons and the number of timesteps
+# the baseline is the mean of. The output is the 2D float32 array with a row of
+# features per timestep.
+def sessionFeatures(AUs, horizons=defaultHorizons, baselineTimesteps=defaultBaselineTimesteps):
+    x = np.asarray(AUs, dtype=np.float64).reshape(-1, auCount)
+    count = len(x)
+    index = np.arange(count)
+    cumulative = np.vstack([np.zeros(auCount), np.cumsum(x, axis=0)])
+    cumulativeSquares = np.vstack([np.zeros(auCount), np.cumsum(x * x, axis=0)])
+    ewmas, means, variances = [], [], []
+    for horizon in horizons:
+        ewmas.append(sessionEwma(x, 2.0 / (horizon + 1.0)))
+        low = np.maximum(index - horizon + 1, 0)
+        counts = (index + 1 - low)[:, None]
+        mean = (cumulative[index + 1] - cumulative[low]) / counts
+        means.append(mean)
+        variances.append(np.maximum((cumulativeSquares[index + 1] - cumulativeSquares[low]) / counts - mean * mean, 0.0))
+    baselineCounts = np.minimum(index + 1, baselineTimesteps)
+    baseline = cumulative[baselineCounts] / baselineCounts[:, None]
+    return np.hstack([x] + ewmas + means + variances + [x - baseline]).astype(np.float32)
+
+def main():
+    # Imported here so connectML.py does not import the session formats with this file
+    import connectML
+    import sessionLog
+    import sessionStore
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", type=str, help="session log recorded with replaySession.py")
+    parser.add_argument("--session", type=str, help="session store directory written by connectML.py --session-store")
+    parser.add_argument("--output", type=str, help="file to write the features, whether the robot was moving and the originatingTimes to (.npz)", required=True)
+    parser.add_argument("--horizons", type=int, nargs="+", help="horizons of the features in timesteps", default=defaultHorizons)
+    parser.add_argument("--baseline-timesteps", type=int, help="timesteps the participant's baseline is the mean of", default=defaultBaselineTimesteps)
+    parser.add_argument("--check", action="store_true", help="check the features against FeatureExtractor")
+    args = parser.parse_args()
+    if bool(args.log) == bool(args.session):
+        parser.error("give one of --log and --session")
+    if args.baseline_timesteps < 1 or min(args.horizons) < 1:
+        parser.error("--baseline-timesteps and --horizons must be at least 1")
+
+    if args.log:
+        records = sessionLog.readLog(args.log)
+        messages = np.array([connectML.decodeAUs(payload)[0] for topic, payload, originatingTime in records],
+            dtype=np.float32).reshape(-1, auCount + 1)
+        moving, AUs = messages[:, 0], messages[:, 1:]
+        originatingTimes = np.array([originatingTime for topic, payload, originatingTime in records], dtype=np.int64)
+    else:
+        session = sessionStore.openSession(args.session)
+        moving, AUs, originatingTimes = session["isMoving"], session["AUs"], session["originatingTime"]
+
+    start = time.perf_counter()
+    features = sessionFeatures(AUs, args.horizons, args.baseline_timesteps)
+    print("{} timesteps, {} features each, computed in {:.2f}s".format(len(features), features.shape[1], time.perf_counter() - start))
+    if args.check:
+        extractor = FeatureExtractor(args.horizons, args.baseline_timesteps)
+        start = time.perf_counter()
+        difference = max([float(np.max(np.abs(extractor.update(timeStepAU) - row))) for timeStepAU, row in zip(AUs, features)] + [0.0])
+        print("FeatureExtractor took {:.1f}us per timestep, largest difference {:.2e}".format(
+            (time.perf_counter() - start) / max(len(features), 1) * 1e6, difference))
+    np.savez(args.output, features=features, isMoving=np.asarray(moving), originatingTime=np.asarray(originatingTimes))
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,61 @@
+import struct
+
+import numpy as np
+
+# This file contains the binary wire format for the AUs PSI sends to connectML.py
+# and the replies it sends back. It is opt-in: a Detector build that sends binary
+# frames gets binary replies, older builds keep sending msgpack maps and get
+# msgpack replies. Both arrive on the same topics and are told apart by the first
+# two bytes of the payload (a msgpack map never starts with "AU").
+#
+# Every frame starts with the same 16 byte header, little endian:
+# magic (2 bytes): "AU"
+# version (1 byte): version of the format, currently 1
+# flags (1 byte): AU frames: none defined yet, must be 0
+#   reply frames: bit 0 set if a new error was detected
+# streamId (4 bytes): identifies the Detector instance, echoed in the reply
+# originatingTime (8 bytes): the timestep's originating time
+# An AU frame follows the header with 18 float32 (isMoving and 17 AUs), which are
+# read straight out of the received frame without copying. A reply frame follows it
+# with 4 float32 (isMoving, classification, classification confidence, is new error
+# detected), the same values as the msgpack reply string.
+
+magic = b"AU"
+version = 1
+header = struct.Struct("<2sBBIq")
+# Number of float32 values after the header in AU and reply frames
+auCount = 18
+replyValues = struct.Struct("<4f")
+auType = np.dtype("<f4")
+# Reply flag set when a new error was detected
+flagNewError = 1
+
+# This function checks if a payload is in the binary format
+def isBinary(payload):
+    return payload[:2] == magic
+
+# This function packs one timestep into an AU frame. The inputs are the 18 values
+# (isMoving and 17 AUs), the originating time and the stream id.
+def packAUs(AUsCalced, originatingTime, streamId=0):
+    return header.pack(magic, version, 0, streamId, originatingTime) + np.asarray(AUsCalced, dtype=auType).tobytes()
+
+# This function reads an AU frame. The outputs are a read-only float32 array of the
+# 18 values viewing the frame's memory, the originating time and the stream id.
+def unpackAUs(payload):
+    frameMagic, frameVersion, flags, streamId, originatingTime = header.unpack_from(payload)
+    if frameVersion != version:
+        raise ValueError("unsupported AU frame version {}".format(frameVersion))
+    return np.frombuffer(payload, auType, auCount, header.size), originatingTime, streamId
+
+# This function packs a reply frame. The inputs are the 1D array comprised of
+# [whether the robot is moving, classification of timestep, classification
+# confidence, is new error detected], the originating time and the stream id.
+def packReply(isError, originatingTime, streamId):
+    flags = flagNewError if isError[3] == 1 else 0
+    return header.pack(magic, version, flags, streamId, originatingTime) + replyValues.pack(*isError)
+
+# This function reads a reply frame. The outputs are the 4 reply values, the
+# originating time and the stream id.
+def unpackReply(payload):
+    frameMagic, frameVersion, flags, streamId, originatingTime = header.unpack_from(payload)
+    return list(replyValues.unpack_from(payload, header.size)), originatingTime, streamId
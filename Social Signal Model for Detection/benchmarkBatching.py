@@ -0,0 +1,70 @@
+import argparse
+import random
+import time
+
+import classifierBackends
+import connectML
+import latencyStats
+
+# This program compares classifying AU timesteps one at a time (connectML default
+# mode) against the micro-batched server mode. Both run in-process on the same
+# synthetic timesteps so only the inference and sliding window cost is measured,
+# not the network. Every "tick" each stream delivers one timestep, which is what
+# the server sees when many Detector instances publish at the same rate.
+
+# This function makes one synthetic 18 value message (isMoving and 17 AUs)
+def syntheticAUs():
+    return [1.0] + [random.uniform(0.0, 5.0) for i in range(connectML.inputSize)]
+
+# This function times the one at a time loop. The outputs are the seconds taken
+# for every tick (all streams handled once).
+def runSequential(model, ticks):
+    windows = [connectML.newWindow() for i in range(len(ticks[0]))]
+    tickTimes = []
+    for count, tick in enumerate(ticks):
+        start = time.perf_counter()
+        for AUsCalced, window in zip(tick, windows):
+            predictedClass, predictedConfidence = connectML.runML(model, AUsCalced[1:])
+            connectML.detectTimeStep(predictedClass, predictedConfidence, count, AUsCalced[0], window)
+        tickTimes.append(time.perf_counter() - start)
+    return tickTimes
+
+# This function times the batched loop, one forward pass per tick. The outputs are
+# the seconds taken for every tick.
+def runBatched(model, ticks):
+    windows = [connectML.newWindow() for i in range(len(ticks[0]))]
+    tickTimes = []
+    for count, tick in enumerate(ticks):
+        start = time.perf_counter()
+        predictedClasses, predictedConfidences = connectML.runMLBatch(model, [AUsCalced[1:] for AUsCalced in tick])
+        for AUsCalced, window, predictedClass, predictedConfidence in zip(tick, windows, predictedClasses, predictedConfidences):
+            connectML.detectTimeStep(predictedClass, predictedConfidence, count, AUsCalced[0], window)
+        tickTimes.append(time.perf_counter() - start)
+    return tickTimes
+
+def report(name, tickTimes, streams):
+    total = sum(tickTimes)
+    print("{:<10} streams={:<4} throughput={:>10.0f} timesteps/s  tick p50={:.3f}ms p95={:.3f}ms p99={:.3f}ms".format(
+        name, streams, streams * len(tickTimes) / total,
+        latencyStats.percentile(tickTimes, 50) * 1000, latencyStats.percentile(tickTimes, 95) * 1000, latencyStats.percentile(tickTimes, 99) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, help="path to the saved binary classifier", default="CaseFullDict")
+    parser.add_argument("--backend", type=str, choices=classifierBackends.backendNames, help="library used to run the binary classifier", default="torch")
+    parser.add_argument("--streams", type=int, nargs="+", help="numbers of simultaneous streams to try", default=[1, 8, 32, 128])
+    parser.add_argument("--ticks", type=int, help="timesteps per stream", default=300)
+    args = parser.parse_args()
+
+    random.seed(20)
+    model = classifierBackends.loadBackend(args.backend, args.model)
+    for streams in args.streams:
+        ticks = [[syntheticAUs() for s in range(streams)] for t in range(args.ticks)]
+        # Warm up both paths so lazy initialisation is not timed
+        runSequential(model, ticks[:5])
+        runBatched(model, ticks[:5])
+        report("sequential", runSequential(model, ticks), streams)
+        report("batched", runBatched(model, ticks), streams)
+
+if __name__ == "__main__":
+    main()
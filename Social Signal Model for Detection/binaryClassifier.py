@@ -0,0 +1,147 @@
+import os
+import torch
+import torch.nn as nn
+import random
+import numpy as np
+
+import classifierBackends
+from classifierBackends import inputSize
+
+# This file contains the PyTorch version of the binary classifier that classifies
+# AUs per timestep as either an error or a non-error timestep. It is only imported
+# when the torch backend is selected so the other backends do not pay for
+# importing torch.
+#
+# Two TorchScript builds of the classifier can be used instead of the eager model:
+# script: the model traced and frozen, with the weights folded in as constants
+# int8: the same with the linear layers dynamically quantized to int8 (per output
+#   channel weights, activations quantized on the fly). Quantized layers only run
+#   on the cpu.
+# They are built from the saved state dict the first time they are loaded and
+# cached next to it (CaseFullDict.script.pt and CaseFullDict.int8.pt for
+# CaseFullDict). A cache older than the state dict is rebuilt.
+
+# Checking to see if gpu is available
+gpuBoole = torch.cuda.is_available()
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+torch.manual_seed(20)
+random.seed(20)
+
+# Define the archetecture of the binary classifier
+# inputs is the number of inputs per timestep, 17 AUs unless the model was trained
+# on the temporal features of auFeatures.py
+class BinaryClassifier(nn.Module):
+  def __init__(self, inputs=inputSize):
+    super(BinaryClassifier, self).__init__()
+    self.layer1 = nn.Linear(inputs, 64)
+    self.relu = nn.ReLU()
+    self.layer2 = nn.Linear(64, 128)
+    self.layer3 = nn.Linear(128, 64)
+    self.outL = nn.Linear(64, 2)
+    self.dropout = nn.Dropout(p=0.1)
+    self.softmax = nn.Softmax()
+
+  def forward(self, x):
+    l1 = self.relu(self.layer1(x))
+    l2 = self.relu(self.layer2(l1))
+    l2 = self.dropout(l2)
+    l3 = self.relu(self.layer3(l2))
+    l3 = self.dropout(l3)
+    out = self.outL(l3)
+    out = self.softmax(out)
+    return out
+
+# This function loads the binary classifier from file. The input is the path
+# to the saved state dict. The output is the model in eval mode on the device.
+def loadModel(path):
+    # The saved weights live on the gpu, so they are mapped to whichever device is
+    # available.
+    stateDict = torch.load(path, map_location=device)
+    # Initialize model with as many inputs as it was trained on
+    model = BinaryClassifier(stateDict["layer1.weight"].shape[1])
+    model.load_state_dict(stateDict)
+    model.eval()
+    model.to(device)
+    return model
+
+# This function returns the number of inputs per timestep of a saved state dict
+def stateDictInputs(path):
+    return classifierBackends.readStateDict(path)["layer1.weight"].shape[1]
+
+# Suffixes of the cached TorchScript builds, by build
+scriptedSuffixes = {"script": ".script.pt", "int8": ".int8.pt"}
+
+# This function builds a TorchScript version of the binary classifier. The inputs
+# are the path to the saved state dict and the build, one of scriptedSuffixes. The
+# output is the frozen module.
+def buildScriptedModel(path, build):
+    model = loadModel(path)
+    buildDevice = device
+    if build == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model.cpu(),
+            {nn.Linear: torch.ao.quantization.per_channel_dynamic_qconfig}, dtype=torch.qint8)
+        buildDevice = torch.device('cpu')
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.zeros(1, stateDictInputs(path), device=buildDevice))
+    return torch.jit.freeze(traced)
+
+# This function loads a TorchScript build of the binary classifier, building and
+# caching it first if there is no up to date cache. The inputs are the path to the
+# saved state dict and the build. The output is the module.
+def loadScriptedModel(path, build):
+    cachePath = path + scriptedSuffixes[build]
+    if os.path.exists(cachePath) and os.path.getmtime(cachePath) >= os.path.getmtime(path):
+        return torch.jit.load(cachePath, map_location=device if build != "int8" else 'cpu')
+    model = buildScriptedModel(path, build)
+    # Written under another name and renamed so a crash never leaves half a file
+    torch.jit.save(model, cachePath + ".tmp")
+    os.replace(cachePath + ".tmp", cachePath)
+    return model
+
+# Classifier backend running the BinaryClassifier with PyTorch, on the gpu if
+# there is one.
+class TorchBackend:
+  def __init__(self, path):
+    print(gpuBoole)
+    self.model = loadModel(path)
+    self.onGpu = gpuBoole
+    self.inputSize = self.model.layer1.in_features
+
+  # This function classifies a set of 17 AUs (1 timestep) as either error or no
+  # error. The input is a 1D list of AU intensities. The outputs are the
+  # classification (1 for error, 0 for no error) and the weighted classfication
+  # confidence
+  def classify(self, timeStepAU):
+    intensitiesTimeStep = torch.tensor(timeStepAU)
+    with torch.no_grad():
+        intensitiesTimeStep = intensitiesTimeStep.view(-1, self.inputSize).to(torch.float)
+        if self.onGpu:
+            intensitiesTimeStep = intensitiesTimeStep.cuda()
+        # Classify the timestep
+        y_hat = self.model(intensitiesTimeStep)
+        predicted = y_hat.argmax(dim=1)
+    return float(predicted.item()), float((predicted * y_hat[:, 1]).item())
+
+  # This function classifies many timesteps in one forward pass. The input is a
+  # 2D list with one row of 17 AU intensities per timestep. The outputs are lists
+  # of the classifications and the weighted classification confidences.
+  def classifyBatch(self, batchAU):
+    intensitiesBatch = torch.from_numpy(np.asarray(batchAU, dtype=np.float32))
+    with torch.no_grad():
+        intensitiesBatch = intensitiesBatch.view(-1, self.inputSize)
+        if self.onGpu:
+            intensitiesBatch = intensitiesBatch.cuda()
+        # Classify all the timesteps
+        y_hat = self.model(intensitiesBatch)
+        predicted = y_hat.argmax(dim=1)
+        confidence = predicted * y_hat[:, 1]
+    return predicted.float().tolist(), confidence.tolist()
+
+# Classifier backend running a TorchScript build of the BinaryClassifier (see
+# above). The int8 build always runs on the cpu.
+class ScriptedBackend(TorchBackend):
+  def __init__(self, path, build):
+    self.model = loadScriptedModel(path, build)
+    self.onGpu = gpuBoole and build != "int8"
+    self.inputSize = stateDictInputs(path)
@@ -0,0 +1,179 @@
+import argparse
+import time
+
+import numpy as np
+
+import classifierBackends
+import connectML
+import sessionLog
+import slidingWindow
+
+# This program calibrates the threshold and size of the sliding window offline. It
+# classifies a recorded session once, in batch, and then evaluates the detections
+# the sliding window would make for a whole grid of (threshold, windowSize) pairs.
+#
+# The window is not run timestep by timestep. For one window size, the window sum
+# at every timestep is a difference of the cumulative sum of the confidences, with
+# the window cut at the last timestep the robot was not moving (the moving reset).
+# The estimated error start is the first error timestep in the window, read off a
+# reverse running minimum. Whether a timestep above the threshold is a new error
+# only depends on the previous timestep above the threshold (the duplicate
+# suppression), found with a running maximum, so every threshold is evaluated at
+# once. The result is checked against SlidingWindow for the setting in connectML.py.
+#
+# The session is a log recorded with replaySession.py and the labels are a text
+# file with the originatingTime of the start of every error, one per line (lines
+# starting with # are ignored). A detection is matched to the last error starting
+# before it if it comes within --max-delay seconds of its start. The first
+# detection matched to an error is counted, later ones are duplicates, and
+# detections matched to no error are false positives. For example:
+#   python calibrateWindow.py --log session.aulog --labels session.labels --csv sweep.csv
+
+# This function reads the originatingTimes of the error starts of a labels file
+def readLabels(path):
+    with open(path) as file:
+        return sorted(int(line.split(",")[0]) for line in file if line.strip() and not line.startswith("#"))
+
+# This function reads a session log. The outputs are the arrays of whether the robot
+# was moving, the AUs and the originatingTimes of the timesteps.
+def readSession(path):
+    records = sessionLog.readLog(path)
+    messages = [connectML.decodeAUs(payload)[0] for topic, payload, originatingTime in records]
+    AUs = np.array(messages, dtype=np.float32).reshape(-1, connectML.inputSize + 1)
+    originatingTimes = np.array([originatingTime for topic, payload, originatingTime in records], dtype=np.int64)
+    return AUs[:, 0] != 0, AUs[:, 1:], originatingTimes
+
+# This function computes the window sums and estimated error starts of one window
+# size at every timestep. The inputs are the confidences, the classifications, the
+# first timestep of the moving segment of every timestep and the window size.
+def windowSums(confidences, predicted, segmentStart, windowSize):
+    count = len(confidences)
+    index = np.arange(count)
+    cumulative = np.concatenate([[0.0], np.cumsum(confidences)])
+    # First timestep in the window, the window being emptied when the robot stops
+    low = np.maximum(segmentStart, index - windowSize + 1)
+    sums = cumulative[np.minimum(index + 1, count)] - cumulative[np.minimum(low, count)]
+    # First error timestep at or after every timestep
+    nextError = np.minimum.accumulate(np.where(predicted, index, count)[::-1])[::-1]
+    first = nextError[np.minimum(low, count - 1)]
+    # With no error timestep in the window the error is estimated to start at the detection
+    starts = np.where(first <= index, first, index)
+    return sums, starts
+
+# This function finds the new errors detected for many thresholds at once. The
+# inputs are whether the robot was moving, the window sums, the estimated error
+# starts and the thresholds. The output is a boolean array with a row per timestep
+# and a column per threshold of whether a new error is detected.
+def newErrors(moving, sums, starts, thresholds):
+    count = len(sums)
+    index = np.arange(count)[:, None]
+    above = moving[:, None] & (sums[:, None] >= thresholds[None, :])
+    # Previous timestep above the threshold, -1 for none
+    lastAbove = np.maximum.accumulate(np.where(above, index, -1), axis=0)
+    previous = np.vstack([np.full((1, len(thresholds)), -1), lastAbove[:-1]])
+    previousStart = np.concatenate([[-1], starts])[previous + 1]
+    return above & (index != previous + 1) & (starts[:, None] != previousStart + 1)
+
+# This function scores the detections of one setting against the labels. The inputs
+# are the timesteps of the detections, their estimated error starts, the timesteps
+# of the error starts, the originatingTimes and the largest delay in ticks. The
+# outputs are the number of errors detected, the false positives, the duplicates,
+# the mean detection delay and the mean absolute estimated start error, in ticks.
+def score(detections, starts, errors, originatingTimes, maxDelay):
+    if len(errors) == 0:
+        return 0, len(detections), 0, np.nan, np.nan
+    error = np.searchsorted(errors, detections, side="right") - 1
+    valid = error >= 0
+    valid[valid] = originatingTimes[detections[valid]] - originatingTimes[errors[error[valid]]] <= maxDelay
+    # Detections are in time order, so the first of every error is its detection
+    matched, first = np.unique(error[valid], return_index=True)
+    firstDetections = detections[valid][first]
+    firstStarts = starts[valid][first]
+    errorTimes = originatingTimes[errors[matched]]
+    if len(matched) == 0:
+        return 0, int(np.sum(~valid)), 0, np.nan, np.nan
+    return (len(matched), int(np.sum(~valid)), int(np.sum(valid)) - len(matched),
+        float(np.mean(originatingTimes[firstDetections] - errorTimes)),
+        float(np.mean(np.abs(originatingTimes[firstStarts] - errorTimes))))
+
+# This function runs the live SlidingWindow over the session. The output is the
+# arrays of the timesteps of the new errors and their estimated starts.
+def liveDetections(moving, predicted, confidences, windowSize, threshold):
+    window = slidingWindow.SlidingWindow(windowSize, threshold)
+    detections = []
+    for index in range(len(confidences)):
+        stopNum, estimatedStart = window.update(float(predicted[index]), float(confidences[index]), index, float(moving[index]))
+        if stopNum != -1 and estimatedStart != -1:
+            detections.append((stopNum, estimatedStart))
+    detections = np.array(detections, dtype=np.int64).reshape(-1, 2)
+    return detections[:, 0], detections[:, 1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", type=str, help="session log recorded with replaySession.py", required=True)
+    parser.add_argument("--labels", type=str, help="file with the originatingTime of every error start", required=True)
+    parser.add_argument("--model", type=str, help="path to the saved binary classifier", default="CaseFullDict")
+    parser.add_argument("--backend", type=str, choices=classifierBackends.backendNames, help="library used to run the binary classifier", default="numpy")
+    parser.add_argument("--thresholds", type=float, nargs=3, metavar=("FIRST", "LAST", "STEP"), help="thresholds to try", default=[1.0, 10.0, 0.5])
+    parser.add_argument("--window-sizes", type=int, nargs=2, metavar=("FIRST", "LAST"), help="window sizes to try", default=[3, 30])
+    parser.add_argument("--max-delay", type=float, help="seconds after an error start a detection still counts for it", default=5.0)
+    parser.add_argument("--ticks-per-ms", type=float, help="originatingTime units per millisecond", default=10000.0)
+    parser.add_argument("--top", type=int, help="number of settings to print", default=20)
+    parser.add_argument("--csv", type=str, help="file to write every setting to as CSV")
+    args = parser.parse_args()
+
+    moving, AUs, originatingTimes = readSession(args.log)
+    errors = np.searchsorted(originatingTimes, readLabels(args.labels))
+    errors = errors[errors < len(originatingTimes)]
+    ticksPerSecond = args.ticks_per_ms * 1000.0
+
+    start = time.perf_counter()
+    model = classifierBackends.loadBackend(args.backend, args.model)
+    predictedClasses, predictedConfidences = connectML.runMLBatch(model, AUs)
+    predicted = np.array(predictedClasses) == 1
+    confidences = np.array(predictedConfidences, dtype=np.float64)
+    classified = time.perf_counter()
+
+    count = len(confidences)
+    index = np.arange(count)
+    segmentStart = np.maximum.accumulate(np.where(moving, -1, index)) + 1
+    thresholds = np.arange(args.thresholds[0], args.thresholds[1] + args.thresholds[2] / 2, args.thresholds[2])
+    results = []
+    for windowSize in range(args.window_sizes[0], args.window_sizes[1] + 1):
+        sums, starts = windowSums(confidences, predicted, segmentStart, windowSize)
+        isNew = newErrors(moving, sums, starts, thresholds)
+        for column, threshold in enumerate(thresholds):
+            detections = np.flatnonzero(isNew[:, column])
+            results.append((float(threshold), windowSize) + score(detections, starts[detections], errors,
+                originatingTimes, args.max_delay * ticksPerSecond))
+    swept = time.perf_counter()
+    print("{} timesteps, {} errors: classified in {:.2f}s, {} settings evaluated in {:.2f}s".format(
+        count, len(errors), classified - start, len(results), swept - classified))
+
+    # Check the sweep against the live window for the current setting
+    sums, starts = windowSums(confidences, predicted, segmentStart, connectML.windowSize)
+    detections = np.flatnonzero(newErrors(moving, sums, starts, np.array([float(connectML.threshold)]))[:, 0])
+    liveStops, liveStarts = liveDetections(moving, predicted, confidences, connectML.windowSize, connectML.threshold)
+    if np.array_equal(detections, liveStops) and np.array_equal(starts[detections], liveStarts):
+        print("Sweep matches SlidingWindow for threshold={} windowSize={}".format(connectML.threshold, connectML.windowSize))
+    else:
+        print("MISMATCH with SlidingWindow for threshold={} windowSize={}: {} detections, SlidingWindow {}".format(
+            connectML.threshold, connectML.windowSize, len(detections), len(liveStops)))
+
+    # Most errors detected first, then fewest false positives, then shortest delay
+    results.sort(key=lambda row: (-row[2], row[3], row[5] if row[2] else 0.0))
+    print("{:>9} {:>6} {:>9} {:>6} {:>6} {:>9} {:>13}".format("threshold", "window", "detected", "fp", "dup", "delay s", "start err s"))
+    for threshold, windowSize, detected, falsePositives, duplicates, delay, startError in results[:args.top]:
+        current = " (current)" if threshold == connectML.threshold and windowSize == connectML.windowSize else ""
+        print("{:>9.2f} {:>6} {:>5}/{:<3} {:>6} {:>6} {:>9.2f} {:>13.2f}{}".format(threshold, windowSize, detected, len(errors),
+            falsePositives, duplicates, delay / ticksPerSecond, startError / ticksPerSecond, current))
+    if args.csv:
+        with open(args.csv, "w") as file:
+            file.write("threshold,windowSize,detected,errors,falsePositives,duplicates,delaySeconds,startErrorSeconds\n")
+            for threshold, windowSize, detected, falsePositives, duplicates, delay, startError in results:
+                file.write("{},{},{},{},{},{},{:.4f},{:.4f}\n".format(threshold, windowSize, detected, len(errors),
+                    falsePositives, duplicates, delay / ticksPerSecond, startError / ticksPerSecond))
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,189 @@
+import collections
+import time
+
+import zmq
+import msgpack
+
+import connectML
+
+# This file contains the fusion of the AUs of the two cameras of DetectorMain.cs
+# (connectML.py --fuse-cameras). Instead of DetectorMain choosing a camera, it
+# publishes the AUs of each camera on its own topic, as [whether the robot is
+# moving, face detection confidence, 17 AUs], and this stage joins the two streams
+# on originatingTime before classification.
+#
+# Frames wait in a join buffer per camera, ordered by originatingTime. A frame is
+# joined with the frame of the other camera nearest in originatingTime if they are
+# at most tolerance apart. A frame that gets no match is taken on its own (a single
+# view timestep) as soon as one of these holds, so memory and latency stay bounded
+# when a camera drops frames:
+# - the other camera has sent a frame more than tolerance after it, so no match
+#   can come any more
+# - it has waited maxWait seconds
+# - its camera's buffer is full
+#
+# A joined timestep is made from the two views with a fusion policy:
+# choose: the AUs of the view with the higher face detection confidence
+# merge: the AUs of the views averaged, weighted by their confidences
+# Views with a confidence below minConfidence are not used, and a timestep with no
+# usable view gets all zero AUs, like DetectorMain does. Timesteps are handed on
+# with the later originatingTime of their views, and a timestep not later than the
+# one before it is dropped, so the replies stay in order.
+
+# Topics the AUs of the two cameras are published on by PSI
+cameraTopics = ["AUs Camera1", "AUs Camera2"]
+fusionPolicies = ["choose", "merge"]
+# Seconds between reports of the fusion counters
+reportInterval = 60.0
+
+# One frame of one camera
+class View:
+    def __init__(self, message, originatingTime, arrival):
+        self.isMoving = message[0]
+        self.confidence = message[1]
+        self.AUs = message[2:]
+        self.originatingTime = originatingTime
+        self.arrival = arrival
+
+class CameraFusion:
+    # The inputs are:
+    # tolerance: Largest originatingTime difference of two joined frames
+    # maxWait: Seconds a frame waits for a match
+    # policy: One of fusionPolicies
+    # minConfidence: Smallest face detection confidence of a view that is used
+    # capacity: Frames the buffer of each camera holds
+    def __init__(self, tolerance, maxWait=0.2, policy="choose", minConfidence=0.5, capacity=32):
+        self.tolerance = tolerance
+        self.maxWait = maxWait
+        self.policy = policy
+        self.minConfidence = minConfidence
+        self.capacity = capacity
+        self.buffers = [collections.deque() for topic in cameraTopics]
+        # Fused timesteps waiting to be classified, as (originatingTime, message)
+        self.ready = collections.deque()
+        self.lastOriginatingTime = None
+        # Timesteps made from two views and from one, and timesteps dropped because
+        # they were out of order
+        self.joined = 0
+        self.single = 0
+        self.outOfOrder = 0
+
+    # This function adds a frame of a camera. The inputs are the number of the camera,
+    # the message ([isMoving, confidence, 17 AUs]), its originatingTime and the
+    # time.perf_counter() time it arrived at.
+    def add(self, camera, message, originatingTime, arrival):
+        view = View(message, originatingTime, arrival)
+        other = self.buffers[1 - camera]
+        # Frames of the other camera too old to match this or any later frame
+        while other and other[0].originatingTime < originatingTime - self.tolerance:
+            self.emit([other.popleft()])
+        # Nearest frame of the other camera within the tolerance
+        match = None
+        for candidate in other:
+            if candidate.originatingTime > originatingTime + self.tolerance:
+                break
+            if match is None or abs(candidate.originatingTime - originatingTime) < abs(match.originatingTime - originatingTime):
+                match = candidate
+        if match is not None:
+            # Frames of the other camera before the match can no longer be joined
+            while other[0] is not match:
+                self.emit([other.popleft()])
+            other.popleft()
+            self.emit([match, view])
+            return
+        own = self.buffers[camera]
+        if len(own) == self.capacity:
+            self.emit([own.popleft()])
+        own.append(view)
+
+    # This function takes the frames that have waited maxWait on their own
+    def expire(self, now):
+        for buffer in self.buffers:
+            while buffer and now - buffer[0].arrival >= self.maxWait:
+                self.emit([buffer.popleft()])
+
+    # This function returns the time.perf_counter() time the next frame expires at,
+    # None if no frame is waiting
+    def nextExpiry(self):
+        arrivals = [buffer[0].arrival for buffer in self.buffers if buffer]
+        return min(arrivals) + self.maxWait if arrivals else None
+
+    # This function fuses one or two views into a timestep ready to be classified
+    def emit(self, views):
+        if len(views) == 2:
+            self.joined += 1
+        else:
+            self.single += 1
+        originatingTime = max(view.originatingTime for view in views)
+        if self.lastOriginatingTime is not None and originatingTime <= self.lastOriginatingTime:
+            self.outOfOrder += 1
+            return
+        self.lastOriginatingTime = originatingTime
+        usable = [view for view in views if view.confidence >= self.minConfidence]
+        if not usable:
+            AUs = [0.0] * connectML.inputSize
+        elif self.policy == "merge":
+            total = sum(view.confidence for view in usable)
+            AUs = [sum(view.confidence * view.AUs[au] for view in usable) / total for au in range(connectML.inputSize)]
+        else:
+            AUs = list(max(usable, key=lambda view: view.confidence).AUs)
+        isMoving = max(view.isMoving for view in views)
+        self.ready.append((originatingTime, [isMoving] + AUs))
+
+    def counters(self):
+        return {"joined": self.joined, "single": self.single, "outOfOrder": self.outOfOrder,
+            "waiting": sum(len(buffer) for buffer in self.buffers)}
+
+# Stand-in for the subscribe socket of connectML.runSingle that receives the AUs of
+# both cameras and hands out fused timesteps as if PSI had sent them on auTopic
+class FusedInput:
+    # The inputs are the subscribe socket (subscribed to cameraTopics) and the
+    # CameraFusion
+    def __init__(self, socket, fusion):
+        self.socket = socket
+        self.fusion = fusion
+        self.nextReport = time.perf_counter() + reportInterval
+
+    # This function receives the frames waiting on the socket and expires the ones
+    # that waited too long
+    def pump(self):
+        while self.socket.poll(0):
+            [topic, payload] = connectML.receiveFrames(self.socket)
+            arrival = time.perf_counter()
+            AUsCalced, oT, streamId = connectML.decodeAUs(payload)
+            self.fusion.add(cameraTopics.index(topic.decode()), AUsCalced, oT, arrival)
+        now = time.perf_counter()
+        self.fusion.expire(now)
+        if now >= self.nextReport:
+            print("Camera fusion: " + " ".join("{}={}".format(name, value) for name, value in self.fusion.counters().items()))
+            self.nextReport = now + reportInterval
+
+    # This function waits up to timeout milliseconds (forever if None) for a fused
+    # timestep. The output is whether there is one.
+    def poll(self, timeout=None):
+        end = None if timeout is None else time.perf_counter() + timeout / 1000.0
+        while True:
+            self.pump()
+            if self.fusion.ready:
+                return True
+            now = time.perf_counter()
+            waits = [deadline - now for deadline in [end, self.fusion.nextExpiry()] if deadline is not None]
+            if end is not None and now >= end:
+                return False
+            self.socket.poll(max(0.0, min(waits)) * 1000 if waits else None)
+
+    def recv_multipart(self, copy=True):
+        self.poll()
+        originatingTime, message = self.fusion.ready.popleft()
+        return [connectML.auTopic.encode(), msgpack.dumps({u"message": message, u"originatingTime": originatingTime})]
+
+# This function makes the input of connectML.runSingle for fused cameras. The inputs
+# are the address PSI publishes on and the parsed connectML.py arguments.
+def connect(address, args):
+    socket = zmq.Context().socket(zmq.SUB)
+    for topic in cameraTopics:
+        socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+    socket.connect(address)
+    fusion = CameraFusion(args.fusion_tolerance * args.ticks_per_ms, args.fusion_wait / 1000.0,
+        args.fusion_policy, args.min_face_confidence)
+    return FusedInput(socket, fusion)
@@ -0,0 +1,216 @@
+import collections
+import os
+import pickle
+import zipfile
+
+import numpy as np
+
+# This file contains the backends that can run the binary classifier. Every
+# backend loads the weights once and offers the same two functions:
+# classify(timeStepAU) -> (classification, weighted confidence) for one timestep
+# classifyBatch(batchAU) -> (classifications, weighted confidences) for many
+# and the number of inputs per timestep it was trained on as inputSize (17 AUs, or
+# more for a model trained on the temporal features of auFeatures.py).
+# The torch backends (binaryClassifier.py: torch, and the TorchScript builds script
+# and int8) only import torch when they are selected.
+#
+# The numpy backend reads its weights from a weights file written next to the
+# saved state dict the first time it is loaded (CaseFullDict.weights.npy for
+# CaseFullDict). The file is a .npy holding one record with a field per
+# parameter, already transposed and float32, so later starts memory map it instead
+# of unzipping and unpickling the state dict.
+
+# A timestep comprised of 17 AUs is the input for the algorithm
+inputSize = 17
+# Names of the linear layers of the binary classifier, in order
+layerNames = ["layer1", "layer2", "layer3", "outL"]
+
+# NumPy types of the torch storages that can appear in a saved state dict
+storageTypes = {
+    "FloatStorage": np.float32,
+    "DoubleStorage": np.float64,
+    "HalfStorage": np.float16,
+    "LongStorage": np.int64,
+    "IntStorage": np.int32,
+    "ByteStorage": np.uint8,
+    "BoolStorage": np.bool_,
+}
+
+# Rebuilds a tensor saved by torch as a NumPy array
+def rebuildTensor(storage, storageOffset, size, stride, *args):
+    itemSize = storage.dtype.itemsize
+    return np.lib.stride_tricks.as_strided(storage[storageOffset:], shape=size,
+        strides=[s * itemSize for s in stride]).copy()
+
+# Unpickler for the state dicts written by torch.save that builds NumPy arrays
+# instead of tensors and refuses every other object.
+class StateDictUnpickler(pickle.Unpickler):
+    def __init__(self, archive, prefix, file):
+        super().__init__(file)
+        self.archive = archive
+        self.prefix = prefix
+
+    def find_class(self, module, name):
+        if module == "collections" and name == "OrderedDict":
+            return collections.OrderedDict
+        if module == "torch._utils" and name == "_rebuild_tensor_v2":
+            return rebuildTensor
+        if module == "torch" and name in storageTypes:
+            return storageTypes[name]
+        raise pickle.UnpicklingError("unexpected object {}.{} in state dict".format(module, name))
+
+    def persistent_load(self, pid):
+        # pid is ('storage', storage type, key, location, number of elements)
+        dtype, key = pid[1], pid[2]
+        return np.frombuffer(self.archive.read(self.prefix + "data/" + key), dtype=dtype)
+
+# This function reads a state dict saved with torch.save without importing torch.
+# The input is the path to the saved file. The output is a dict of parameter
+# name to NumPy array.
+def readStateDict(path):
+    with zipfile.ZipFile(path) as archive:
+        pickleName = [name for name in archive.namelist() if name.endswith("data.pkl")][0]
+        prefix = pickleName[:-len("data.pkl")]
+        with archive.open(pickleName) as file:
+            return dict(StateDictUnpickler(archive, prefix, file).load())
+
+# Suffix of the weights file written next to a saved state dict
+weightsSuffix = ".weights.npy"
+
+# This function converts a state dict to the arrays the numpy backend computes
+# with. The outputs are the lists of weights, transposed so a row of AUs is
+# multiplied as x @ W, and biases of the layers, as contiguous float32 arrays.
+def layerArrays(stateDict):
+    weights = [np.ascontiguousarray(stateDict[name + ".weight"].T, dtype=np.float32) for name in layerNames]
+    biases = [np.ascontiguousarray(stateDict[name + ".bias"], dtype=np.float32) for name in layerNames]
+    return weights, biases
+
+# This function writes the weights file of a state dict. The inputs are the path
+# to write to and the state dict.
+def writeWeights(path, stateDict):
+    weights, biases = layerArrays(stateDict)
+    fields = []
+    for name, weight, bias in zip(layerNames, weights, biases):
+        fields += [(name + ".weight", weight), (name + ".bias", bias)]
+    record = np.zeros(1, dtype=[(field, np.float32, array.shape) for field, array in fields])
+    for field, array in fields:
+        record[field][0] = array
+    # Written under another name and renamed so a crash never leaves half a file
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        np.save(file, record)
+    os.replace(temporary, path)
+
+# This function loads the weights of the binary classifier for the numpy backend.
+# The input is the path to a saved state dict or to a weights file. The weights
+# file of a state dict is written if it is missing or older than the state dict.
+# The outputs are the lists of weights and biases of the layers (see layerArrays).
+def loadWeights(path):
+    if not path.endswith(weightsSuffix):
+        weightsPath = path + weightsSuffix
+        if not os.path.exists(weightsPath) or os.path.getmtime(weightsPath) < os.path.getmtime(path):
+            stateDict = readStateDict(path)
+            try:
+                writeWeights(weightsPath, stateDict)
+            except OSError as e:
+                print("Could not write {}: {}".format(weightsPath, e))
+                return layerArrays(stateDict)
+        path = weightsPath
+    record = np.load(path, mmap_mode="r")
+    weights = [record[name + ".weight"][0].view(np.ndarray) for name in layerNames]
+    biases = [record[name + ".bias"][0].view(np.ndarray) for name in layerNames]
+    return weights, biases
+
+# Classifier backend evaluating the BinaryClassifier in eval mode with NumPy:
+# four matmuls, ReLU and a softmax. The weights are mapped from the weights file as
+# contiguous float32 arrays and every forward pass writes into preallocated buffers, so
+# classifying a timestep allocates nothing. The buffers are shared, so one
+# backend must only be used from one thread at a time.
+class NumpyBackend:
+    # The inputs are the path to the saved state dict or weights file and the
+    # largest batch to allocate for up front. arrays are the weights and biases (see
+    # layerArrays) to use instead of loading them from path.
+    def __init__(self, path, batchSize=256, arrays=None):
+        self.weights, self.biases = arrays if arrays is not None else loadWeights(path)
+        self.inputSize = self.weights[0].shape[0]
+        self.single = self.allocateBuffers(1)
+        self.batch = self.allocateBuffers(batchSize)
+
+    # This function allocates the input and per layer output buffers for up to
+    # rows timesteps
+    def allocateBuffers(self, rows):
+        return [np.empty((rows, self.inputSize), dtype=np.float32)] + \
+            [np.empty((rows, w.shape[1]), dtype=np.float32) for w in self.weights] + \
+            [np.empty((rows, 1), dtype=np.float32)]
+
+    # This function runs the classifier on the first rows of the input buffer.
+    # The output is the view of the buffer holding the softmax probabilities.
+    def forward(self, buffers, rows):
+        x = buffers[0][:rows]
+        for layer in range(len(self.weights)):
+            out = buffers[layer + 1][:rows]
+            np.matmul(x, self.weights[layer], out=out)
+            out += self.biases[layer]
+            # ReLU on the hidden layers, dropout does nothing in eval mode
+            if layer < len(self.weights) - 1:
+                np.maximum(out, 0, out=out)
+            x = out
+        # Softmax over the two classes
+        scratch = buffers[-1][:rows]
+        np.max(x, axis=1, keepdims=True, out=scratch)
+        x -= scratch
+        np.exp(x, out=x)
+        np.sum(x, axis=1, keepdims=True, out=scratch)
+        x /= scratch
+        return x
+
+    # This function classifies a set of 17 AUs (1 timestep) as either error or no
+    # error. The input is a 1D list of AU intensities. The outputs are the
+    # classification (1 for error, 0 for no error) and the weighted classfication
+    # confidence
+    def classify(self, timeStepAU):
+        self.single[0][0] = timeStepAU
+        y_hat = self.forward(self.single, 1)
+        # Ties go to class 0 like torch's argmax
+        if y_hat[0, 1] > y_hat[0, 0]:
+            return 1.0, float(y_hat[0, 1])
+        return 0.0, 0.0
+
+    # This function classifies many timesteps in one forward pass. The input is a
+    # 2D list with one row of 17 AU intensities per timestep. The outputs are lists
+    # of the classifications and the weighted classification confidences.
+    def classifyBatch(self, batchAU):
+        rows = len(batchAU)
+        if rows > len(self.batch[0]):
+            self.batch = self.allocateBuffers(rows)
+        self.batch[0][:rows] = batchAU
+        y_hat = self.forward(self.batch, rows)
+        predicted = y_hat[:, 1] > y_hat[:, 0]
+        return predicted.astype(np.float32).tolist(), np.where(predicted, y_hat[:, 1], 0).tolist()
+
+# This function runs a backend's first forward passes on zeros, one timestep and
+# one batch of batchSize timesteps, so the first timesteps received do not pay for
+# lazy initialisation (faulting in the mapped weights, torch picking its kernels,
+# buffers growing).
+def warmUp(model, batchSize=1):
+    timeStepAU = [0.0] * model.inputSize
+    for i in range(3):
+        model.classify(timeStepAU)
+        if batchSize > 1:
+            model.classifyBatch([timeStepAU] * batchSize)
+
+# Names of the backends that can be selected
+backendNames = ["torch", "numpy", "script", "int8"]
+
+# This function loads the binary classifier with the named backend. The inputs are
+# the backend name and the path to the saved state dict.
+def loadBackend(name, path):
+    if name == "torch":
+        import binaryClassifier
+        return binaryClassifier.TorchBackend(path)
+    if name == "numpy":
+        return NumpyBackend(path)
+    if name in ["script", "int8"]:
+        import binaryClassifier
+        return binaryClassifier.ScriptedBackend(path, name)
+    raise ValueError("unknown classifier backend {}".format(name))
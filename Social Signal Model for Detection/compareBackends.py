@@ -0,0 +1,101 @@
+import argparse
+import random
+import time
+
+import classifierBackends
+import connectML
+import latencyStats
+import sessionLog
+
+# This program checks that the classifier backends agree with the torch backend
+# and times them. Backends agree when every classification and every detection of
+# the sliding window matches and the weighted confidences differ by no more than
+# the tolerance. Every backend is timed classifying one timestep at a time
+# (latency percentiles and throughput) and in batches of --batch-size timesteps
+# (latency per batch and throughput).
+#
+# The timesteps are synthetic by default, or the AUs of a session recorded with
+# replaySession.py, which is what the agreement should be judged on. For example:
+#   python compareBackends.py --log session.aulog --backends numpy script int8
+
+# This function makes one synthetic row of whether the robot is moving and 17 AUs
+def syntheticAUs():
+    return [1.0] + [random.uniform(0.0, 5.0) for i in range(classifierBackends.inputSize)]
+
+# This function reads the rows of whether the robot is moving and 17 AUs of a
+# session log
+def recordedAUs(path):
+    return [list(connectML.decodeAUs(payload)[0]) for topic, payload, originatingTime in sessionLog.readLog(path)]
+
+# This function runs the sliding window over classified timesteps. The output is
+# the indices of the timesteps where a new error was detected.
+def detections(timesteps, results):
+    window = connectML.newWindow()
+    return [index for index, (AUsCalced, (predictedClass, predictedConfidence)) in enumerate(zip(timesteps, results))
+        if connectML.detectTimeStep(predictedClass, predictedConfidence, index, AUsCalced[0], window)[3] == 1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, help="path to the saved binary classifier", default="CaseFullDict")
+    parser.add_argument("--backends", type=str, nargs="+", help="backends to compare against torch", default=["numpy"])
+    parser.add_argument("--log", type=str, help="session log (see replaySession.py) to take the timesteps from instead of synthetic ones")
+    parser.add_argument("--timesteps", type=int, help="number of synthetic timesteps to classify", default=5000)
+    parser.add_argument("--batch-size", type=int, help="timesteps per batch when timing batched classification", default=64)
+    parser.add_argument("--tolerance", type=float, help="largest allowed confidence difference", default=1e-4)
+    args = parser.parse_args()
+
+    random.seed(20)
+    if args.log:
+        timesteps = recordedAUs(args.log)
+    else:
+        timesteps = [syntheticAUs() for i in range(args.timesteps)]
+    batchAU = [AUsCalced[1:] for AUsCalced in timesteps]
+    batches = [batchAU[i:i + args.batch_size] for i in range(0, len(batchAU), args.batch_size)]
+    print("{} timesteps, batches of {}".format(len(batchAU), args.batch_size))
+    print("{:<8} {:>9} {:>10} {:>10} {:>12} {:>12} {:>12}".format(
+        "backend", "load ms", "p50 us", "p95 us", "timesteps/s", "batch us", "batched/s"))
+    agreed = True
+    reference = None
+    for name in ["torch"] + args.backends:
+        start = time.perf_counter()
+        backend = classifierBackends.loadBackend(name, args.model)
+        loadTime = time.perf_counter() - start
+        classifierBackends.warmUp(backend, args.batch_size)
+
+        results = []
+        latencies = []
+        start = time.perf_counter()
+        for timeStepAU in batchAU:
+            callStart = time.perf_counter()
+            results.append(backend.classify(timeStepAU))
+            latencies.append(time.perf_counter() - callStart)
+        elapsed = time.perf_counter() - start
+
+        batchClasses, batchConfidences = [], []
+        start = time.perf_counter()
+        for batch in batches:
+            predictedClasses, predictedConfidences = backend.classifyBatch(batch)
+            batchClasses += predictedClasses
+            batchConfidences += predictedConfidences
+        batchElapsed = time.perf_counter() - start
+        print("{:<8} {:>9.1f} {:>10.1f} {:>10.1f} {:>12.0f} {:>12.1f} {:>12.0f}".format(name, loadTime * 1000,
+            latencyStats.percentile(latencies, 50) * 1e6, latencyStats.percentile(latencies, 95) * 1e6, len(batchAU) / elapsed,
+            batchElapsed / len(batches) * 1e6, len(batchAU) / batchElapsed))
+
+        if reference is None:
+            reference = results
+            referenceDetections = detections(timesteps, results)
+            continue
+        mismatched = sum(1 for (p, c), (rp, rc) in zip(results, reference) if p != rp)
+        mismatched += sum(1 for p, (rp, rc) in zip(batchClasses, reference) if p != rp)
+        difference = max(max(abs(c - rc) for (p, c), (rp, rc) in zip(results, reference)),
+            max(abs(c - rc) for c, (rp, rc) in zip(batchConfidences, reference)))
+        detected = detections(timesteps, results)
+        mismatchedDetections = len(set(detected) ^ set(referenceDetections))
+        print("{:<8} mismatched classes={} largest confidence difference={:.2e} detections={} (torch {}, {} mismatched)".format(
+            name, mismatched, difference, len(detected), len(referenceDetections), mismatchedDetections))
+        agreed = agreed and mismatched == 0 and mismatchedDetections == 0 and difference <= args.tolerance
+    return 0 if agreed else 1
+
+if __name__ == "__main__":
+    exit(main())
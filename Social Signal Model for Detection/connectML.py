@@ -1,120 +1,196 @@
+# Imported first so the start time it takes includes the other imports
+import startupTiming
+import time
+
+import atexit
+import os
+
 import zmq
 import msgpack
-import torch
-import torch.nn as nn
-import random
-import queue
+import argparse
+
+import auWireFormat
+import classifierBackends
+import latencyTrace
+import slidingWindow
 
 # This program detects if a potential error has occured based on AUs.
 # It contains a binary classier that classifies AUs per timestep as
 # either an error or a non-error timestep. Then classified timesteps
 # are fed into a sliding window that determines if an error has occured.
 # The program communicates with PSI.
+#
+# It runs in one of four modes:
+# - default: one Detector instance, one timestep classified per message
+# - server (--server): AU streams from many Detector instances are told apart by
+#   their topic suffix (e.g. "AUs Intensities/station2"). Timesteps arriving within
+#   a short window are classified together in one batched forward pass, each stream
+#   keeps its own sliding window, and replies go out on the matching
+#   "isNewError" topic (e.g. "isNewError/station2").
+# - pipelined (--async-pipeline): receiving, classifying and publishing run as
+#   separate stages with bounded queues, and frames that fall behind are handled
+#   with a late frame policy (see asyncPipeline.py). Streams are told apart like
+#   in server mode.
+# - worker pool (--workers N): streams are told apart like in server mode and
+#   shared out to N worker processes, each running server mode's batching for its
+#   streams (see workerPool.py).
+# The default mode can also take the AUs of the two cameras separately and join
+# them per timestep itself (--fuse-cameras, see cameraFusion.py). The default and
+# server modes can keep every timestep they handle (AUs, classification, window
+# sum and detection) in a session store on disk (--session-store, see
+# sessionStore.py). Except for the worker pool, a new classifier can be swapped in
+# while running, keeping the sliding windows (--model-dir, --control, see
+# modelReload.py). The default and server modes can also classify temporal features
+# of the AUs of every stream instead of the AUs of the timestep on their own, with a
+# model trained on them (--features, see auFeatures.py).
+#
+# Startup is kept short: heavy modules (torch, asyncio) are only imported by the
+# mode and backend that need them, and the model is warmed up with a few forward
+# passes before the first AUs are received. Once it is ready the program publishes
+# a heartbeat on the "detectorReady" topic every --heartbeat-interval seconds,
+# which DetectorMain.cs waits for before sending AUs, so the two can be
+# started in either order. The time from starting to being ready and to publishing
+# the first prediction are printed.
 
-# Subscribe socket that sends AUs per timestep and whether or not the robot is
-# moving as one 1D array of size 18 (isMoving and 17 AUs)
-input = zmq.Context().socket(zmq.SUB)
-input.setsockopt_string(zmq.SUBSCRIBE, "AUs Intensities")
-# Fill in the X's for the appropriate IP address to communicate between PSI and this program
-input.connect("tcp://XXX.X.X.X:X")
-
-# Publish to socket that outputs new error or not
-output = zmq.Context().socket(zmq.PUB)
-# Fill in the X's for the appropriate IP address to communicate between PSI and this program
-output.bind("tcp://XXX.X.X.X:X")
-
-# Checking to see if gpu is available
-gpuBoole = torch.cuda.is_available()
-print(gpuBoole)
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-torch.manual_seed(20)
-random.seed(20)
+# Topic the AUs per timestep are published on by PSI
+auTopic = "AUs Intensities"
+# Topic the error detection replies are published on
+replyTopic = "isNewError"
+# Topic the readiness heartbeat is published on
+readyTopic = "detectorReady"
+# Late frame policies of the pipelined mode (see asyncPipeline.py)
+latePolicies = ["none", "coalesce", "skip"]
+# originatingTime of the Unix epoch, in the 100ns ticks since 0001-01-01 PSI uses
+unixEpochTicks = 621355968000000000
 
 # A timestep comprised of 17 AUs is the input for the algorithm
-inputSize = 17
+inputSize = classifierBackends.inputSize
 # Threshold for the sliding window to determine if an error as occured
 threshold = 6
 # Size of the sliding window
 windowSize = 11
-# Represents the contents for the sliding window
-slidingWindowQPred = queue.Queue()
-slidingWindowQConf = queue.Queue()
-count = 0
-# Sum of the confidence classifications for the window
-runningWindowSum = 0
-# Previous error detected timestep
-prevStopNum = -1
-# Previous estimated error start
-prevStartReact = -1
-
-# Define the archetecture of the binary classifier
-class BinaryClassifier(nn.Module):
-  def __init__(self,):
-    super(BinaryClassifier, self).__init__()
-    self.layer1 = nn.Linear(inputSize, 64)
-    self.relu = nn.ReLU()
-    self.layer2 = nn.Linear(64, 128)
-    self.layer3 = nn.Linear(128, 64)
-    self.outL = nn.Linear(64, 2)
-    self.dropout = nn.Dropout(p=0.1)
-    self.softmax = nn.Softmax()
-
-  def forward(self, x):
-    l1 = self.relu(self.layer1(x))
-    l2 = self.relu(self.layer2(l1))
-    l2 = self.dropout(l2)
-    l3 = self.relu(self.layer3(l2))
-    l3 = self.dropout(l3)
-    out = self.outL(l3)
-    out = self.softmax(out)
-    return out
-
-# Initialize model
-model = BinaryClassifier()
-# Load the model
-model.load_state_dict(torch.load('CaseFullDict'))
-model.eval()
-model.to(device)
 
+# This function makes an empty sliding window for one stream of AUs. Each
+# Detector instance served by this program gets its own.
+def newWindow():
+    return slidingWindow.SlidingWindow(windowSize, threshold)
+
+# This function returns the current time as a PSI originatingTime
+def originatingTimeNow():
+    return unixEpochTicks + time.time_ns() // 100
+
+# Publishes the readiness heartbeat. Every beat is a message on readyTopic whose
+# message is the seconds since the detector became ready. Beats are sent by the
+# loop that owns the output socket, while it waits for AUs.
+class Heartbeat:
+    # The inputs are the publish socket and the seconds between beats
+    def __init__(self, output, interval):
+        self.output = output
+        self.interval = interval
+        self.readyAt = time.perf_counter()
+        self.nextBeat = self.readyAt
+
+    def beat(self):
+        now = time.perf_counter()
+        payload = {u"message": now - self.readyAt, u"originatingTime": originatingTimeNow()}
+        self.output.send_multipart([readyTopic.encode(), msgpack.dumps(payload)])
+        self.nextBeat = now + self.interval
+
+    # This function blocks until input has a message to receive, beating whenever
+    # a beat is due
+    def waitFor(self, input):
+        while True:
+            remaining = self.nextBeat - time.perf_counter()
+            if remaining <= 0:
+                self.beat()
+            elif input.poll(remaining * 1000):
+                return
 
 # This function reads in messages sent from PSI and outputs the 1D array of
-# calculated AUs for the timestep and the originating
-# that was sent through the message. This function is blocking.
-def readAUCalced():
-    [topic, payload] = input.recv_multipart()
+# calculated AUs for the timestep, the originating time and the stream id
+# that were sent through the message. This function is blocking.
+def readAUCalced(input):
+    AUsCalced, oT, streamId, topic = readAUCalcedStream(input)
+    return (AUsCalced, oT, streamId)
+
+# Same as readAUCalced but also outputs the topic the message arrived on, which
+# identifies the stream in server mode.
+def readAUCalcedStream(input):
+    [topic, payload] = receiveFrames(input)
+    received = latencyTrace.now()
+    AUsCalced, oT, streamId = decodeAUs(payload)
+    latencyTrace.mark("receive", oT, received)
+    latencyTrace.mark("unpack", oT)
+    return (AUsCalced, oT, streamId, topic)
+
+# This function receives a message without copying its payload out of the socket's
+# frame, so a binary AU frame is decoded in place. The outputs are the topic and
+# the payload, a memoryview of the frame (or the bytes of a stand-in socket).
+def receiveFrames(input):
+    [topic, payload] = input.recv_multipart(copy=False)
+    if isinstance(payload, zmq.Frame):
+        return [topic.bytes, payload.buffer]
+    return [topic, payload]
+
+# This function decodes the payload of a message sent from PSI, either a msgpack
+# map or a binary frame (see auWireFormat.py). The outputs are the 1D array of
+# calculated AUs, the originating time and the stream id, which is None for msgpack
+# messages.
+def decodeAUs(payload):
+    if auWireFormat.isBinary(payload):
+        return auWireFormat.unpackAUs(payload)
     message = msgpack.unpackb(payload, raw=True)
-    AUsCalced = message[b"message"]
-    oT = message[b"originatingTime"]
-    return (AUsCalced, oT)
+    return (message[b"message"], message[b"originatingTime"], None)
 
-# This function sends a message to PSI indicating whether an error has been
+# This function encodes a message to PSI indicating whether an error has been
 # detected. The inputs are:
 # isError: 1D array comprised of [whether the robot is moving, classification of
 # timestep, classification confidence, is new error detected]
 # originatingTime: Time recieved from the incoming message PSI sent that this one is replying to.
-def writeCommand(isError, originatingTime):
+# streamId: Stream id of the binary frame being replied to, None to reply in msgpack
+# The output is the payload of the message.
+def encodeReply(isError, originatingTime, streamId=None):
+    if streamId is not None:
+        return auWireFormat.packReply(isError, originatingTime, streamId)
     isNewError = ",".join([str(i) for i in isError])
     payload = {u"message":isNewError, u"originatingTime":originatingTime}
-    output.send_multipart(["isNewError".encode(), msgpack.dumps(payload)])
+    return msgpack.dumps(payload)
+
+# This function sends a message to PSI indicating whether an error has been
+# detected. The inputs are the output socket, the inputs of encodeReply and the
+# topic to publish the reply on.
+def writeCommand(output, isError, originatingTime, topic=replyTopic.encode(), streamId=None):
+    output.send_multipart([topic, encodeReply(isError, originatingTime, streamId)])
+    latencyTrace.mark("publish", originatingTime)
+    startupTiming.reportFirstReply()
+
+# This function decodes a reply sent by writeCommand. The outputs are the 1D array
+# comprised of [whether the robot is moving, classification of timestep,
+# classification confidence, is new error detected] and the originating time.
+def decodeReply(payload):
+    if auWireFormat.isBinary(payload):
+        isError, oT, streamId = auWireFormat.unpackReply(payload)
+        return (isError, oT)
+    message = msgpack.unpackb(payload, raw=True)
+    return ([float(i) for i in message[b"message"].split(b",")], message[b"originatingTime"])
 
 # This function is the binary classifier and classifies a set of 17 AUs (1 timestep)
 # as either error or no error. The arguments are:
-# model: The classifier loaded from file.
+# model: The classifier backend loaded from file.
 # timeStepAU: 1D list of AU intensities
-# gpuBoole: Flag indicating the gpu
 # The outputs are the classification (1 for error, 0 for no error) and the weighted
 # classfication confidence
-def runML(model, timeStepAU, gpuBoole):
-    intensitiesTimeStep = torch.tensor(timeStepAU)
-    with torch.no_grad():
-        intensitiesTimeStep = intensitiesTimeStep.view(-1, inputSize).to(torch.float)
-        if gpuBoole:
-            intensitiesTimeStep = intensitiesTimeStep.cuda()
-        # Classify the timestep
-        y_hat = model(intensitiesTimeStep)
-        predicted = y_hat.argmax(dim=1)
-    return float(predicted.item()), float((predicted * y_hat[:, 1]).item())
+def runML(model, timeStepAU):
+    return model.classify(timeStepAU)
+
+# This function is the batched version of runML and classifies many timesteps,
+# possibly from different streams, in one forward pass. The arguments are:
+# model: The classifier backend loaded from file.
+# batchAU: 2D list with one row of 17 AU intensities per timestep
+# The outputs are lists of the classifications and the weighted classification
+# confidences, in the same order as the rows of batchAU
+def runMLBatch(model, batchAU):
+    return model.classifyBatch(batchAU)
 
 # This function is the sliding window that determines if a new error has been
 # detected. A new error can only be detected if the robot is moving (specific to
@@ -123,79 +199,231 @@ def runML(model, timeStepAU, gpuBoole):
 # confidence: Classification confidence
 # index: Current timestep index over the entire data collection
 # isMoving: Flag indicating if the robot is moving at the timestep
+# window: Sliding window of the stream the timestep belongs to
 # The outputs are the timestep index if it was a new error and estimated index
 # of error start. If it is not a new error, then the function outputs -1 for both.
-def postPredictionWindow(predicted, confidence, index, isMoving):
-    global runningWindowSum
-    global prevStopNum
-    global prevStartReact
-
-    # Check if the robot is not moving
-    if isMoving == 0:
-        # Reset the sliding window because the robot is no longer moving
-        slidingWindowQPred.queue.clear()
-        slidingWindowQConf.queue.clear()
-        runningWindowSum = 0
-    else:
-        # Check if the window is the correct size
-        if slidingWindowQPred.qsize() == windowSize:
-            # Remove oldest value from the queue
-            p = slidingWindowQPred.get()
-            c = slidingWindowQConf.get()
-            # Remove that value from the running weighted sum
-            runningWindowSum = runningWindowSum - c
-        # Add the currently newest classified value into the window
-        slidingWindowQPred.put(predicted)
-        slidingWindowQConf.put(confidence)
-        # Add the new timestep classification to the running sum
-        runningWindowSum = runningWindowSum + confidence
-
-        # Check if the running sum is the above the threshold to see if error
-        # is detected
-        if runningWindowSum >= threshold:
-            # Set the detected error timestep
-            stopNum = index
-            queueCount = 0
-            # Iterate through queue and to determine the estimated error start
-            for i in slidingWindowQPred.queue:
-                # Check if the current timestep in the window is an error one
-                if i == 1:
-                    # Calculate the current estimated error start for the detection
-                    startReact = index - (slidingWindowQPred.qsize() - queueCount) + 1
-                    break
-                queueCount += 1
-                
-            # Check if the estimated error start and detected error timestep are
-            #within one of the previously indicated one to see if it is the same
-            # error.
-            if stopNum != prevStopNum + 1 and startReact != prevStartReact + 1:
-                prevStopNum = stopNum
-                prevStartReact = startReact
-                return stopNum, startReact
-            prevStopNum = stopNum
-            prevStartReact = startReact
-    # return -1 -1 if no error was detected
-    return -1, -1
-
-# Continous while that waits for AU timesteps to come in
-while True:
-    AUsCalced, oT = readAUCalced()
-    # Extract the 17 AUs from the message payload
-    timeStepAU = AUsCalced[1:]
-    # Extract whether the robot was moving
-    isMoving = AUsCalced[0]
-    # Calls function to run the binary classifier on the AUs
-    predictedClass, predictedConfidence = runML(model, timeStepAU, gpuBoole)
+def postPredictionWindow(predicted, confidence, index, isMoving, window):
+    return window.update(predicted, confidence, index, isMoving)
+
+# This function runs the sliding window for one classified timestep and builds
+# the reply sent back to PSI. The inputs are the outputs of runML for the
+# timestep, the timestep index, whether the robot is moving and the stream's
+# sliding window. The output is the 1D array passed to writeCommand.
+def detectTimeStep(predictedClass, predictedConfidence, index, isMoving, window):
     # Calls function to run the sliding window on the output from the binary classifier
-    stopNum, estimatedStart = postPredictionWindow(predictedClass, predictedConfidence, count, isMoving)
+    stopNum, estimatedStart = postPredictionWindow(predictedClass, predictedConfidence, index, isMoving, window)
     # Checks if a new error was detected
     if stopNum != -1 and estimatedStart != -1:
-        # Calls function to send reply to PSI stating the error was detected
-        writeCommand([float(isMoving), float(predictedClass), float(predictedConfidence), float(1)], oT)
-    else:
-        # Calls function to send reply to PSI stating no error was detected
-        writeCommand([float(isMoving), float(predictedClass), float(predictedConfidence), float(0)], oT)
-    count += 1
+        return [float(isMoving), float(predictedClass), float(predictedConfidence), float(1)]
+    return [float(isMoving), float(predictedClass), float(predictedConfidence), float(0)]
+
+# This function opens a session store (see sessionStore.py) that is closed when the
+# program exits. The inputs are the directory and the topic of the stream, whose
+# suffix names the subdirectory of its session in server mode.
+def openStore(directory, topic=None):
+    import sessionStore
+    if topic is not None:
+        directory = os.path.join(directory, topic[len(auTopic):].decode().strip("/") or "default")
+    store = sessionStore.SessionStore(directory)
+    atexit.register(store.close)
+    return store
+
+# Continous while that waits for AU timesteps to come in and handles them one at a time.
+# heartbeat is the readiness Heartbeat to beat while waiting, None for none. store is
+# the session store every timestep is kept in, None for none. features is the
+# auFeatures.FeatureExtractor making the input of the classifier, None to classify
+# the AUs.
+def runSingle(input, output, model, heartbeat=None, store=None, features=None):
+    window = newWindow()
+    count = 0
+    while True:
+        if heartbeat is not None:
+            heartbeat.waitFor(input)
+        AUsCalced, oT, streamId = readAUCalced(input)
+        # Extract the 17 AUs from the message payload
+        timeStepAU = AUsCalced[1:]
+        if features is not None:
+            timeStepAU = features.update(timeStepAU)
+        # Extract whether the robot was moving
+        isMoving = AUsCalced[0]
+        # Calls function to run the binary classifier on the AUs
+        predictedClass, predictedConfidence = runML(model, timeStepAU)
+        latencyTrace.mark("inference", oT)
+        reply = detectTimeStep(predictedClass, predictedConfidence, count, isMoving, window)
+        latencyTrace.mark("window", oT)
+        if store is not None:
+            store.append(AUsCalced, predictedClass, predictedConfidence, window.runningWindowSum, reply[3], oT)
+        # Calls function to send reply to PSI stating whether the error was detected
+        writeCommand(output, reply, oT, streamId=streamId)
+        count += 1
+
+# Continous while that waits for AU timesteps from many streams to come in. After the
+# first timestep arrives it keeps collecting timesteps for up to batchWindow seconds
+# (or until maxBatch of them are waiting) and then classifies them all at once.
+# heartbeat is as in runSingle. storeDirectory is the directory to keep a session
+# store of every stream in, None for none. newFeatures makes the
+# auFeatures.FeatureExtractor of a stream, None to classify the AUs.
+def runServer(input, output, model, batchWindow, maxBatch, heartbeat=None, storeDirectory=None, newFeatures=None):
+    poller = zmq.Poller()
+    poller.register(input, zmq.POLLIN)
+    # Sliding window, timestep count, reply topic, session store and feature
+    # extractor of every stream seen so far
+    streams = {}
+    while True:
+        # Block until a timestep arrives, then collect the rest of the batch
+        if heartbeat is not None:
+            heartbeat.waitFor(input)
+        pending = [readAUCalcedStream(input)]
+        deadline = time.perf_counter() + batchWindow
+        while len(pending) < maxBatch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not poller.poll(remaining * 1000):
+                break
+            pending.append(readAUCalcedStream(input))
 
+        for AUsCalced, oT, streamId, topic in pending:
+            if topic not in streams:
+                streams[topic] = [newWindow(), 0, replyTopic.encode() + topic[len(auTopic):],
+                    openStore(storeDirectory, topic) if storeDirectory else None, newFeatures() if newFeatures else None]
+        batchAU = [AUsCalced[1:] for AUsCalced, oT, streamId, topic in pending]
+        if newFeatures is not None:
+            # In arrival order so every stream's features see its own timesteps in order
+            batchAU = [streams[topic][4].update(timeStepAU) for timeStepAU, (AUsCalced, oT, streamId, topic) in zip(batchAU, pending)]
+        # Calls function to run the binary classifier on all the collected timesteps
+        predictedClasses, predictedConfidences = runMLBatch(model, batchAU)
+        classified = latencyTrace.now()
 
+        # Timesteps are handled in arrival order so every stream's window sees its own
+        # timesteps in order
+        for (AUsCalced, oT, streamId, topic), predictedClass, predictedConfidence in zip(pending, predictedClasses, predictedConfidences):
+            stream = streams[topic]
+            latencyTrace.mark("inference", oT, classified)
+            reply = detectTimeStep(predictedClass, predictedConfidence, stream[1], AUsCalced[0], stream[0])
+            latencyTrace.mark("window", oT)
+            if stream[3] is not None:
+                stream[3].append(AUsCalced, predictedClass, predictedConfidence, stream[0].runningWindowSum, reply[3], oT)
+            writeCommand(output, reply, oT, stream[2], streamId)
+            stream[1] += 1
+
+def parseArguments(parser = argparse.ArgumentParser()):
+    # Fill in the X's for the appropriate IP address to communicate between PSI and this program
+    parser.add_argument("--input", type=str, help="address PSI publishes the AUs on", default="tcp://XXX.X.X.X:X")
+    parser.add_argument("--output", type=str, help="address to publish error detections on", default="tcp://XXX.X.X.X:X")
+    parser.add_argument("--model", type=str, help="path to the saved binary classifier", default="CaseFullDict")
+    parser.add_argument("--backend", type=str, choices=classifierBackends.backendNames, help="library used to run the binary classifier", default="torch")
+    parser.add_argument("--server", action="store_true", help="serve AU streams from many Detector instances with batched inference")
+    parser.add_argument("--batch-window", type=float, help="milliseconds to collect timesteps for one batch in server mode", default=5.0)
+    parser.add_argument("--max-batch", type=int, help="largest number of timesteps classified in one batch in server mode", default=256)
+    parser.add_argument("--workers", type=int, help="serve AU streams from many Detector instances with a pool of this many worker processes", default=0)
+    parser.add_argument("--async-pipeline", action="store_true", help="run receiving, classifying and publishing as separate stages")
+    parser.add_argument("--late-policy", type=str, choices=latePolicies, help="what the pipeline does with frames that fall behind", default="coalesce")
+    parser.add_argument("--max-lag", type=float, help="milliseconds a frame can be behind the newest frame of its stream before it is late", default=1000.0)
+    parser.add_argument("--ticks-per-ms", type=float, help="originatingTime units per millisecond", default=10000.0)
+    parser.add_argument("--queue-size", type=int, help="frames each queue between pipeline stages holds", default=64)
+    parser.add_argument("--hwm", type=int, help="messages the pipeline's subscribe socket holds before dropping", default=1000)
+    parser.add_argument("--stats-interval", type=float, help="seconds between pipeline counter reports, 0 for none", default=10.0)
+    parser.add_argument("--fuse-cameras", action="store_true", help="receive the AUs of both cameras and join them per timestep (default mode only)")
+    parser.add_argument("--fusion-tolerance", type=float, help="milliseconds apart the frames of the two cameras can be to be joined", default=150.0)
+    parser.add_argument("--fusion-wait", type=float, help="milliseconds a camera frame waits for the other camera's", default=200.0)
+    parser.add_argument("--fusion-policy", type=str, choices=["choose", "merge"], help="how the two views of a timestep are fused", default="choose")
+    parser.add_argument("--min-face-confidence", type=float, help="smallest face detection confidence of a view that is used", default=0.5)
+    parser.add_argument("--session-store", type=str, help="directory to keep every timestep handled in, a new run directory inside it per run (default and server modes, see sessionStore.py)")
+    parser.add_argument("--features", action="store_true", help="classify temporal features of the AUs with a model trained on them (default and server modes, see auFeatures.py)")
+    parser.add_argument("--feature-horizons", type=int, nargs="+", help="horizons of the temporal features in timesteps", default=[3, 9, 30])
+    parser.add_argument("--baseline-timesteps", type=int, help="timesteps a participant's baseline for the temporal features is the mean of", default=90)
+    parser.add_argument("--model-dir", type=str, help="directory to watch for new models to swap in (see modelReload.py)")
+    parser.add_argument("--control", type=str, help="address to receive reload and rollback messages on (see modelReload.py)")
+    parser.add_argument("--reload-validation", type=str, help="session log whose first timesteps new models are validated on, the last timesteps classified by default")
+    parser.add_argument("--reload-min-agreement", type=float, help="smallest share of the held-out classes a new model must agree on", default=0.8)
+    parser.add_argument("--heartbeat-interval", type=float, help="seconds between readiness heartbeats, 0 for none", default=1.0)
+    parser.add_argument("--trace", type=str, help="file to append per stage latency marks to (see traceReport.py)")
+    args = parser.parse_args()
+    if args.baseline_timesteps < 1 or min(args.feature_horizons) < 1:
+        parser.error("--baseline-timesteps and --feature-horizons must be at least 1")
+    return args
+
+def main():
+    args = parseArguments()
+    if args.fuse_cameras and (args.server or args.async_pipeline or args.workers > 0):
+        print("--fuse-cameras only works in the default mode")
+        return
+    if args.session_store and (args.async_pipeline or args.workers > 0):
+        print("--session-store only works in the default and server modes")
+        return
+    if args.features and (args.async_pipeline or args.workers > 0):
+        print("--features only works in the default and server modes")
+        return
+    if (args.model_dir or args.control) and args.workers > 0:
+        print("--model-dir and --control do not work with --workers")
+        return
+    if args.workers > 0 and args.backend != "numpy":
+        print("--workers only runs the numpy backend, start it with --backend numpy")
+        return
+    if args.trace:
+        latencyTrace.start(args.trace, "ml")
+
+    # Publish to socket that outputs new error or not
+    output = zmq.Context().socket(zmq.PUB)
+    output.bind(args.output)
+
+    if args.workers > 0:
+        import workerPool
+        workerPool.run(args.input, output, args)
+        return
+
+    # Subscribe socket that sends AUs per timestep and whether or not the robot is
+    # moving as one 1D array of size 18 (isMoving and 17 AUs). In server mode every
+    # topic starting with auTopic is received. It is connected before the model is
+    # loaded so it is subscribed by the time the readiness heartbeat goes out.
+    # With --fuse-cameras the AUs of the two cameras are received instead and joined
+    # into one timestep (see cameraFusion.py).
+    if args.fuse_cameras:
+        import cameraFusion
+        input = cameraFusion.connect(args.input, args)
+    elif not args.async_pipeline:
+        input = zmq.Context().socket(zmq.SUB)
+        input.setsockopt_string(zmq.SUBSCRIBE, auTopic)
+        input.connect(args.input)
+
+    imported = time.perf_counter()
+    model = classifierBackends.loadBackend(args.backend, args.model)
+    loaded = time.perf_counter()
+    # Only the modes classifying in batches need the batch size warmed up
+    classifierBackends.warmUp(model, args.max_batch if args.server or args.async_pipeline else 1)
+    ready = time.perf_counter()
+    newFeatures = None
+    if args.features:
+        import auFeatures
+        newFeatures = lambda: auFeatures.FeatureExtractor(args.feature_horizons, args.baseline_timesteps)
+        if model.inputSize != auFeatures.featureCount(len(args.feature_horizons)):
+            print("The model takes {} inputs per timestep, the features of {} horizons are {}".format(
+                model.inputSize, len(args.feature_horizons), auFeatures.featureCount(len(args.feature_horizons))))
+            return
+    elif model.inputSize != inputSize:
+        print("The model takes {} inputs per timestep, start it with --features if it was trained on temporal features".format(model.inputSize))
+        return
+    startTime = startupTiming.startTime
+    print("Ready {:.1f}ms after start (imports {:.1f}ms, model {:.1f}ms, warm-up {:.1f}ms)".format(
+        (ready - startTime) * 1000, (imported - startTime) * 1000, (loaded - imported) * 1000, (ready - loaded) * 1000))
+    if args.model_dir or args.control:
+        import modelReload
+        model = modelReload.start(model, args)
+    # Every run keeps its session in a new directory, so it is not joined to an earlier run's
+    storeDirectory = None
+    if args.session_store:
+        import sessionStore
+        storeDirectory = sessionStore.newRunDirectory(args.session_store)
+        print("Keeping the session in {}".format(storeDirectory))
+    heartbeat = Heartbeat(output, args.heartbeat_interval) if args.heartbeat_interval > 0 else None
+
+    if args.async_pipeline:
+        import asyncPipeline
+        asyncPipeline.run(args.input, output, model, args, heartbeat)
+    elif args.server:
+        runServer(input, output, model, args.batch_window / 1000.0, args.max_batch, heartbeat, storeDirectory, newFeatures)
+    else:
+        runSingle(input, output, model, heartbeat, openStore(storeDirectory) if storeDirectory else None,
+            newFeatures() if newFeatures else None)
 
+if __name__ == "__main__":
+    main()
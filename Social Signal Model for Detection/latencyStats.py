@@ -0,0 +1,7 @@
+# This file contains the statistics shared by the benchmarks and latency reports of
+# the social signal model.
+
+# This function returns the value at percentile p (0-100) of a list of numbers
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
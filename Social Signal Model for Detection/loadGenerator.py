@@ -0,0 +1,227 @@
+import argparse
+import collections
+import heapq
+import math
+import random
+import time
+
+import zmq
+import msgpack
+
+import auWireFormat
+import connectML
+
+# This program stands in for PSI to load test connectML.py. It publishes synthetic
+# AU timesteps (isMoving and 17 AUs) for a number of simultaneous participants at a
+# fixed rate, subscribes to the replies and reports the round trip latency, the
+# messages that never got a reply and the CPU and memory use of the detector.
+#
+# With one participant the timesteps go out on "AUs Intensities" like PSI does.
+# With more, every participant gets its own topic ("AUs Intensities/p0", ...) and
+# connectML.py has to run with --server.
+#
+# Example soak run of 300 participants at 3 Hz for an hour against a local detector:
+#   python connectML.py --server --input tcp://127.0.0.1:5555 --output tcp://127.0.0.1:5556
+#   python loadGenerator.py --participants 300 --duration 3600 --pid <pid of connectML.py>
+
+# One synthetic participant. The robot alternates between moving and not moving
+# phases, and while it moves the participant sometimes reacts to an error with a
+# burst of raised AU intensities.
+class Participant:
+    def __init__(self, name, rate, rng):
+        self.topic = (connectML.auTopic + name).encode()
+        self.rng = rng
+        self.rate = rate
+        # Every participant has its own resting AU intensities
+        self.baseline = [rng.uniform(0.0, 1.0) for i in range(connectML.inputSize)]
+        self.intensities = list(self.baseline)
+        self.isMoving = 1.0
+        self.phaseLeft = self.phaseLength(True)
+        self.burstLeft = 0
+        self.burstAUs = []
+
+    # Number of timesteps a moving (10-40s) or not moving (3-10s) phase lasts
+    def phaseLength(self, isMoving):
+        return int(self.rng.uniform(10.0, 40.0) * self.rate) if isMoving else int(self.rng.uniform(3.0, 10.0) * self.rate)
+
+    # This function advances the participant by one timestep. The output is the 18
+    # value message (isMoving and 17 AUs).
+    def step(self):
+        self.phaseLeft -= 1
+        if self.phaseLeft <= 0:
+            self.isMoving = 0.0 if self.isMoving else 1.0
+            self.phaseLeft = self.phaseLength(self.isMoving == 1.0)
+            self.burstLeft = 0
+        # Start an error reaction burst of 2-6s on a few AUs about once a minute
+        if self.isMoving and self.burstLeft == 0 and self.rng.random() < 1.0 / (60.0 * self.rate):
+            self.burstLeft = int(self.rng.uniform(2.0, 6.0) * self.rate)
+            self.burstAUs = self.rng.sample(range(connectML.inputSize), 5)
+        target = list(self.baseline)
+        if self.burstLeft:
+            self.burstLeft -= 1
+            for au in self.burstAUs:
+                target[au] += self.rng.uniform(1.5, 3.5)
+        # Intensities drift smoothly towards the target with some noise
+        for au in range(connectML.inputSize):
+            value = 0.7 * self.intensities[au] + 0.3 * target[au] + self.rng.gauss(0.0, 0.1)
+            self.intensities[au] = min(5.0, max(0.0, value))
+        return [self.isMoving] + self.intensities
+
+# Samples the CPU and memory use of the detector process. Needs psutil.
+class ProcessMonitor:
+    def __init__(self, pid):
+        import psutil
+        self.process = psutil.Process(pid)
+        self.process.cpu_percent()
+        self.cpu = []
+        self.rss = []
+
+    def sample(self):
+        self.cpu.append(self.process.cpu_percent())
+        self.rss.append(self.process.memory_info().rss)
+
+    def summary(self):
+        if not self.cpu:
+            return "cpu n/a"
+        return "cpu mean={:.0f}% max={:.0f}%  rss last={:.1f}MB max={:.1f}MB".format(
+            sum(self.cpu) / len(self.cpu), max(self.cpu), self.rss[-1] / 1e6, max(self.rss) / 1e6)
+
+# Round trip latencies counted in logarithmic buckets, each growth times as wide as
+# the one before, so a soak run of any length takes the same memory and time to
+# report. Percentiles are accurate to half a bucket (0.5% with the default growth).
+class LatencyHistogram:
+    # The inputs are the smallest and largest latency told apart in seconds and the
+    # growth of the buckets
+    def __init__(self, smallest=1e-6, largest=100.0, growth=1.01):
+        self.smallest = smallest
+        self.logGrowth = math.log(growth)
+        # Bucket 0 holds the latencies up to smallest, bucket i > 0 the ones up to
+        # smallest * growth ** i, the last one everything above
+        self.counts = [0] * (int(math.ceil(math.log(largest / smallest) / self.logGrowth)) + 2)
+        self.count = 0
+
+    def add(self, latency):
+        index = 0
+        if latency > self.smallest:
+            index = min(len(self.counts) - 1, int(math.ceil(math.log(latency / self.smallest) / self.logGrowth)))
+        self.counts[index] += 1
+        self.count += 1
+
+    # This function returns the latency at percentile p (0-100), the geometric middle
+    # of its bucket
+    def percentile(self, p):
+        if not self.count:
+            return float("nan")
+        rank = min(self.count, int(round(p / 100.0 * (self.count - 1))) + 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.smallest * math.exp((index - 0.5) * self.logGrowth) if index else self.smallest
+
+# This function prints the statistics of the messages sent so far
+def report(elapsed, sent, latencies, dropped, monitor):
+    print("{:>7.0f}s sent={} replied={} dropped={} rate={:.0f}/s  rtt p50={:.2f}ms p95={:.2f}ms p99={:.2f}ms  {}".format(
+        elapsed, sent, latencies.count, dropped, sent / elapsed if elapsed else 0.0,
+        latencies.percentile(50) * 1000, latencies.percentile(95) * 1000, latencies.percentile(99) * 1000,
+        monitor.summary() if monitor else ""))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--publish", type=str, help="address to publish the AUs on (connectML.py --input)", default="tcp://127.0.0.1:5555")
+    parser.add_argument("--subscribe", type=str, help="address connectML.py publishes its replies on (connectML.py --output)", default="tcp://127.0.0.1:5556")
+    parser.add_argument("--participants", type=int, help="number of simultaneous participants", default=1)
+    parser.add_argument("--rate", type=float, help="timesteps per second per participant", default=3.0)
+    parser.add_argument("--duration", type=float, help="seconds to run for", default=60.0)
+    parser.add_argument("--report-interval", type=float, help="seconds between progress reports", default=10.0)
+    parser.add_argument("--timeout", type=float, help="seconds after which a message without reply counts as dropped", default=2.0)
+    parser.add_argument("--pid", type=int, help="process id of connectML.py to sample CPU and memory of (needs psutil)")
+    parser.add_argument("--binary", action="store_true", help="send binary AU frames instead of msgpack")
+    parser.add_argument("--seed", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.participants == 1:
+        participants = [Participant("", args.rate, rng)]
+    else:
+        participants = [Participant("/p{}".format(i), args.rate, rng) for i in range(args.participants)]
+    monitor = ProcessMonitor(args.pid) if args.pid else None
+
+    context = zmq.Context()
+    output = context.socket(zmq.PUB)
+    output.setsockopt(zmq.SNDHWM, 0)
+    output.bind(args.publish)
+    input = context.socket(zmq.SUB)
+    input.setsockopt_string(zmq.SUBSCRIBE, connectML.replyTopic)
+    input.connect(args.subscribe)
+    poller = zmq.Poller()
+    poller.register(input, zmq.POLLIN)
+    # Give the subscriptions time to connect before publishing
+    time.sleep(1.0)
+
+    # Send times of the messages still waiting for a reply, by reply topic and
+    # originating time, and their keys in the order they were sent. Messages
+    # without a reply after the timeout are counted as dropped and forgotten, so
+    # neither grows over a long run. Keys of replied messages are taken off the
+    # order when they reach its front.
+    waiting = {}
+    sendOrder = collections.deque()
+    dropped = 0
+    latencies = LatencyHistogram()
+    sent = 0
+    period = 1.0 / args.rate
+    start = time.perf_counter()
+    # Participants are spread evenly over one period
+    schedule = [(start + i * period / len(participants), i) for i in range(len(participants))]
+    heapq.heapify(schedule)
+    nextReport = start + args.report_interval
+    end = start + args.duration
+
+    while True:
+        now = time.perf_counter()
+        if now >= end and (not waiting or now >= end + args.timeout):
+            break
+        # Send every timestep that is due
+        while schedule and schedule[0][0] <= now and now < end:
+            due, i = heapq.heappop(schedule)
+            participant = participants[i]
+            originatingTime = connectML.originatingTimeNow()
+            if args.binary:
+                payload = auWireFormat.packAUs(participant.step(), originatingTime, i)
+            else:
+                payload = msgpack.dumps({u"message": participant.step(), u"originatingTime": originatingTime})
+            output.send_multipart([participant.topic, payload])
+            key = (connectML.replyTopic.encode() + participant.topic[len(connectML.auTopic):], originatingTime)
+            waiting[key] = time.perf_counter()
+            sendOrder.append(key)
+            sent += 1
+            heapq.heappush(schedule, (due + period, i))
+        # Collect the replies until the next timestep is due
+        timeout = max(0.0, (schedule[0][0] if now < end else now + 0.05) - time.perf_counter())
+        if poller.poll(timeout * 1000):
+            while True:
+                try:
+                    [topic, payload] = input.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                sendTime = waiting.pop((topic, connectML.decodeReply(payload)[1]), None)
+                if sendTime is not None:
+                    latencies.add(time.perf_counter() - sendTime)
+        expired = time.perf_counter() - args.timeout
+        while sendOrder and (sendOrder[0] not in waiting or waiting[sendOrder[0]] < expired):
+            if waiting.pop(sendOrder.popleft(), None) is not None:
+                dropped += 1
+        if time.perf_counter() >= nextReport:
+            if monitor:
+                monitor.sample()
+            report(time.perf_counter() - start, sent, latencies, dropped, monitor)
+            nextReport += args.report_interval
+
+    if monitor:
+        monitor.sample()
+    print("Final:")
+    # Messages still without a reply at the end count as dropped
+    report(min(time.perf_counter() - start, args.duration), sent, latencies, dropped + len(waiting), monitor)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import collections
+import math
+import os
+import threading
+import time
+
+import zmq
+import msgpack
+
+import classifierBackends
+import connectML
+import latencyStats
+import sessionLog
+
+# This file contains the hot reload of the binary classifier of connectML.py. The
+# detector swaps in a new model without restarting, so the sliding windows keep
+# their state and DetectorMain.cs does not have to be restarted with it.
+#
+# A reload is started by a new model file appearing in the directory given with
+# --model-dir (once its size and modification time have not changed for one poll,
+# so a file still being copied is not read), or by a "reload <path>" message on the
+# "detectorControl" topic of the --control address. A background thread loads the
+# new model with the same backend, warms it up and validates it on a held-out
+# batch: the timesteps of --reload-validation (a session recorded with
+# replaySession.py) or else the last timesteps the detector classified. The new
+# model must give a class of 0 or 1 and a finite confidence for every timestep and
+# agree with the classes of the current model on at least --reload-min-agreement of
+# them (averaged over the two classes, as error timesteps are rare). Only then is
+# it swapped in, with one assignment between two timesteps. The model it replaced
+# is kept loaded, and a "rollback" message swaps it back.
+#
+# Every classification is timed, and after a reload the inference latency before,
+# during (while the new model was loaded and validated) and right after the swap
+# is printed. Control messages are sent with this file, for example:
+#   python modelReload.py --control tcp://127.0.0.1:5660 reload models/CaseFullDict2
+#   python modelReload.py --control tcp://127.0.0.1:5660 rollback
+
+# Topic the control messages are published on
+controlTopic = "detectorControl"
+# Timesteps in the held-out batch
+validationSize = 256
+# Classifications timed after a swap for the reload report
+settleCount = 50
+# Files in the model directory that are not models
+ignoredSuffixes = [classifierBackends.weightsSuffix, ".script.pt", ".int8.pt", ".tmp"]
+
+# Classifier backend standing in for the loaded one, which the reloader swaps.
+# Every call reads the model once, so a call in progress during a swap finishes
+# with the old model and the next one uses the new model.
+class SwappableModel:
+    # The inputs are the loaded backend and the path it was loaded from
+    def __init__(self, model, path):
+        self.model = model
+        self.path = path
+        self.previous = None
+        self.previousPath = None
+        # Last timesteps classified and their classes, the default held-out batch
+        self.recent = collections.deque(maxlen=validationSize)
+        # Seconds the last classifications took, and the ones since a reload
+        # started (None when no reload is being measured)
+        self.latencies = collections.deque(maxlen=1000)
+        self.reloadLatencies = None
+
+    @property
+    def inputSize(self):
+        return self.model.inputSize
+
+    def record(self, latency):
+        self.latencies.append(latency)
+        if self.reloadLatencies is not None:
+            self.reloadLatencies.append(latency)
+
+    def classify(self, timeStepAU):
+        model = self.model
+        start = time.perf_counter()
+        predictedClass, predictedConfidence = model.classify(timeStepAU)
+        self.record(time.perf_counter() - start)
+        self.recent.append((timeStepAU, predictedClass))
+        return predictedClass, predictedConfidence
+
+    def classifyBatch(self, batchAU):
+        model = self.model
+        start = time.perf_counter()
+        predictedClasses, predictedConfidences = model.classifyBatch(batchAU)
+        self.record(time.perf_counter() - start)
+        self.recent.extend(zip(batchAU, predictedClasses))
+        return predictedClasses, predictedConfidences
+
+    # This function swaps in a model, keeping the one it replaces for a rollback
+    def swap(self, model, path):
+        self.previous, self.previousPath = self.model, self.path
+        self.model, self.path = model, path
+
+    # This function returns a copy of the last timesteps classified and their classes
+    def recentTimesteps(self):
+        while True:
+            try:
+                return list(self.recent)
+            except RuntimeError:
+                # Appended to by the classifying thread while being copied
+                continue
+
+# Watches for new models and swaps them into a SwappableModel from a background thread
+class ModelReloader:
+    # The inputs are:
+    # model: The SwappableModel serving the detector
+    # backend: Name of the backend to load new models with
+    # batchSize: Batch size to warm new models up for
+    # modelDirectory: Directory to watch for new models, None for none
+    # controlAddress: Address to receive control messages on, None for none
+    # validation: Held-out batch as a list of (timeStepAU, class of the current
+    # model), None for the last timesteps classified
+    # minAgreement: Smallest share of the held-out classes a new model must agree on
+    # pollInterval: Seconds between looks at the model directory
+    def __init__(self, model, backend, batchSize, modelDirectory=None, controlAddress=None, validation=None,
+            minAgreement=0.8, pollInterval=1.0):
+        self.model = model
+        self.backend = backend
+        self.batchSize = batchSize
+        self.modelDirectory = modelDirectory
+        self.validation = validation
+        self.minAgreement = minAgreement
+        self.pollInterval = pollInterval
+        self.control = None
+        if controlAddress:
+            self.control = zmq.Context().socket(zmq.SUB)
+            self.control.setsockopt_string(zmq.SUBSCRIBE, controlTopic)
+            self.control.bind(controlAddress)
+        # Model files in the directory by path, as (modification time, size), when they
+        # were last reloaded. The ones there at startup are not reloaded.
+        self.seen = self.listModels() if modelDirectory else {}
+        # New or changed model files at the last poll, reloaded once unchanged for a poll
+        self.candidates = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def listModels(self):
+        models = {}
+        for name in os.listdir(self.modelDirectory):
+            path = os.path.join(self.modelDirectory, name)
+            if any(name.endswith(suffix) for suffix in ignoredSuffixes):
+                continue
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                models[path] = (status.st_mtime, status.st_size)
+        return models
+
+    # This function reloads the newest model file that is new or changed and has not
+    # changed since the last poll
+    def checkDirectory(self):
+        models = self.listModels()
+        stable = []
+        for path, status in models.items():
+            if self.seen.get(path) == status:
+                continue
+            if self.candidates.get(path) == status:
+                stable.append(path)
+            self.candidates[path] = status
+        if stable:
+            for path in stable:
+                self.seen[path] = models[path]
+                del self.candidates[path]
+            self.reload(max(stable, key=lambda path: models[path][0]))
+
+    def run(self):
+        while True:
+            if self.control is not None and self.control.poll(self.pollInterval * 1000):
+                [topic, payload] = self.control.recv_multipart()
+                command = str(msgpack.unpackb(payload)["message"]).split(None, 1)
+                if command[0] == "reload" and len(command) == 2:
+                    self.reload(command[1])
+                elif command[0] == "rollback":
+                    self.rollback()
+                else:
+                    print("Unknown control message {}".format(" ".join(command)))
+            elif self.control is None:
+                time.sleep(self.pollInterval)
+            if self.modelDirectory:
+                self.checkDirectory()
+
+    # This function checks a new model on the held-out batch. The outputs are the
+    # share of the classes it agrees on, averaged over the classes, or a string saying
+    # why the model is not valid, and the number of held-out timesteps.
+    def validate(self, model):
+        batch = self.validation if self.validation is not None else self.model.recentTimesteps()
+        if not batch:
+            return ("no timesteps to validate on yet", 0)
+        if model.inputSize != self.model.inputSize:
+            return ("takes {} inputs per timestep instead of {}".format(model.inputSize, self.model.inputSize), len(batch))
+        predictedClasses, predictedConfidences = model.classifyBatch([timeStepAU for timeStepAU, predictedClass in batch])
+        if any(predictedClass not in (0, 1) for predictedClass in predictedClasses) or \
+                not all(math.isfinite(predictedConfidence) for predictedConfidence in predictedConfidences):
+            return ("invalid classes or confidences", len(batch))
+        # Agreement on each class the current model gave, averaged, so a model that
+        # never detects an error does not pass on the mostly non-error timesteps
+        agreements = []
+        for label in set(expected for timeStepAU, expected in batch):
+            matches = [predictedClass == expected for (timeStepAU, expected), predictedClass in zip(batch, predictedClasses)
+                if expected == label]
+            agreements.append(sum(matches) / float(len(matches)))
+        return (sum(agreements) / len(agreements), len(batch))
+
+    # This function loads, warms up and validates the model at path and swaps it in
+    # if it is valid
+    def reload(self, path):
+        self.model.reloadLatencies = []
+        before = list(self.model.latencies)
+        start = time.perf_counter()
+        heldOut = 0
+        try:
+            model = classifierBackends.loadBackend(self.backend, path)
+            loaded = time.perf_counter()
+            classifierBackends.warmUp(model, self.batchSize)
+            warmed = time.perf_counter()
+            agreement, heldOut = self.validate(model)
+        except Exception as e:
+            agreement = "{}: {}".format(type(e).__name__, e)
+        if isinstance(agreement, str) or agreement < self.minAgreement:
+            self.model.reloadLatencies = None
+            reason = agreement if isinstance(agreement, str) else "agrees on {:.1%} of the held-out batch".format(agreement)
+            print("Model reload {} rejected: {}, keeping {}".format(path, reason, self.model.path))
+            return
+        validated = time.perf_counter()
+        during = len(self.model.reloadLatencies)
+        self.model.swap(model, path)
+        print("Model reload {}: loaded in {:.1f}ms, warmed up in {:.1f}ms, agrees on {:.1%} of {} held-out timesteps, swapped in".format(
+            path, (loaded - start) * 1000, (warmed - loaded) * 1000, agreement, heldOut))
+        # Wait for the first classifications of the new model for the report
+        end = validated + 10.0
+        while len(self.model.reloadLatencies) < during + settleCount and time.perf_counter() < end:
+            time.sleep(0.05)
+        latencies = self.model.reloadLatencies
+        self.model.reloadLatencies = None
+        for name, values in [("before", before), ("during reload", latencies[:during]), ("after swap", latencies[during:])]:
+            if values:
+                print("  inference {:<14} p50 {:>8.1f}us p99 {:>8.1f}us max {:>8.1f}us over {} calls".format(name,
+                    latencyStats.percentile(values, 50) * 1e6, latencyStats.percentile(values, 99) * 1e6, max(values) * 1e6, len(values)))
+
+    # This function swaps the model replaced by the last reload back in
+    def rollback(self):
+        if self.model.previous is None:
+            print("Model rollback: no previous model")
+            return
+        self.model.swap(self.model.previous, self.model.previousPath)
+        print("Model rollback: {} swapped back in, replacing {}".format(self.model.path, self.model.previousPath))
+
+# This function reads the held-out batch of --reload-validation. The inputs are the
+# session log, the current model, which gives the expected classes, and the parsed
+# connectML.py arguments.
+def readValidation(path, model, args):
+    batchAU = [list(connectML.decodeAUs(payload)[0])[1:] for topic, payload, originatingTime in sessionLog.readLog(path)]
+    if args.features:
+        import auFeatures
+        batchAU = auFeatures.sessionFeatures(batchAU, args.feature_horizons, args.baseline_timesteps)
+    batchAU = batchAU[:validationSize]
+    predictedClasses, predictedConfidences = model.classifyBatch(batchAU)
+    return list(zip(batchAU, predictedClasses))
+
+# This function wraps the loaded model of connectML.py for hot reloading and starts
+# the reloader. The inputs are the loaded backend and the parsed connectML.py
+# arguments. The output is the model the detector classifies with.
+def start(model, args):
+    validation = readValidation(args.reload_validation, model, args) if args.reload_validation else None
+    swappable = SwappableModel(model, args.model)
+    batchSize = args.max_batch if args.server or args.async_pipeline else 1
+    ModelReloader(swappable, args.backend, batchSize, args.model_dir, args.control, validation, args.reload_min_agreement)
+    return swappable
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--control", type=str, help="control address of connectML.py", required=True)
+    parser.add_argument("command", type=str, choices=["reload", "rollback"], help="what the detector should do")
+    parser.add_argument("path", type=str, nargs="?", help="model to reload, as the detector sees it")
+    args = parser.parse_args()
+    if args.command == "reload" and not args.path:
+        parser.error("reload needs the path of the model")
+
+    output = zmq.Context().socket(zmq.PUB)
+    output.connect(args.control)
+    # Give the connection time to be set up so the message is not dropped
+    time.sleep(0.5)
+    message = args.command if args.command == "rollback" else "reload " + args.path
+    output.send_multipart([controlTopic.encode(), msgpack.dumps({u"message": message, u"originatingTime": connectML.originatingTimeNow()})])
+    time.sleep(0.1)
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,122 @@
+import argparse
+import time
+
+import zmq
+
+import classifierBackends
+import connectML
+import sessionLog
+
+# This program records the AUs PSI sends to connectML.py and replays recorded
+# sessions through the detector without PSI. It is the regression check for
+# changes to the detector: a replay pushes every recorded message through
+# readAUCalced, runML, postPredictionWindow and writeCommand as fast as possible
+# and checks that the replies are byte for byte the same as a stored golden log.
+#
+# Record a session (runs alongside connectML.py until stopped with Ctrl-C):
+#   python replaySession.py record --input tcp://XXX.X.X.X:X --log session.aulog
+# Store the replies of a session as the golden log:
+#   python replaySession.py replay --log session.aulog --golden session.golden --write-golden
+# Check a change against the golden log:
+#   python replaySession.py replay --log session.aulog --golden session.golden
+
+# Stand-in for the subscribe socket that hands out the messages of a log. It
+# raises EOFError once every message has been received.
+class LogSocket:
+    def __init__(self, records):
+        self.records = records
+        self.next = 0
+
+    def recv_multipart(self, copy=True):
+        if self.next == len(self.records):
+            raise EOFError
+        topic, payload, originatingTime = self.records[self.next]
+        self.next += 1
+        return [topic, payload]
+
+# Stand-in for the publish socket that keeps every message sent
+class CaptureSocket:
+    def __init__(self):
+        self.messages = []
+
+    def send_multipart(self, frames):
+        self.messages.append(frames)
+
+# This function subscribes to the AUs PSI sends and writes them to a log. The
+# inputs are the address PSI publishes on, the path of the log and the number of
+# messages to record (0 records until interrupted).
+def record(address, path, count):
+    input = zmq.Context().socket(zmq.SUB)
+    input.setsockopt_string(zmq.SUBSCRIBE, connectML.auTopic)
+    input.connect(address)
+    recorded = 0
+    with sessionLog.LogWriter(path) as log:
+        try:
+            while count == 0 or recorded < count:
+                [topic, payload] = input.recv_multipart()
+                AUsCalced, originatingTime, streamId = connectML.decodeAUs(payload)
+                log.write(topic, payload, originatingTime)
+                recorded += 1
+        except KeyboardInterrupt:
+            pass
+    print("Recorded {} messages to {}".format(recorded, path))
+
+# This function replays recorded messages through the detector's single stream
+# loop. The inputs are the records of a log and the classifier backend. The
+# outputs are the reply frames the detector sent and the seconds it took.
+def replay(records, model):
+    input = LogSocket(records)
+    output = CaptureSocket()
+    start = time.perf_counter()
+    try:
+        connectML.runSingle(input, output, model)
+    except EOFError:
+        pass
+    return output.messages, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--log", type=str, help="session log to record to or replay", required=True)
+    parser.add_argument("--input", type=str, help="address PSI publishes the AUs on (record)", default="tcp://XXX.X.X.X:X")
+    parser.add_argument("--count", type=int, help="number of messages to record, 0 until interrupted (record)", default=0)
+    parser.add_argument("--model", type=str, help="path to the saved binary classifier (replay)", default="CaseFullDict")
+    parser.add_argument("--backend", type=str, choices=classifierBackends.backendNames, help="library used to run the binary classifier (replay)", default="torch")
+    parser.add_argument("--golden", type=str, help="log of the expected replies (replay)")
+    parser.add_argument("--write-golden", action="store_true", help="store the replies as the golden log instead of checking them (replay)")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        record(args.input, args.log, args.count)
+        return 0
+
+    records = sessionLog.readLog(args.log)
+    model = classifierBackends.loadBackend(args.backend, args.model)
+    replies, elapsed = replay(records, model)
+    detections = sum(1 for topic, payload in replies if connectML.decodeReply(payload)[0][3] == 1)
+    print("Replayed {} timesteps in {:.3f}s ({:.0f} timesteps/s), {} errors detected".format(
+        len(replies), elapsed, len(replies) / elapsed if elapsed else 0.0, detections))
+
+    if args.golden is None:
+        return 0
+    if args.write_golden:
+        with sessionLog.LogWriter(args.golden) as golden:
+            for topic, payload in replies:
+                golden.write(topic, payload, connectML.decodeReply(payload)[1])
+        print("Wrote golden log {}".format(args.golden))
+        return 0
+
+    expected = sessionLog.readLog(args.golden)
+    for i, ((topic, payload), (goldenTopic, goldenPayload, originatingTime)) in enumerate(zip(replies, expected)):
+        if topic != goldenTopic or payload != goldenPayload:
+            print("MISMATCH at timestep {} (originatingTime {}): got {} expected {}".format(
+                i, originatingTime, connectML.decodeReply(payload)[0], connectML.decodeReply(goldenPayload)[0]))
+            return 1
+    if len(replies) != len(expected):
+        print("MISMATCH: {} replies, golden log has {}".format(len(replies), len(expected)))
+        return 1
+    print("All {} replies match {}".format(len(replies), args.golden))
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
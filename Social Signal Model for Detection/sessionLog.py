@@ -0,0 +1,59 @@
+import struct
+
+# This file contains the on-disk log of PSI messages used to record and replay
+# sessions. The log starts with a magic line and then holds one record per
+# message:
+# flag (1 byte): 0 if the originating time is an integer, 1 if it is a float
+# originatingTime (8 bytes): the message's originating time
+# topic length (2 bytes) and payload length (4 bytes)
+# topic and raw payload (msgpack or binary), exactly as they came off the socket
+# All numbers are little endian.
+
+magic = b"AULOG1\n"
+recordHeader = struct.Struct("<BqHI")
+
+# Writes PSI messages to a log file
+class LogWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(magic)
+
+    # This function appends one message to the log. The inputs are the topic and
+    # raw payload frames of the message and its originating time.
+    def write(self, topic, payload, originatingTime):
+        if isinstance(originatingTime, float):
+            header = recordHeader.pack(1, struct.unpack("<q", struct.pack("<d", originatingTime))[0], len(topic), len(payload))
+        else:
+            header = recordHeader.pack(0, originatingTime, len(topic), len(payload))
+        self.file.write(header + topic + payload)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# This function reads a whole log file. The input is the path to the log. The
+# output is a list of (topic, payload, originatingTime) for every message in
+# the order they were recorded.
+def readLog(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    if not data.startswith(magic):
+        raise ValueError("{} is not a session log".format(path))
+    records = []
+    offset = len(magic)
+    while offset < len(data):
+        flag, originatingTime, topicLength, payloadLength = recordHeader.unpack_from(data, offset)
+        offset += recordHeader.size
+        if flag == 1:
+            originatingTime = struct.unpack("<d", struct.pack("<q", originatingTime))[0]
+        topic = data[offset:offset + topicLength]
+        offset += topicLength
+        payload = data[offset:offset + payloadLength]
+        offset += payloadLength
+        records.append((topic, payload, originatingTime))
+    return records
@@ -0,0 +1,245 @@
+import collections
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+# This file contains the session store of connectML.py (--session-store <directory>).
+# It keeps what the detector computed for every timestep (the AUs, whether the
+# robot was moving, the classification, its confidence, the sum of the sliding
+# window, whether a new error was detected and the originatingTime), so a session
+# can be analysed afterwards without classifying it again.
+#
+# The classifying loop only appends a tuple to a deque (atomic in CPython, so no
+# lock is taken) and never waits on the disk. A background thread drains the deque
+# every flushInterval seconds and copies the rows into the current chunk file.
+# When more than maxPending rows are waiting the new ones are dropped and counted
+# instead of growing without bound.
+#
+# A session is a directory of chunk files (chunk00000.aucols, chunk00001.aucols,
+# ...) of capacity rows each, a new one being started when one is full. Every run of
+# connectML.py keeps its session in a new directory inside the --session-store one,
+# named after the time it started (run-20240131-142501), so runs into the same
+# directory are never joined into one session. A chunk file is columnar:
+# magic (8 bytes), capacity and rows written so far (8 bytes each), padded to 64 bytes
+# a block per column of capacity values, the 17 AUs first (AU by AU), then
+# isMoving, class, confidence, windowSum and detection (float32) and the
+# originatingTime (int64, which float32 cannot hold)
+# All numbers are little endian. The row count is only updated after the rows are
+# written, so a chunk can be read while it is being written and after a crash.
+# openSession memory maps the chunks, so opening a session reads only the headers.
+# Given a --session-store directory it opens the newest run in it. Running this file
+# prints a summary of a session:
+#   python sessionStore.py session1
+
+magic = b"AUCOLS1\n"
+header = struct.Struct("<8sQQ")
+headerSize = 64
+chunkSuffix = ".aucols"
+runPrefix = "run-"
+auCount = 17
+# Columns after the AUs, in file order, and their types
+columns = [("isMoving", np.float32), ("class", np.float32), ("confidence", np.float32), ("windowSum", np.float32),
+    ("detection", np.float32), ("originatingTime", np.int64)]
+
+# This function returns the offset of every column block of a chunk of the given
+# capacity, the AUs under "AUs", and the size of the file
+def chunkLayout(capacity):
+    offsets = {"AUs": headerSize}
+    offset = headerSize + auCount * capacity * 4
+    for name, dtype in columns:
+        offsets[name] = offset
+        offset += capacity * np.dtype(dtype).itemsize
+    return offsets, offset
+
+# This function maps the column blocks of a chunk. The inputs are the memory map of
+# the whole file and its capacity. The output is a dict of column name to array,
+# the AUs as an array of 17 rows of capacity values.
+def mapColumns(data, capacity):
+    offsets, size = chunkLayout(capacity)
+    mapped = {"AUs": np.ndarray((auCount, capacity), dtype=np.float32, buffer=data, offset=offsets["AUs"])}
+    for name, dtype in columns:
+        mapped[name] = np.ndarray((capacity,), dtype=dtype, buffer=data, offset=offsets[name])
+    return mapped
+
+def chunkPath(directory, number):
+    return os.path.join(directory, "chunk{:05d}{}".format(number, chunkSuffix))
+
+def chunkNames(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(chunkSuffix))
+
+# This function creates the directory of a new run inside directory, named after the
+# current time, and returns its path
+def newRunDirectory(directory):
+    name = runPrefix + time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, name)
+    number = 1
+    while True:
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            # Another run started in the same second
+            path = os.path.join(directory, "{}-{}".format(name, number))
+            number += 1
+
+# Writes the rows of one session to a directory of chunk files from a background thread
+class SessionStore:
+    # The inputs are:
+    # directory: Directory to write the chunks to, created if missing. It must not
+    # hold a session already.
+    # capacity: Rows per chunk file
+    # flushInterval: Seconds between writes of the waiting rows
+    # maxPending: Rows that can wait to be written before new ones are dropped
+    def __init__(self, directory, capacity=65536, flushInterval=0.5, maxPending=100000):
+        self.directory = directory
+        self.capacity = capacity
+        self.flushInterval = flushInterval
+        self.maxPending = maxPending
+        os.makedirs(directory, exist_ok=True)
+        if chunkNames(directory):
+            raise ValueError("{} already holds a session".format(directory))
+        self.chunkNumber = 0
+        self.chunk = None
+        self.pending = collections.deque()
+        # Rows written to disk and rows dropped because too many were waiting
+        self.written = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # This function queues one timestep to be written. The inputs are the message of
+    # the timestep (whether the robot is moving and the 17 AUs), the classification,
+    # the confidence, the sum of the sliding window, whether a new error was detected
+    # and the originatingTime.
+    def append(self, AUsCalced, predictedClass, predictedConfidence, windowSum, detection, originatingTime):
+        if len(self.pending) >= self.maxPending:
+            self.dropped += 1
+            return
+        self.pending.append((AUsCalced, predictedClass, predictedConfidence, windowSum, detection, originatingTime))
+
+    # This function creates the next chunk file and maps it
+    def openChunk(self):
+        offsets, size = chunkLayout(self.capacity)
+        path = chunkPath(self.directory, self.chunkNumber)
+        with open(path, "wb") as file:
+            file.write(header.pack(magic, self.capacity, 0))
+            file.truncate(size)
+        self.chunkNumber += 1
+        data = np.memmap(path, mode="r+")
+        self.chunk = [data, mapColumns(data, self.capacity), 0]
+
+    def closeChunk(self):
+        data, mapped, rows = self.chunk
+        data.flush()
+        self.chunk = None
+
+    # This function writes the waiting rows into the chunk files
+    def flush(self):
+        count = len(self.pending)
+        if count == 0:
+            return
+        rows = [self.pending.popleft() for i in range(count)]
+        AUs = np.array([row[0] for row in rows], dtype=np.float32).reshape(count, auCount + 1)
+        values = {"isMoving": AUs[:, 0],
+            "class": np.array([row[1] for row in rows], dtype=np.float32),
+            "confidence": np.array([row[2] for row in rows], dtype=np.float32),
+            "windowSum": np.array([row[3] for row in rows], dtype=np.float32),
+            "detection": np.array([row[4] for row in rows], dtype=np.float32),
+            "originatingTime": np.array([row[5] for row in rows], dtype=np.int64)}
+        done = 0
+        while done < count:
+            if self.chunk is None:
+                self.openChunk()
+            data, mapped, start = self.chunk
+            end = min(self.capacity, start + count - done)
+            mapped["AUs"][:, start:end] = AUs[done:done + end - start, 1:].T
+            for name, dtype in columns:
+                mapped[name][start:end] = values[name][done:done + end - start]
+            # The row count goes in last so readers never see rows not written yet
+            data[:header.size] = np.frombuffer(header.pack(magic, self.capacity, end), dtype=np.uint8)
+            self.chunk[2] = end
+            done += end - start
+            if end == self.capacity:
+                self.closeChunk()
+        self.written += count
+
+    def run(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    # This function writes the rows still waiting and closes the chunk
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+        if self.chunk is not None:
+            self.closeChunk()
+        if self.dropped:
+            print("Session store {}: {} timesteps written, {} dropped".format(self.directory, self.written, self.dropped))
+
+# A session read back with openSession
+class Session:
+    def __init__(self, chunks):
+        # Columns of every chunk, cut to the rows written
+        self.chunks = chunks
+        self.rows = sum(len(chunk["originatingTime"]) for chunk in chunks)
+
+    # This function returns the values of a column over the whole session. The AUs
+    # are returned as an array of a row of 17 AUs per timestep. A session of one
+    # chunk is returned without copying.
+    def column(self, name):
+        if len(self.chunks) == 1:
+            return self.chunks[0][name]
+        if not self.chunks:
+            return np.zeros((0, auCount) if name == "AUs" else 0, dtype=np.float32 if name != "originatingTime" else np.int64)
+        return np.concatenate([chunk[name] for chunk in self.chunks])
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+# This function opens a session written by SessionStore. The input is the directory
+# of the session, or a --session-store directory to open its newest run. The output
+# is a Session whose columns are memory mapped from the chunk files.
+def openSession(directory):
+    names = chunkNames(directory)
+    runs = sorted(name for name in os.listdir(directory) if name.startswith(runPrefix))
+    if not names and runs:
+        # The newest by the start time in the name, then by the number of a run started in the same second
+        directory = os.path.join(directory, max(runs, key=lambda name: (name[:len(runPrefix) + 15], len(name), name)))
+        names = chunkNames(directory)
+    streams = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    if not names and streams:
+        # A server mode run keeps a session per stream
+        raise ValueError("{} holds the sessions of the streams {}, open one of them".format(directory, ", ".join(streams)))
+    chunks = []
+    for name in names:
+        data = np.memmap(os.path.join(directory, name), mode="r")
+        fileMagic, capacity, rows = header.unpack(data[:header.size].tobytes())
+        if fileMagic != magic:
+            raise ValueError("{} is not a session store chunk".format(name))
+        mapped = mapColumns(data, capacity)
+        chunk = {name: values[:rows] for name, values in mapped.items() if name != "AUs"}
+        chunk["AUs"] = mapped["AUs"][:, :rows].T
+        chunks.append(chunk)
+    return Session(chunks)
+
+def main():
+    start = time.perf_counter()
+    session = openSession(sys.argv[1])
+    opened = time.perf_counter()
+    moving = session["isMoving"]
+    print("{} timesteps in {} chunks, opened in {:.1f}ms".format(session.rows, len(session.chunks), (opened - start) * 1000))
+    if session.rows:
+        originatingTimes = session["originatingTime"]
+        print("{:.1f} minutes, robot moving {:.0%} of the time, {:.0%} classified as error, {} errors detected".format(
+            (originatingTimes[-1] - originatingTimes[0]) / 600000000.0, float(np.mean(moving)),
+            float(np.mean(session["class"])), int(np.sum(session["detection"]))))
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,106 @@
+from array import array
+
+# This file contains the sliding window that determines if a new error has been
+# detected from the classified timesteps of one stream of AUs. Each window keeps
+# its own state, so one process can run a window per stream.
+#
+# The window is a fixed-size ring buffer of classification confidences with a
+# running sum of them. A second ring buffer holds the timesteps in the window
+# that were classified as errors, oldest first, so the estimated error start is
+# read off its head instead of scanning the window. Every update takes constant
+# time and allocates nothing.
+
+class SlidingWindow:
+    # The inputs are the number of timesteps in the window and the threshold the
+    # sum of the confidences has to reach for an error to be detected
+    def __init__(self, windowSize=11, threshold=6):
+        self.windowSize = windowSize
+        self.threshold = threshold
+        # Confidences of the timesteps in the window, starting at slot head
+        self.confidences = array('d', [0.0] * windowSize)
+        self.head = 0
+        self.size = 0
+        # Number of timesteps added since the window was last reset. Timesteps
+        # are identified by the value of this count when they were added.
+        self.added = 0
+        # Timesteps in the window classified as errors, starting at slot errorHead
+        self.errors = array('q', [0] * windowSize)
+        self.errorHead = 0
+        self.errorCount = 0
+        # Sum of the confidence classifications for the window
+        self.runningWindowSum = 0
+        # Previous error detected timestep
+        self.prevStopNum = -1
+        # Previous estimated error start
+        self.prevStartReact = -1
+
+    # This function empties the window. The previous detection is kept so the
+    # same error is not reported twice.
+    def reset(self):
+        self.head = 0
+        self.size = 0
+        self.added = 0
+        self.errorHead = 0
+        self.errorCount = 0
+        self.runningWindowSum = 0
+
+    # This function adds a classified timestep to the window and checks if a new
+    # error has been detected. A new error can only be detected if the robot is
+    # moving (specific to the task). The inputs are:
+    # predicted: Timestep classification (1 or 0)
+    # confidence: Classification confidence
+    # index: Current timestep index over the entire data collection
+    # isMoving: Flag indicating if the robot is moving at the timestep
+    # The outputs are the timestep index if it was a new error and estimated index
+    # of error start. If it is not a new error, then the function outputs -1 for both.
+    def update(self, predicted, confidence, index, isMoving):
+        # Check if the robot is not moving
+        if isMoving == 0:
+            # Reset the sliding window because the robot is no longer moving
+            self.reset()
+            return -1, -1
+
+        # Check if the window is the correct size
+        if self.size == self.windowSize:
+            # Remove the oldest value from the running weighted sum
+            self.runningWindowSum = self.runningWindowSum - self.confidences[self.head]
+            # Forget the oldest timestep if it was an error one
+            if self.errorCount and self.errors[self.errorHead] == self.added - self.size:
+                self.errorHead = (self.errorHead + 1) % self.windowSize
+                self.errorCount -= 1
+            self.head = (self.head + 1) % self.windowSize
+            self.size -= 1
+
+        # Add the currently newest classified value into the window
+        self.confidences[(self.head + self.size) % self.windowSize] = confidence
+        self.size += 1
+        if predicted == 1:
+            self.errors[(self.errorHead + self.errorCount) % self.windowSize] = self.added
+            self.errorCount += 1
+        self.added += 1
+        # Add the new timestep classification to the running sum
+        self.runningWindowSum = self.runningWindowSum + confidence
+
+        # Check if the running sum is the above the threshold to see if error
+        # is detected
+        if self.runningWindowSum >= self.threshold:
+            # Set the detected error timestep
+            stopNum = index
+            # The estimated error start is the oldest error timestep in the window.
+            # With no error timestep (only possible with a threshold of 0 or less)
+            # the error is estimated to start at the detection.
+            startReact = index
+            if self.errorCount:
+                queueCount = self.errors[self.errorHead] - (self.added - self.size)
+                startReact = index - (self.size - queueCount) + 1
+
+            # Check if the estimated error start and detected error timestep are
+            # within one of the previously indicated one to see if it is the same
+            # error.
+            isNewError = stopNum != self.prevStopNum + 1 and startReact != self.prevStartReact + 1
+            self.prevStopNum = stopNum
+            self.prevStartReact = startReact
+            if isNewError:
+                return stopNum, startReact
+        # return -1 -1 if no error was detected
+        return -1, -1
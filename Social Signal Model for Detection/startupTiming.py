@@ -0,0 +1,20 @@
+import time
+# Taken when the detector process first imports this file, which connectML.py does
+# before its other imports, so the startup report includes them
+startTime = time.perf_counter()
+
+# This file contains the start time of the detector and the report of the time to
+# first prediction. They are kept here and not in connectML.py because when
+# connectML.py is run, the modes that import it (asyncPipeline.py, workerPool.py,
+# cameraFusion.py, ...) get a second copy of it with its own globals, while this
+# file is only ever loaded once.
+
+# Set once the first reply is published, for the time to first prediction
+isFirstReplySent = False
+
+# This function prints the time to first prediction when the first reply is published
+def reportFirstReply():
+    global isFirstReplySent
+    if not isFirstReplySent:
+        isFirstReplySent = True
+        print("First prediction published {:.1f}ms after start".format((time.perf_counter() - startTime) * 1000))
@@ -0,0 +1,57 @@
+import argparse
+import collections
+
+import latencyStats
+import latencyTrace
+
+# This program joins the latency traces written by connectML.py and
+# connectPsiRobot.py (--trace) on originatingTime and prints how long messages
+# spent between consecutive stages. For example:
+#   python traceReport.py ml.trace robot.trace
+
+# This function reads trace files. The output is a dict from originating time to a
+# dict of stage to the time the message first reached it. A record that does not
+# have the fields or a stage of latencyTrace.py is an error, as it means the copy of
+# latencyTrace.py in Robot Controller no longer matches this one.
+def readTraces(paths):
+    messages = collections.defaultdict(dict)
+    for path in paths:
+        with open(path) as file:
+            for number, line in enumerate(file, 1):
+                fields = line.rstrip("\n").split(",")
+                if len(fields) != 4 or fields[1] not in latencyTrace.stageIds:
+                    raise ValueError("{} line {} is not a latencyTrace.py record of this version: {}".format(path, number, line.rstrip("\n")))
+                process, stage, originatingTime, timeNs = fields
+                marks = messages[int(originatingTime)]
+                if stage not in marks or int(timeNs) < marks[stage]:
+                    marks[stage] = int(timeNs)
+    return messages
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("traces", type=str, nargs="+", help="trace files to join")
+    args = parser.parse_args()
+
+    messages = readTraces(args.traces)
+    # Milliseconds between consecutive stages a message reached, by stage pair
+    latencies = collections.defaultdict(list)
+    totals = []
+    for marks in messages.values():
+        reached = [stage for stage in latencyTrace.stages if stage in marks]
+        for previous, stage in zip(reached, reached[1:]):
+            latencies[(previous, stage)].append((marks[stage] - marks[previous]) / 1e6)
+        if len(reached) > 1:
+            totals.append((marks[reached[-1]] - marks[reached[0]]) / 1e6)
+
+    print("{} messages traced".format(len(messages)))
+    print("{:<32} {:>8} {:>10} {:>10} {:>10} {:>10}".format("stage", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms"))
+    order = {stage: i for i, stage in enumerate(latencyTrace.stages)}
+    for (previous, stage), values in sorted(latencies.items(), key=lambda item: (order[item[0][0]], order[item[0][1]])):
+        print("{:<32} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(previous + " -> " + stage, len(values),
+            sum(values) / len(values), latencyStats.percentile(values, 50), latencyStats.percentile(values, 95), latencyStats.percentile(values, 99)))
+    if totals:
+        print("{:<32} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format("first -> last stage", len(totals),
+            sum(totals) / len(totals), latencyStats.percentile(totals, 50), latencyStats.percentile(totals, 95), latencyStats.percentile(totals, 99)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import zmq
+import msgpack
+
+import classifierBackends
+import connectML
+import startupTiming
+
+# This file contains the worker pool mode of connectML.py (--workers). A supervisor
+# process receives the AUs of every stream and hands each stream to one of a pool
+# of worker processes, so classification is not limited to one core by the GIL.
+#
+# Streams are told apart by their topic, like in server mode. A stream is given to
+# the worker with the fewest streams when its first timestep arrives and stays with
+# it (sticky routing), so its sliding window lives in that worker only. The
+# supervisor numbers the timesteps of every stream and sends the number along, so
+# the timestep indices keep counting when a worker is restarted.
+#
+# Workers classify with the numpy backend (connectML.py --workers needs --backend
+# numpy), batching the timesteps waiting for them
+# like server mode. The supervisor loads the weights once into a shared memory
+# block and every worker maps that one read-only copy instead of loading its own.
+# Workers send their replies back to the supervisor, which publishes them.
+#
+# The supervisor restarts a worker that dies. Its streams stay with it, their
+# sliding windows start empty again and their timesteps are dropped until the new
+# worker connects. Every --stats-interval seconds it prints the load of every
+# worker (streams, timesteps per second, share of time spent classifying,
+# restarts, timesteps dropped while restarting) and publishes it on the
+# "detectorStats" topic. The readiness heartbeat starts once every worker has
+# mapped the weights and warmed up.
+
+# Topic the worker load is published on
+statsTopic = "detectorStats"
+# Seconds between checks that the workers are alive
+healthInterval = 0.5
+
+# This function copies the weights of the classifier into a new shared memory
+# block. The inputs are the lists of weights and biases (see
+# classifierBackends.layerArrays). The outputs are the block and the layout of the
+# arrays in it, a list of (shape, offset), weights first.
+def shareWeights(weights, biases):
+    arrays = weights + biases
+    block = shared_memory.SharedMemory(create=True, size=sum(array.nbytes for array in arrays))
+    layout = []
+    offset = 0
+    for array in arrays:
+        np.ndarray(array.shape, dtype=np.float32, buffer=block.buf, offset=offset)[...] = array
+        layout.append((array.shape, offset))
+        offset += array.nbytes
+    return block, layout
+
+# This function maps the weights shared by shareWeights. The inputs are the name of
+# the block and the layout. The outputs are the block and the lists of weights and
+# biases, as read-only arrays.
+def mapWeights(name, layout):
+    block = shared_memory.SharedMemory(name=name)
+    arrays = []
+    for shape, offset in layout:
+        array = np.ndarray(shape, dtype=np.float32, buffer=block.buf, offset=offset)
+        array.flags.writeable = False
+        arrays.append(array)
+    half = len(arrays) // 2
+    return block, arrays[:half], arrays[half:]
+
+# This function is the main loop of a worker process. The inputs are:
+# worker: Number of the worker
+# taskAddress: Address the supervisor sends the worker its timesteps on
+# replyAddress: Address to send the replies and load reports to
+# weightsName, layout: Shared memory block of the weights (see shareWeights)
+# batchWindow, maxBatch: Batching of the timesteps, as in connectML.runServer
+# statsInterval: Seconds between load reports
+def runWorker(worker, taskAddress, replyAddress, weightsName, layout, batchWindow, maxBatch, statsInterval):
+    block, weights, biases = mapWeights(weightsName, layout)
+    model = classifierBackends.NumpyBackend(None, maxBatch, (weights, biases))
+    classifierBackends.warmUp(model, maxBatch)
+    context = zmq.Context()
+    tasks = context.socket(zmq.PULL)
+    tasks.connect(taskAddress)
+    replies = context.socket(zmq.PUSH)
+    replies.connect(replyAddress)
+    # Sliding window and reply topic of every stream of the worker
+    streams = {}
+    # Timesteps classified and seconds spent classifying them since the last report
+    timesteps = 0
+    busy = 0.0
+    # The first report tells the supervisor the worker is ready
+    nextReport = time.perf_counter()
+    try:
+        while True:
+            if time.perf_counter() >= nextReport:
+                replies.send_multipart([statsTopic.encode(), msgpack.dumps([worker, len(streams), timesteps, busy])])
+                timesteps = 0
+                busy = 0.0
+                nextReport = time.perf_counter() + statsInterval
+            if not tasks.poll(max(0.0, nextReport - time.perf_counter()) * 1000):
+                continue
+            # Collect the rest of the batch like connectML.runServer
+            pending = [tasks.recv_multipart()]
+            deadline = time.perf_counter() + batchWindow
+            while len(pending) < maxBatch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not tasks.poll(remaining * 1000):
+                    break
+                pending.append(tasks.recv_multipart())
+
+            start = time.perf_counter()
+            decoded = [connectML.decodeAUs(payload) for topic, payload, index in pending]
+            predictedClasses, predictedConfidences = connectML.runMLBatch(model, [AUsCalced[1:] for AUsCalced, oT, streamId in decoded])
+            for (topic, payload, index), (AUsCalced, oT, streamId), predictedClass, predictedConfidence in zip(
+                    pending, decoded, predictedClasses, predictedConfidences):
+                if topic not in streams:
+                    streams[topic] = [connectML.newWindow(), connectML.replyTopic.encode() + topic[len(connectML.auTopic):]]
+                window, replyTopic = streams[topic]
+                reply = connectML.detectTimeStep(predictedClass, predictedConfidence, struct.unpack("<q", index)[0], AUsCalced[0], window)
+                replies.send_multipart([replyTopic, connectML.encodeReply(reply, oT, streamId)])
+            timesteps += len(pending)
+            busy += time.perf_counter() - start
+    except KeyboardInterrupt:
+        pass
+    finally:
+        block.close()
+
+# One worker process as seen by the supervisor
+class Worker:
+    def __init__(self, index, tasks, taskAddress):
+        self.index = index
+        # Socket the worker's timesteps are sent on, kept across restarts
+        self.tasks = tasks
+        self.taskAddress = taskAddress
+        self.process = None
+        self.streams = 0
+        self.restarts = 0
+        # Timesteps dropped because the worker was not connected (restarting)
+        self.dropped = 0
+        # Last load report: [worker, streams, timesteps, seconds classifying]
+        self.load = None
+
+class WorkerPool:
+    # The inputs are the number of workers, the weights and biases of the
+    # classifier and the parsed connectML.py arguments
+    def __init__(self, workerCount, weights, biases, args):
+        self.args = args
+        self.context = zmq.Context()
+        self.replies = self.context.socket(zmq.PULL)
+        replyPort = self.replies.bind_to_random_port("tcp://127.0.0.1")
+        self.replyAddress = "tcp://127.0.0.1:{}".format(replyPort)
+        self.block, self.layout = shareWeights(weights, biases)
+        # Workers are spawned, not forked, so they start the same on every platform
+        self.processes = multiprocessing.get_context("spawn")
+        self.workers = []
+        for index in range(workerCount):
+            tasks = self.context.socket(zmq.PUSH)
+            taskPort = tasks.bind_to_random_port("tcp://127.0.0.1")
+            self.workers.append(Worker(index, tasks, "tcp://127.0.0.1:{}".format(taskPort)))
+        # Worker and number of timesteps so far of every stream
+        self.routes = {}
+        # Whether every worker has reported once, i.e. loaded the weights and warmed up
+        self.ready = False
+
+    def startWorker(self, worker):
+        worker.process = self.processes.Process(target=runWorker, daemon=True, args=(worker.index, worker.taskAddress,
+            self.replyAddress, self.block.name, self.layout, self.args.batch_window / 1000.0, self.args.max_batch,
+            self.args.stats_interval if self.args.stats_interval > 0 else 1.0))
+        worker.process.start()
+
+    def start(self):
+        for worker in self.workers:
+            self.startWorker(worker)
+
+    # This function sends a timestep to the worker of its stream, choosing the
+    # worker with the fewest streams for a new stream
+    def route(self, topic, payload):
+        if topic not in self.routes:
+            worker = min(self.workers, key=lambda worker: worker.streams)
+            worker.streams += 1
+            self.routes[topic] = [worker, 0]
+        route = self.routes[topic]
+        try:
+            route[0].tasks.send_multipart([topic, payload, struct.pack("<q", route[1])], zmq.NOBLOCK)
+        except zmq.Again:
+            route[0].dropped += 1
+        route[1] += 1
+
+    # This function restarts the workers that died
+    def checkWorkers(self):
+        for worker in self.workers:
+            if not worker.process.is_alive():
+                print("Worker {} exited with code {}, restarting it".format(worker.index, worker.process.exitcode))
+                worker.restarts += 1
+                worker.load = None
+                self.startWorker(worker)
+
+    # This function prints and publishes the last load report of every worker
+    def report(self, output, interval):
+        loads = []
+        for worker in self.workers:
+            index, streams, timesteps, busy = worker.load or [worker.index, 0, 0, 0.0]
+            loads.append({u"worker": worker.index, u"streams": worker.streams, u"timestepsPerSecond": timesteps / interval,
+                u"busy": busy / interval, u"restarts": worker.restarts, u"dropped": worker.dropped})
+            print("worker {} pid={} streams={} timesteps/s={:.0f} busy={:.0%} restarts={} dropped={}".format(worker.index,
+                worker.process.pid, worker.streams, timesteps / interval, busy / interval, worker.restarts, worker.dropped))
+        output.send_multipart([statsTopic.encode(), msgpack.dumps(loads)])
+
+    # This function runs the supervisor until interrupted. The inputs are the
+    # subscribe socket of the AUs, the publish socket of the replies and the
+    # readiness heartbeat, None for none.
+    def run(self, input, output, heartbeat=None):
+        poller = zmq.Poller()
+        poller.register(input, zmq.POLLIN)
+        poller.register(self.replies, zmq.POLLIN)
+        now = time.perf_counter()
+        nextHealthCheck = now + healthInterval
+        nextReport = now + self.args.stats_interval
+        while True:
+            now = time.perf_counter()
+            if not self.ready and all(worker.load is not None for worker in self.workers):
+                self.ready = True
+                print("Ready {:.1f}ms after start with {} workers".format((now - startupTiming.startTime) * 1000, len(self.workers)))
+                if heartbeat is not None:
+                    heartbeat.nextBeat = now
+            if self.ready and heartbeat is not None and now >= heartbeat.nextBeat:
+                heartbeat.beat()
+            if now >= nextHealthCheck:
+                self.checkWorkers()
+                nextHealthCheck = now + healthInterval
+            if self.args.stats_interval > 0 and now >= nextReport:
+                self.report(output, self.args.stats_interval)
+                nextReport = now + self.args.stats_interval
+            due = nextHealthCheck if heartbeat is None or not self.ready else min(nextHealthCheck, heartbeat.nextBeat)
+            events = dict(poller.poll(max(0.0, due - time.perf_counter()) * 1000))
+            if input in events:
+                while input.poll(0):
+                    self.route(*input.recv_multipart())
+            if self.replies in events:
+                while self.replies.poll(0):
+                    [topic, payload] = self.replies.recv_multipart()
+                    if topic == statsTopic.encode():
+                        load = msgpack.unpackb(payload)
+                        self.workers[load[0]].load = load
+                    else:
+                        output.send_multipart([topic, payload])
+                        startupTiming.reportFirstReply()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.process.terminate()
+        for worker in self.workers:
+            worker.process.join()
+        self.block.close()
+        self.block.unlink()
+
+# This function runs the worker pool until interrupted. The inputs are the address
+# PSI publishes the AUs on, the publish socket for the replies and the parsed
+# connectML.py arguments.
+def run(address, output, args):
+    weights, biases = classifierBackends.loadWeights(args.model)
+    pool = WorkerPool(args.workers, weights, biases, args)
+    input = zmq.Context().socket(zmq.SUB)
+    input.setsockopt_string(zmq.SUBSCRIBE, connectML.auTopic)
+    input.connect(address)
+    pool.start()
+    heartbeat = connectML.Heartbeat(output, args.heartbeat_interval) if args.heartbeat_interval > 0 else None
+    try:
+        pool.run(input, output, heartbeat)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()